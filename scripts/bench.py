@@ -0,0 +1,370 @@
+"""
+Load and soak tests /api/chat and /api/generate, reporting time to first token,
+inter-token latency and aggregate throughput at each level of concurrency.
+
+    venv/bin/python scripts/bench.py --concurrency 1 2 4 8
+    venv/bin/python scripts/bench.py --target Stub --stream on off --output bench.json
+    venv/bin/python scripts/bench.py --turns 4 --prompt-tokens uniform:64-2048
+    venv/bin/python scripts/bench.py --duration 600 --concurrency 8
+
+Each client holds conversations of `--turns` requests, each turn sending the
+whole conversation so far. The `Stub` target starts a server on the stub engine,
+which generates canned text without a model, to measure the server's own
+overhead. `--output` writes the results as JSON to diff between commits.
+"""
+
+import argparse
+import asyncio
+from dataclasses import dataclass, field
+import json
+import os
+from pathlib import Path
+import random
+import socket
+import subprocess
+import sys
+from time import perf_counter, sleep
+from typing import Any, Dict, List, Optional
+import httpx
+
+TARGETS = {
+    "Mllama": ("http://localhost:8000", "mlx-community/llama-3.3-70B-Instruct-8bit"),
+    "Ollama": ("http://localhost:11434", "llama3.3:70b-instruct-q8_0"),
+    "Stub": (None, "stub"),
+}
+WORDS = (
+    "why is the sky blue explain at a university level with reference to "
+    "rayleigh scattering the solar spectrum and the sensitivity of the eye"
+).split()
+PERCENTILES = [50, 95, 99]
+
+
+@dataclass
+class Sample:
+    """One request, timed from just before it was sent."""
+
+    ok: bool
+    latency: float = 0.0
+    time_to_first_token: Optional[float] = None
+    inter_token_latencies: List[float] = field(default_factory=list)
+    eval_count: int = 0
+    prompt_eval_count: int = 0
+    response: str = ""
+
+
+class PromptLengths:
+    """
+    A distribution of prompt lengths in words, which most tokenizers make about
+    one token each: `fixed:N`, `uniform:MIN-MAX` or `lognormal:MEDIAN`.
+    """
+
+    def __init__(self, spec: str):
+        self.spec = spec
+        kind, _, value = spec.partition(":")
+        if kind == "fixed":
+            self.sample = lambda rng: int(value)
+        elif kind == "uniform":
+            low, high = (int(bound) for bound in value.split("-"))
+            self.sample = lambda rng: rng.randint(low, high)
+        elif kind == "lognormal":
+            median = int(value)
+            self.sample = lambda rng: max(1, int(median * rng.lognormvariate(0, 1)))
+        else:
+            raise argparse.ArgumentTypeError(f"Invalid prompt length: {spec}")
+
+    def prompt(self, rng: random.Random) -> str:
+        return " ".join(rng.choice(WORDS) for _ in range(self.sample(rng)))
+
+    def __str__(self) -> str:
+        return self.spec
+
+
+async def request(
+    client: httpx.AsyncClient,
+    url: str,
+    model: str,
+    endpoint: str,
+    messages: List[Dict[str, str]],
+    stream: bool,
+    max_tokens: int,
+) -> Sample:
+    options = {"max_tokens": max_tokens, "num_predict": max_tokens}
+    if endpoint == "chat":
+        body: Dict[str, Any] = {"model": model, "messages": messages}
+    else:
+        # The conversation so far, as a single prompt
+        body = {
+            "model": model,
+            "prompt": "\n\n".join(message["content"] for message in messages),
+        }
+    body.update(options=options, stream=stream)
+
+    start = perf_counter()
+    sample = Sample(ok=False)
+    last_chunk_time = None
+    try:
+        async with client.stream("POST", f"{url}/api/{endpoint}", json=body) as res:
+            res.raise_for_status()
+            async for line in res.aiter_lines():
+                if not line:
+                    continue
+                chunk = json.loads(line)
+                text = (
+                    chunk.get("message", {}).get("content", "")
+                    if endpoint == "chat"
+                    else chunk.get("response", "")
+                )
+                if text:
+                    now = perf_counter()
+                    if last_chunk_time is None:
+                        sample.time_to_first_token = now - start
+                    else:
+                        sample.inter_token_latencies.append(now - last_chunk_time)
+                    last_chunk_time = now
+                    sample.response += text
+                if chunk.get("done"):
+                    sample.eval_count = chunk.get("eval_count") or 0
+                    sample.prompt_eval_count = chunk.get("prompt_eval_count") or 0
+                    sample.ok = True
+    except (httpx.HTTPError, json.JSONDecodeError) as e:
+        print(f"    error: {e!r}", file=sys.stderr)
+    sample.latency = perf_counter() - start
+    return sample
+
+
+async def client_loop(
+    client: httpx.AsyncClient,
+    args: argparse.Namespace,
+    url: str,
+    model: str,
+    endpoint: str,
+    stream: bool,
+    seed: int,
+    deadline: Optional[float],
+) -> List[Sample]:
+    """Holds conversations until it has held `--requests` of them or the deadline passes."""
+    rng = random.Random(seed)
+    samples = []
+    conversations = 0
+    while perf_counter() < deadline if deadline else conversations < args.requests:
+        messages: List[Dict[str, str]] = []
+        for _ in range(args.turns):
+            messages.append({"role": "user", "content": args.prompt_tokens.prompt(rng)})
+            sample = await request(
+                client, url, model, endpoint, messages, stream, args.max_tokens
+            )
+            samples.append(sample)
+            if not sample.ok:
+                break
+            messages.append({"role": "assistant", "content": sample.response})
+        conversations += 1
+    return samples
+
+
+def percentiles(values: List[float]) -> Optional[Dict[str, float]]:
+    """Linearly interpolated percentiles, in milliseconds."""
+    if not values:
+        return None
+    values = sorted(values)
+    result = {}
+    for p in PERCENTILES:
+        position = (len(values) - 1) * p / 100
+        low = int(position)
+        high = min(low + 1, len(values) - 1)
+        value = values[low] + (values[high] - values[low]) * (position - low)
+        result[f"p{p}"] = round(value * 1000, 3)
+    return result
+
+
+async def run(
+    args: argparse.Namespace,
+    url: str,
+    model: str,
+    endpoint: str,
+    stream: bool,
+    concurrency: int,
+) -> Dict[str, Any]:
+    async with httpx.AsyncClient(timeout=None) as client:
+        # Make sure the model is loaded so load time doesn't skew the first round.
+        await request(
+            client, url, model, endpoint, [{"role": "user", "content": "hi"}], False, 1
+        )
+
+        start = perf_counter()
+        deadline = start + args.duration if args.duration else None
+        results = await asyncio.gather(
+            *[
+                client_loop(
+                    client, args, url, model, endpoint, stream, args.seed + i, deadline
+                )
+                for i in range(concurrency)
+            ]
+        )
+        elapsed = perf_counter() - start
+
+    samples = [sample for result in results for sample in result]
+    ok = [sample for sample in samples if sample.ok]
+    eval_count = sum(sample.eval_count for sample in ok)
+    return {
+        "endpoint": endpoint,
+        "stream": stream,
+        "concurrency": concurrency,
+        "requests": len(samples),
+        "errors": len(samples) - len(ok),
+        "wall_seconds": round(elapsed, 3),
+        "requests_per_second": round(len(ok) / elapsed, 3),
+        "tokens_per_second": round(eval_count / elapsed, 3),
+        "prompt_eval_count": sum(sample.prompt_eval_count for sample in ok),
+        "eval_count": eval_count,
+        # Without streaming, the first token arrives with the last.
+        "time_to_first_token_ms": percentiles(
+            [
+                sample.time_to_first_token
+                for sample in ok
+                if sample.time_to_first_token is not None
+            ]
+        ),
+        # Between streamed chunks, which may hold several tokens when the
+        # server coalesces them
+        "inter_token_latency_ms": percentiles(
+            [latency for sample in ok for latency in sample.inter_token_latencies]
+        ),
+        "latency_ms": percentiles([sample.latency for sample in ok]),
+    }
+
+
+def report(result: Dict[str, Any]):
+    def format_percentiles(values: Optional[Dict[str, float]]) -> str:
+        if values is None:
+            return "-"
+        return "/".join(f"{value:.1f}" for value in values.values())
+
+    print(
+        f"  {result['endpoint']:>8} stream={'on' if result['stream'] else 'off':<3} "
+        f"concurrency {result['concurrency']:>3}: "
+        f"{result['tokens_per_second']:8.1f} tokens/s, "
+        f"TTFT {format_percentiles(result['time_to_first_token_ms'])} ms, "
+        f"ITL {format_percentiles(result['inter_token_latency_ms'])} ms "
+        f"(p50/p95/p99), "
+        f"{result['errors']} errors"
+    )
+
+
+def start_stub_server() -> tuple[subprocess.Popen, str]:
+    """Starts a server on the stub engine, on a free port, and waits until it is up."""
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+    src = Path(__file__).resolve().parent.parent / "src"
+    server = subprocess.Popen(
+        [
+            sys.executable,
+            "-m",
+            "uvicorn",
+            "mllama.main:app",
+            "--app-dir",
+            str(src),
+            "--port",
+            str(port),
+            "--log-level",
+            "warning",
+            "--no-access-log",
+        ],
+        env={**os.environ, "MLLAMA_ENGINE": "stub"},
+    )
+    url = f"http://127.0.0.1:{port}"
+    for _ in range(300):
+        try:
+            httpx.get(url).raise_for_status()
+            return server, url
+        except httpx.HTTPError:
+            if server.poll() is not None:
+                break
+            sleep(0.1)
+    server.kill()
+    raise RuntimeError("The stub server didn't start")
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--target", choices=TARGETS, nargs="+", default=["Mllama"])
+    parser.add_argument("--url", help="override the target's base URL")
+    parser.add_argument("--model", help="override the target's model")
+    parser.add_argument(
+        "--endpoint", choices=["chat", "generate"], nargs="+", default=["chat"]
+    )
+    parser.add_argument("--stream", choices=["on", "off"], nargs="+", default=["on"])
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 2, 4, 8])
+    parser.add_argument("--max-tokens", type=int, default=256)
+    parser.add_argument(
+        "--prompt-tokens",
+        type=PromptLengths,
+        default=PromptLengths("fixed:16"),
+        help="fixed:N, uniform:MIN-MAX or lognormal:MEDIAN (default: fixed:16)",
+    )
+    parser.add_argument(
+        "--turns", type=int, default=1, help="requests per conversation"
+    )
+    parser.add_argument(
+        "--requests", type=int, default=1, help="conversations per client"
+    )
+    parser.add_argument(
+        "--duration",
+        type=float,
+        help="soak for this many seconds instead of holding --requests conversations",
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="write the results as JSON to this file")
+    args = parser.parse_args()
+
+    results = []
+    for name in args.target:
+        url, model = TARGETS[name]
+        model = args.model or model
+        server = None
+        if name == "Stub" and not args.url:
+            server, url = start_stub_server()
+        url = args.url or url
+        try:
+            print(f"Testing {name} ({model} at {url})")
+            for endpoint in args.endpoint:
+                for stream in args.stream:
+                    for concurrency in args.concurrency:
+                        result = asyncio.run(
+                            run(args, url, model, endpoint, stream == "on", concurrency)
+                        )
+                        report(result)
+                        results.append({"target": name, "model": model, **result})
+        finally:
+            if server is not None:
+                server.terminate()
+                server.wait()
+
+    if args.output:
+        config = {
+            "commit": git_commit(),
+            "max_tokens": args.max_tokens,
+            "prompt_tokens": str(args.prompt_tokens),
+            "turns": args.turns,
+            "requests": args.requests,
+            "duration": args.duration,
+            "seed": args.seed,
+        }
+        with open(args.output, "w") as file:
+            json.dump({"config": config, "results": results}, file, indent=2)
+            file.write("\n")
+
+
+if __name__ == "__main__":
+    main()
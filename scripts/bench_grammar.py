@@ -0,0 +1,105 @@
+"""
+Compares constrained decoding with a cached grammar, with a grammar compiled for
+every request as before the cache, and unconstrained decoding, in process.
+
+    venv/bin/python scripts/bench_grammar.py --model mlx-community/Llama-3.2-1B-Instruct-4bit
+"""
+
+import argparse
+import asyncio
+from datetime import datetime, timedelta
+import json
+from statistics import median
+from time import time_ns
+from typing import Any, Dict, Optional
+from mllama.events import ChunkEvent, EndEvent
+from mllama.grammar import GrammarCache
+from mllama.model import Model
+
+SCHEMA = {
+    "type": "object",
+    "properties": {
+        "name": {"type": "string"},
+        "age": {"type": "integer"},
+        "email": {"type": "string", "format": "email"},
+        "tags": {"type": "array", "items": {"type": "string"}, "maxItems": 4},
+    },
+    "required": ["name", "age", "email", "tags"],
+}
+PROMPT = (
+    "Extract the person from this text as JSON: Ada Lovelace, 36, "
+    "ada@example.com, is a mathematician and writer."
+)
+
+
+async def generate(
+    model: Model, format: Optional[Dict[str, Any]], max_tokens: int
+) -> Dict[str, float]:
+    start_time = time_ns()
+    events = await model.generate(
+        start_time,
+        model.template([{"role": "user", "content": PROMPT}]),
+        {"max_tokens": max_tokens},
+        format,
+        "generate",
+    )
+    first_token_time = None
+    async for event in events:
+        if isinstance(event, ChunkEvent) and first_token_time is None:
+            first_token_time = time_ns()
+        elif isinstance(event, EndEvent):
+            return {
+                "ttft": ((first_token_time or time_ns()) - start_time) / 1e6,
+                "tokens_per_second": (
+                    event.eval_count / (event.eval_duration / 1e9)
+                    if event.eval_duration
+                    else 0.0
+                ),
+            }
+    raise RuntimeError("Generation ended without an EndEvent")
+
+
+async def run(args: argparse.Namespace):
+    model = await asyncio.to_thread(
+        Model.create, args.model, datetime.now() + timedelta(minutes=5)
+    )
+    schema = json.load(open(args.schema)) if args.schema else SCHEMA
+    # Warm up the model before timing anything
+    await generate(model, None, 8)
+
+    cases = [
+        ("unconstrained", None, model.grammars),
+        # A cache too small to hold anything compiles every request's grammar.
+        ("uncached", schema, GrammarCache(0)),
+        ("cached", schema, model.grammars),
+    ]
+    for name, format, grammars in cases:
+        model.grammars = grammars
+        if name == "cached":
+            # Compiles the grammar, so the timed requests all hit the cache
+            await generate(model, format, 1)
+        samples = [
+            await generate(model, format, args.max_tokens) for _ in range(args.requests)
+        ]
+        print(
+            f"  {name:>13}: "
+            f"TTFT {median(sample['ttft'] for sample in samples):8.1f} ms median, "
+            f"{median(sample['tokens_per_second'] for sample in samples):8.1f} "
+            "tokens/s median"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--model", default="mlx-community/Llama-3.2-1B-Instruct-4bit")
+    parser.add_argument("--schema", help="a JSON schema file to constrain output to")
+    parser.add_argument("--requests", type=int, default=5)
+    parser.add_argument("--max-tokens", type=int, default=128)
+    args = parser.parse_args()
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+"""
+Times importing the server in fresh interpreters, the bulk of its startup before
+it can answer `/`, and fails if the median exceeds `--max-seconds`.
+
+    venv/bin/python scripts/bench_startup.py
+    venv/bin/python scripts/bench_startup.py --runs 10 --max-seconds 1.5
+"""
+
+import argparse
+import os
+from pathlib import Path
+from statistics import median
+import subprocess
+import sys
+
+SRC = Path(__file__).resolve().parent.parent / "src"
+PROBE = """
+import time
+start = time.perf_counter()
+import mllama.main
+print(time.perf_counter() - start)
+"""
+
+
+def run(*args: str) -> subprocess.CompletedProcess:
+    return subprocess.run(
+        [sys.executable, *args],
+        capture_output=True,
+        text=True,
+        check=True,
+        env={**os.environ, "PYTHONPATH": str(SRC)},
+    )
+
+
+def slowest_imports(count: int) -> list[tuple[int, str]]:
+    """The modules mllama.main imports that take longest, in microseconds including their own imports."""
+    stderr = run("-X", "importtime", "-c", "import mllama.main").stderr
+    imports: list[tuple[int, str]] = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line.split("|")
+        # Each level of nesting is indented by two more spaces, and a module's
+        # imports are listed before it.
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        if depth == 0:
+            if name.strip() == "mllama.main":
+                break
+            imports = []
+        elif depth == 1:
+            imports.append((int(cumulative), name.strip()))
+    return sorted(imports, reverse=True)[:count]
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--max-seconds", type=float, default=1.5)
+    args = parser.parse_args()
+
+    # The first run warms the bytecode and filesystem caches.
+    run("-c", PROBE)
+    seconds = median(float(run("-c", PROBE).stdout) for _ in range(args.runs))
+    print(f"Importing mllama.main takes {seconds * 1000:.0f} ms (median)")
+    for cumulative, name in slowest_imports(5):
+        print(f"  {cumulative / 1000:8.1f} ms  {name}")
+
+    if seconds > args.max_seconds:
+        print(f"Slower than {args.max_seconds}s", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,262 @@
+from datetime import datetime
+import json
+import os
+from pathlib import Path
+import threading
+from typing import Any, Dict, List, Optional
+from pydantic import BaseModel, ValidationError
+from mllama.config import hub_cache
+from mllama.logger import logger
+from mllama.registry import estimate_size
+
+# How often `watch` checks the cache for changes, in seconds
+REFRESH_INTERVAL = 5
+
+DTYPE_BITS = {"float32": 32, "float16": 16, "bfloat16": 16}
+
+
+class CatalogEntry(BaseModel):
+    name: str
+    # The snapshot's commit hash, as in /api/ps
+    digest: str
+    modified_at: str
+    size: int
+    format: str
+    family: str
+    families: Optional[List[str]]
+    parameter_size: str
+    quantization_level: str
+    # The mtimes the entry was read at. Downloads and deletions change them.
+    key: List[int]
+
+
+class CatalogIndex(BaseModel):
+    cache_dir: str
+    # By the repo's directory in the cache
+    entries: Dict[str, CatalogEntry]
+
+
+class Catalog:
+    """
+    The models in the Hugging Face cache, indexed for /api/tags.
+
+    `refresh` only stats each repo's refs, blobs and snapshots, and reads a
+    repo's config and sizes again when those changed, so a cache with hundreds
+    of snapshots is read once rather than on every request. The index is saved
+    to `index_file`, so a restart doesn't read them again either.
+    """
+
+    cache_dir: Path
+    index_file: Optional[Path]
+    entries: Dict[str, CatalogEntry]
+    # The entries sorted by name, replaced whole on each change
+    listing: List[CatalogEntry]
+    refreshed: bool
+
+    def __init__(self, cache_dir: str, index_file: Optional[str] = None):
+        self.cache_dir = Path(cache_dir)
+        self.index_file = Path(index_file) if index_file else None
+        self.entries = {}
+        self.listing = []
+        self.refreshed = False
+        self.lock = threading.Lock()
+
+        if self.index_file is not None and self.index_file.exists():
+            try:
+                index = CatalogIndex.model_validate_json(self.index_file.read_bytes())
+            except (OSError, ValidationError):
+                logger.exception(f"catalog - ignoring index {self.index_file}")
+            else:
+                if index.cache_dir == str(self.cache_dir):
+                    self.entries = index.entries
+
+    def models(self) -> List[CatalogEntry]:
+        """The models as of the last refresh, refreshing first if there was none."""
+        if not self.refreshed:
+            self.refresh()
+        return self.listing
+
+    def refresh(self):
+        """Brings the index up to date, reading only the repos that changed."""
+        with self.lock:
+            entries = {}
+            changed = False
+            try:
+                repos = [
+                    entry
+                    for entry in os.scandir(self.cache_dir)
+                    if entry.name.startswith("models--") and entry.is_dir()
+                ]
+            except FileNotFoundError:
+                repos = []
+            for repo in repos:
+                try:
+                    key = _key(Path(repo.path))
+                    entry = self.entries.get(repo.name)
+                    if entry is None or entry.key != key:
+                        entry = _read(Path(repo.path), key)
+                        changed = True
+                except OSError:
+                    # Deleted in the meantime
+                    logger.exception(f"catalog - {repo.name} - read error")
+                    continue
+                if entry is not None:
+                    entries[repo.name] = entry
+
+            if changed or entries.keys() != self.entries.keys() or not self.refreshed:
+                self.entries = entries
+                self.listing = sorted(entries.values(), key=lambda entry: entry.name)
+                self.save()
+            self.refreshed = True
+
+    def save(self):
+        if self.index_file is None:
+            return
+        index = CatalogIndex(cache_dir=str(self.cache_dir), entries=self.entries)
+        try:
+            self.index_file.parent.mkdir(parents=True, exist_ok=True)
+            partial = self.index_file.with_suffix(".partial")
+            partial.write_text(index.model_dump_json())
+            os.replace(partial, self.index_file)
+        except OSError:
+            logger.exception(f"catalog - failed to save index {self.index_file}")
+
+
+def _mtime(path: Path) -> int:
+    try:
+        return path.stat().st_mtime_ns
+    except FileNotFoundError:
+        return 0
+
+
+def _key(repo: Path) -> List[int]:
+    """
+    The mtimes of what a download or deletion changes: `refs/main` when the
+    revision moves, `blobs` when a file finishes downloading, and the snapshots.
+    """
+    key = [_mtime(repo / "refs" / "main"), _mtime(repo / "blobs")]
+    snapshots = repo / "snapshots"
+    key.append(_mtime(snapshots))
+    if snapshots.is_dir():
+        key.extend(_mtime(snapshot) for snapshot in sorted(snapshots.iterdir()))
+    return key
+
+
+def _read(repo: Path, key: List[int]) -> Optional[CatalogEntry]:
+    """Reads a repo's entry, or None until it has a snapshot."""
+    snapshots = repo / "snapshots"
+    refs = repo / "refs" / "main"
+    revision = refs.read_text().strip() if refs.exists() else None
+    if revision is None or not (snapshots / revision).is_dir():
+        candidates = (
+            [path for path in snapshots.iterdir() if path.is_dir()]
+            if snapshots.is_dir()
+            else []
+        )
+        if not candidates:
+            return None
+        revision = max(candidates, key=lambda path: path.stat().st_mtime).name
+    snapshot = snapshots / revision
+
+    blobs = [
+        entry.stat()
+        for entry in os.scandir(repo / "blobs")
+        if not entry.name.endswith(".incomplete")
+    ]
+    modified_at = max(
+        (blob.st_mtime for blob in blobs), default=snapshot.stat().st_mtime
+    )
+    suffixes = {path.suffix for path in snapshot.iterdir()}
+    config = _config(snapshot)
+    family = str(config.get("model_type", ""))
+
+    logger.info(f"catalog - {repo.name} - read {revision}")
+    return CatalogEntry(
+        name=repo.name.removeprefix("models--").replace("--", "/"),
+        digest=revision,
+        modified_at=datetime.fromtimestamp(modified_at).astimezone().isoformat(),
+        size=sum(blob.st_size for blob in blobs),
+        format=(
+            "safetensors"
+            if ".safetensors" in suffixes
+            else "gguf" if ".gguf" in suffixes else ""
+        ),
+        family=family,
+        families=[family] if family else None,
+        parameter_size=parameter_size(config, estimate_size(str(snapshot))),
+        quantization_level=quantization_level(config),
+        key=key,
+    )
+
+
+def _config(snapshot: Path) -> Dict[str, Any]:
+    try:
+        config = json.loads((snapshot / "config.json").read_text())
+    except (OSError, ValueError):
+        return {}
+    return config if isinstance(config, dict) else {}
+
+
+def _quantization(config: Dict[str, Any]) -> Dict[str, Any]:
+    """MLX's quantization settings, such as `{"bits": 4, "group_size": 64}`."""
+    quantization = config.get("quantization") or config.get("quantization_config")
+    return quantization if isinstance(quantization, dict) else {}
+
+
+def quantization_level(config: Dict[str, Any]) -> str:
+    """Like Ollama's, such as `Q4` for 4-bit weights or `BF16` for unquantized ones."""
+    bits = _quantization(config).get("bits")
+    if bits:
+        return f"Q{bits}"
+    dtype = config.get("torch_dtype")
+    if dtype in DTYPE_BITS:
+        return dtype.replace("bfloat", "BF").replace("float", "F")
+    return "unknown"
+
+
+def parameter_size(config: Dict[str, Any], weights_size: int) -> str:
+    """
+    Estimates the parameter count, such as `3.2B`, from the size of the weights
+    and the bits per weight. Quantized weights also store a 16-bit scale and
+    bias per group.
+    """
+    quantization = _quantization(config)
+    if quantization.get("bits"):
+        bits = quantization["bits"] + 32 / quantization.get("group_size", 64)
+    else:
+        bits = DTYPE_BITS.get(str(config.get("torch_dtype")), 16)
+    count = weights_size * 8 / bits
+    if count >= 1e9:
+        return f"{count / 1e9:.1f}B"
+    return f"{count / 1e6:.0f}M"
+
+
+_catalog: Optional[Catalog] = None
+
+
+def catalog() -> Catalog:
+    """
+    The catalog of the Hugging Face cache, indexed in MLLAMA_CATALOG_FILE
+    (default: `~/.cache/mllama/catalog.json`).
+    """
+    global _catalog
+    if _catalog is None:
+        _catalog = Catalog(
+            hub_cache(),
+            os.environ.get(
+                "MLLAMA_CATALOG_FILE",
+                os.path.expanduser("~/.cache/mllama/catalog.json"),
+            ),
+        )
+    return _catalog
+
+
+def watch(stop: threading.Event):
+    """Refreshes the catalog until `stop` is set, so /api/tags only reads it."""
+    while True:
+        try:
+            catalog().refresh()
+        except Exception:
+            logger.exception("catalog - refresh error")
+        if stop.wait(REFRESH_INTERVAL):
+            break
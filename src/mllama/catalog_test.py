@@ -0,0 +1,90 @@
+import json
+import os
+import shutil
+from mllama import catalog as catalog_module
+from mllama.catalog import Catalog, parameter_size, quantization_level
+
+REVISION = "0123456789abcdef0123456789abcdef01234567"
+
+
+def add_repo(cache_dir, name, config, weights_size=1000):
+    repo = cache_dir / f"models--{name.replace('/', '--')}"
+    blobs = repo / "blobs"
+    snapshot = repo / "snapshots" / REVISION
+    blobs.mkdir(parents=True)
+    snapshot.mkdir(parents=True)
+    (repo / "refs").mkdir()
+    (repo / "refs" / "main").write_text(REVISION)
+    for blob, filename, content in [
+        ("a", "config.json", json.dumps(config).encode()),
+        ("b", "model.safetensors", b"0" * weights_size),
+    ]:
+        (blobs / blob).write_bytes(content)
+        (snapshot / filename).symlink_to(blobs / blob)
+    return repo
+
+
+def test_reads_metadata_from_config(tmp_path):
+    add_repo(
+        tmp_path,
+        "mlx-community/Llama-3.2-3B-Instruct-4bit",
+        {"model_type": "llama", "quantization": {"bits": 4, "group_size": 64}},
+    )
+
+    [entry] = Catalog(str(tmp_path)).models()
+
+    assert entry.name == "mlx-community/Llama-3.2-3B-Instruct-4bit"
+    assert entry.digest == REVISION
+    assert entry.format == "safetensors"
+    assert entry.family == "llama"
+    assert entry.families == ["llama"]
+    assert entry.quantization_level == "Q4"
+    assert entry.size > 1000
+
+
+def test_metadata():
+    assert quantization_level({"torch_dtype": "bfloat16"}) == "BF16"
+    assert quantization_level({}) == "unknown"
+    assert parameter_size({"torch_dtype": "bfloat16"}, 6_400_000_000) == "3.2B"
+    # 4 bits per weight plus a 16-bit scale and bias per 64
+    assert parameter_size({"quantization": {"bits": 4}}, 225_000_000) == "400M"
+
+
+def test_only_reads_repos_that_changed(tmp_path, monkeypatch):
+    index_file = tmp_path / "catalog.json"
+    cache_dir = tmp_path / "hub"
+    cache_dir.mkdir()
+    unchanged = add_repo(cache_dir, "org/unchanged", {"model_type": "llama"})
+    changed = add_repo(cache_dir, "org/changed", {"model_type": "qwen2"})
+    catalog = Catalog(str(cache_dir), str(index_file))
+    catalog.refresh()
+
+    reads = []
+    read = catalog_module._read
+    monkeypatch.setattr(
+        catalog_module,
+        "_read",
+        lambda repo, key: reads.append(repo.name) or read(repo, key),
+    )
+    catalog.refresh()
+    assert reads == []
+
+    # Another file finishes downloading.
+    (changed / "blobs" / "c").write_bytes(b"0" * 100)
+    os.utime(changed / "blobs", ns=(0, 10**18))
+    catalog.refresh()
+    assert reads == ["models--org--changed"]
+    assert [entry.name for entry in catalog.models()] == [
+        "org/changed",
+        "org/unchanged",
+    ]
+
+    # A restart reads the index rather than the repos.
+    restarted = Catalog(str(cache_dir), str(index_file))
+    restarted.refresh()
+    assert reads == ["models--org--changed"]
+    assert restarted.models() == catalog.models()
+
+    shutil.rmtree(unchanged)
+    restarted.refresh()
+    assert [entry.name for entry in restarted.models()] == ["org/changed"]
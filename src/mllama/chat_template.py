@@ -0,0 +1,150 @@
+from datetime import date
+import hashlib
+import json
+from pathlib import Path
+from typing import Any, Dict, List
+from mllama.logger import logger
+from mllama.lru import LRUCache
+
+# Used by models whose tokenizer doesn't define a chat template
+CHATML = (Path(__file__).parent / "templates" / "chatml.jinja").read_text()
+
+# Rendered segments are small, so this holds the recent history of many chats.
+SEGMENT_CACHE_SIZE = 64 * 2**20
+
+# Conversations the incremental renderer and tokenizer memo are checked against
+# when a model loads
+PROBES: List[List[Dict[str, Any]]] = [
+    [
+        {
+            "role": "system",
+            "content": (
+                "You are a helpful assistant. Answer concisely, in English, and "
+                "cite sources where you can. Format code in Markdown blocks:\n\n"
+                "```python\nprint('hello, world')\n```\n\n"
+                "Prices are in USD ($1,234.56), dates in ISO 8601 (2024-12-31), "
+                "and temperatures in °C. Don't guess — say \"I don't know.\"  "
+            ),
+        },
+        {"role": "user", "content": "Why is the sky blue?"},
+        {"role": "assistant", "content": "Rayleigh scattering.\n"},
+        {"role": "user", "content": " And sunsets? "},
+    ],
+    [
+        {"role": "user", "content": "Hi"},
+        {"role": "assistant", "content": "<think>A greeting.</think>Hello!"},
+        {"role": "user", "content": "Bye"},
+    ],
+]
+
+
+class ChatTemplate:
+    """
+    A model's chat template, compiled once when the model loads.
+
+    Most templates render a conversation as the concatenation of one segment per
+    message, where a segment depends only on the message and the roles of the
+    messages before it. When a template behaves this way on `PROBES`, segments
+    are rendered against placeholder history with empty contents and cached, so
+    each request only renders the messages appended since the last one.
+    Templates that don't, such as ones that render the last message specially,
+    are rendered in full.
+    """
+
+    incremental: bool
+
+    def __init__(self, tokenizer: Any):
+        # Imported here since transformers takes most of a second to import
+        from transformers.utils.chat_template_utils import _compile_jinja_template
+
+        source = tokenizer.chat_template or CHATML
+        if isinstance(source, dict):
+            source = source["default"]
+        self.template = _compile_jinja_template(source)
+        self.variables = dict(tokenizer.special_tokens_map)
+        self.segments: LRUCache[str, str] = LRUCache(SEGMENT_CACHE_SIZE)
+        self.incremental = False
+        try:
+            self.incremental = all(
+                self._render_incremental(probe)
+                == self._render(probe, add_generation_prompt=True)
+                for probe in PROBES
+            )
+        except Exception as e:
+            logger.info(f"chat template - incremental rendering unavailable - {e}")
+
+    def render(self, messages: List[Dict[str, Any]]) -> str:
+        """Renders `messages` followed by the prompt for the assistant's reply."""
+        if self.incremental:
+            try:
+                return self._render_incremental(messages)
+            except ValueError:
+                pass
+        return self._render(messages, add_generation_prompt=True)
+
+    def _render(
+        self, messages: List[Dict[str, Any]], add_generation_prompt: bool
+    ) -> str:
+        return self.template.render(
+            messages=messages,
+            tools=None,
+            documents=None,
+            add_generation_prompt=add_generation_prompt,
+            **self.variables,
+        )
+
+    def _render_incremental(self, messages: List[Dict[str, Any]]) -> str:
+        placeholders = [{**message, "content": ""} for message in messages]
+        # Identifies the placeholder history before each message. Templates may
+        # include the current date.
+        history = hashlib.sha256(date.today().isoformat().encode())
+        parts = []
+        for i, message in enumerate(messages):
+            key = f"{history.hexdigest()}:{_hash(message)}"
+            segment = self.segments.get(key)
+            if segment is None:
+                segment = self._extend(placeholders[:i], [message], False)
+                self.segments.put(key, segment, len(segment))
+            parts.append(segment)
+            history.update(_hash(placeholders[i]).encode())
+
+        key = f"{history.hexdigest()}:generation prompt"
+        prompt = self.segments.get(key)
+        if prompt is None:
+            prompt = self._extend(placeholders, [], True)
+            self.segments.put(key, prompt, len(prompt))
+        parts.append(prompt)
+        return "".join(parts)
+
+    def _extend(
+        self,
+        placeholders: List[Dict[str, Any]],
+        messages: List[Dict[str, Any]],
+        add_generation_prompt: bool,
+    ) -> str:
+        """Renders the text `messages` add after `placeholders`."""
+        before = self._render(placeholders, False) if placeholders else ""
+        after = self._render(placeholders + messages, add_generation_prompt)
+        if not after.startswith(before):
+            raise ValueError("template does not render history as a prefix")
+        return after[len(before) :]
+
+
+def _hash(message: Dict[str, Any]) -> str:
+    text = json.dumps(message, sort_keys=True, default=str)
+    return hashlib.sha256(text.encode()).hexdigest()
+
+
+def with_images(message: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Moves a message's `images` into its content as an image part per image
+    ahead of the text, which is where vision models' chat templates put their
+    image tokens. The images themselves go to the engine separately.
+    """
+    images = message.get("images")
+    message = {key: value for key, value in message.items() if key != "images"}
+    if images:
+        message["content"] = [{"type": "image"} for _ in images] + [
+            {"type": "text", "text": message.get("content") or ""}
+        ]
+    return message
@@ -0,0 +1,74 @@
+from types import SimpleNamespace
+from mllama.chat_template import ChatTemplate, with_images
+
+CONVERSATION = [
+    {"role": "system", "content": "You are a helpful assistant. " * 100},
+    {"role": "user", "content": "Why is the sky blue?"},
+    {"role": "assistant", "content": "Rayleigh scattering."},
+    {"role": "user", "content": "And sunsets?"},
+    {"role": "assistant", "content": "The light travels through more air."},
+    {"role": "user", "content": "Thanks!"},
+]
+
+# Only shows the content of the last message, so it can't be rendered incrementally
+LAST_MESSAGE_TEMPLATE = (
+    "{% for message in messages %}"
+    "{% if loop.last %}{{ message['content'] }}{% else %}{{ message['role'] }}{% endif %}"
+    "{% endfor %}"
+)
+
+# Like Llava's, which puts an image token for each image part
+VISION_TEMPLATE = (
+    "{% for message in messages %}{{ message['role'] }}: "
+    "{% if message['content'] is string %}{{ message['content'] }}"
+    "{% else %}{% for part in message['content'] %}"
+    "{% if part['type'] == 'image' %}<image>{% else %}{{ part['text'] }}{% endif %}"
+    "{% endfor %}{% endif %}{{ '\\n' }}{% endfor %}"
+)
+
+
+def tokenizer(chat_template=None):
+    return SimpleNamespace(
+        chat_template=chat_template, special_tokens_map={"bos_token": "<s>"}
+    )
+
+
+def test_incremental_matches_full_render():
+    template = ChatTemplate(tokenizer())
+
+    assert template.incremental
+    for length in range(1, len(CONVERSATION) + 1):
+        messages = CONVERSATION[:length]
+        assert template.render(messages) == template._render(
+            messages, add_generation_prompt=True
+        )
+
+
+def test_reuses_segments():
+    template = ChatTemplate(tokenizer())
+    template.render(CONVERSATION[:4])
+    cached = len(template.segments)
+
+    template.render(CONVERSATION[:6])
+
+    # Two new messages and a new generation prompt
+    assert len(template.segments) == cached + 3
+
+
+def test_falls_back_to_full_render():
+    template = ChatTemplate(tokenizer(LAST_MESSAGE_TEMPLATE))
+
+    assert not template.incremental
+    assert template.render(CONVERSATION) == "systemuserassistantuserassistantThanks!"
+
+
+def test_renders_image_parts():
+    template = ChatTemplate(tokenizer(VISION_TEMPLATE))
+    messages = [
+        {"role": "user", "content": "Compare these", "images": ["a", "b"]},
+        {"role": "assistant", "content": "They match.", "images": []},
+    ]
+
+    assert template.render([with_images(message) for message in messages]) == (
+        "user: <image><image>Compare these\nassistant: They match.\n"
+    )
@@ -0,0 +1,45 @@
+import os
+import re
+from typing import Dict
+
+SIZE_UNITS = {"": 1, "KB": 2**10, "MB": 2**20, "GB": 2**30, "TB": 2**40}
+
+
+def parse_size(value: str) -> int:
+    """Parses a size in bytes such as `512MB` or `4GB`."""
+    match = re.fullmatch(r"\s*(\d+(?:\.\d+)?)\s*([KMGT]?B)?\s*", value, re.IGNORECASE)
+    if match is None:
+        raise ValueError(f"Invalid size: {value}")
+    return int(float(match[1]) * SIZE_UNITS[(match[2] or "").upper()])
+
+
+def get_int(name: str, default: int) -> int:
+    """Reads an integer from the environment. Read at call time so `.env` files are honored."""
+    return int(os.environ.get(name, default))
+
+
+def get_size(name: str, default: str) -> int:
+    """Reads a size in bytes from the environment, see `parse_size`."""
+    return parse_size(os.environ.get(name, default))
+
+
+def get_mapping(name: str) -> Dict[str, str]:
+    """Reads a mapping written as `key=value,key=value` from the environment."""
+    mapping = {}
+    for item in os.environ.get(name, "").split(","):
+        if item.strip():
+            key, separator, value = item.partition("=")
+            if not separator:
+                raise ValueError(f"Invalid {name} entry: {item}")
+            mapping[key.strip()] = value.strip()
+    return mapping
+
+
+def hub_cache() -> str:
+    """
+    The Hugging Face cache that models are pulled to and loaded from. Read at
+    call time, unlike huggingface_hub, so `.env` files are honored.
+    """
+    import huggingface_hub
+
+    return os.environ.get("HF_HUB_CACHE") or huggingface_hub.constants.HF_HUB_CACHE
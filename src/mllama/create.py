@@ -0,0 +1,186 @@
+import asyncio
+import functools
+import hashlib
+import os
+from pathlib import Path
+import re
+import shutil
+from typing import Any, AsyncGenerator, Callable, Dict, Optional
+import uuid
+from fastapi import HTTPException
+from huggingface_hub.file_download import repo_folder_name
+from mllama import config, engines
+from mllama.catalog import catalog
+from mllama.logger import logger
+from mllama.model import Model
+
+# Ollama's quantization types, such as `q4_K_M` or `q8_0`, by their bits per weight
+QUANTIZATION = re.compile(r"q(\d)(_\w+)?", re.IGNORECASE)
+# The bits per weight MLX quantizes to
+BITS = (2, 3, 4, 6, 8)
+FROM = re.compile(r"^\s*FROM\s+(\S+)", re.IGNORECASE | re.MULTILINE)
+
+
+def parse_bits(quantize: str) -> int:
+    match = QUANTIZATION.fullmatch(quantize.strip())
+    if match is None or int(match[1]) not in BITS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Invalid quantize: {quantize}, expected q2, q3, q4, q6 or q8, such as q4_K_M",
+        )
+    return int(match[1])
+
+
+def parse_source(modelfile: str) -> str:
+    """The model a Modelfile's FROM line names."""
+    match = FROM.search(modelfile)
+    if match is None:
+        raise HTTPException(
+            status_code=400, detail="Invalid modelfile, expected a FROM line"
+        )
+    return match[1]
+
+
+def read_modelfile(path: str) -> str:
+    """
+    Reads a Modelfile from MLLAMA_MODELFILE_DIR, which `path` is relative to.
+    Without the directory, requests can't read files on the server.
+    """
+    directory = os.environ.get("MLLAMA_MODELFILE_DIR")
+    if not directory:
+        raise HTTPException(
+            status_code=400, detail="Invalid path: MLLAMA_MODELFILE_DIR is not set"
+        )
+    root = Path(directory).resolve()
+    file = (root / path).resolve()
+    if not file.is_relative_to(root):
+        raise HTTPException(
+            status_code=400, detail=f"Invalid path: {path} is outside the Modelfiles"
+        )
+    try:
+        return file.read_text()
+    except FileNotFoundError:
+        raise HTTPException(status_code=404, detail=f"Modelfile {path} not found")
+    except (OSError, UnicodeDecodeError) as e:
+        raise HTTPException(status_code=400, detail=f"Invalid path: {path}: {e}")
+
+
+class Creation:
+    """
+    A quantized variant of a model being written on a thread, which finishes
+    even if the request that started it goes away.
+    """
+
+    name: str
+    task: "asyncio.Future[None]"
+    # Each step's status as it starts, then None once done
+    statuses: "asyncio.Queue[Optional[str]]"
+
+    def __init__(self, name: str, source: str, bits: int, group_size: int):
+        self.name = name
+        self.statuses = asyncio.Queue()
+        loop = asyncio.get_running_loop()
+
+        def progress(status: str):
+            loop.call_soon_threadsafe(self.statuses.put_nowait, status)
+
+        self.task = asyncio.ensure_future(
+            asyncio.to_thread(create, name, source, bits, group_size, progress)
+        )
+        self.task.add_done_callback(lambda _: self.statuses.put_nowait(None))
+
+    async def events(self) -> AsyncGenerator[Dict[str, Any], None]:
+        """The creation's progress in Ollama's format, ending with `success` or an `error`."""
+        while (status := await self.statuses.get()) is not None:
+            yield {"status": status}
+        error = self.task.exception()
+        if isinstance(error, HTTPException):
+            yield {"error": error.detail}
+        elif error is not None:
+            yield {"error": f"Creating {self.name} failed: {error}"}
+        else:
+            yield {"status": "success"}
+
+
+# Models being created, by name
+creations: Dict[str, Creation] = {}
+
+
+def start(name: str, source: str, bits: int, group_size: int) -> Creation:
+    if name in creations:
+        raise HTTPException(
+            status_code=409, detail=f"Model {name} is already being created"
+        )
+    creation = creations[name] = Creation(name, source, bits, group_size)
+    creation.task.add_done_callback(functools.partial(_finished, name))
+    return creation
+
+
+def _finished(name: str, task: "asyncio.Future[None]"):
+    creations.pop(name, None)
+    # Retrieved here, since the request that started it may be gone.
+    if not task.cancelled() and task.exception() is not None:
+        logger.error(f"create - {name} - {task.exception()}")
+
+
+def create(
+    name: str,
+    source: str,
+    bits: int,
+    group_size: int,
+    progress: Callable[[str], None],
+):
+    """
+    Writes `source` quantized to `bits` per weight into the Hugging Face cache
+    as `name`, laid out as if it were pulled so it loads and lists like any
+    other model. Blocks, so called on a thread.
+    """
+    engine = engines.get()
+    progress("reading model metadata")
+    source_path = Model.locate(engine, source)
+
+    cache_dir = Path(config.hub_cache())
+    repo = cache_dir / repo_folder_name(repo_id=name, repo_type="model")
+    # The same source and settings always make the same snapshot.
+    revision = hashlib.sha1(
+        f"{os.path.basename(source_path)}:{bits}:{group_size}".encode()
+    ).hexdigest()
+    # Written next to the cache first, so moving the files in is atomic and a
+    # failure leaves no partial snapshot behind.
+    staging = cache_dir / f".mllama-create-{uuid.uuid4().hex}"
+    try:
+        logger.info(f"create - {name} - quantize {source} to Q{bits}")
+        progress(f"quantizing {source} to Q{bits}")
+        engine.quantize(source_path, str(staging), bits, group_size)
+
+        progress("writing snapshot")
+        snapshot = repo / "snapshots" / revision
+        shutil.rmtree(snapshot, ignore_errors=True)
+        (repo / "blobs").mkdir(parents=True, exist_ok=True)
+        for file in sorted(staging.rglob("*")):
+            if not file.is_file():
+                continue
+            blob = repo / "blobs" / _sha256(file)
+            os.replace(file, blob)
+            link = snapshot / file.relative_to(staging)
+            link.parent.mkdir(parents=True, exist_ok=True)
+            link.symlink_to(os.path.relpath(blob, link.parent))
+        ref = repo / "refs" / "main"
+        ref.parent.mkdir(exist_ok=True)
+        ref.write_text(revision)
+    finally:
+        shutil.rmtree(staging, ignore_errors=True)
+
+    # A variant loaded before this one is replaced once its generations finish.
+    Model.unload(name)
+    catalog().refresh()
+    logger.info(f"create - {name} - done")
+
+
+def _sha256(path: Path) -> str:
+    """The file's sha256, which names its blob as the Hub's ETag would."""
+    digest = hashlib.sha256()
+    with path.open("rb") as file:
+        while chunk := file.read(2**24):
+            digest.update(chunk)
+    return digest.hexdigest()
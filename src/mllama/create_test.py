@@ -0,0 +1,125 @@
+import json
+from fastapi.testclient import TestClient
+import pytest
+from mllama.catalog import Catalog
+from mllama.create import parse_bits, parse_source
+from mllama.main import app
+from mllama.model import Model
+
+CLIENT = TestClient(app)
+
+
+@pytest.fixture
+def cache_dir(monkeypatch, tmp_path):
+    monkeypatch.setenv("MLLAMA_ENGINE", "stub")
+    monkeypatch.setenv("HF_HUB_CACHE", str(tmp_path))
+    return tmp_path
+
+
+def test_create_streams_progress(cache_dir):
+    response = CLIENT.post(
+        "/api/create",
+        json={"model": "org/base-4bit", "from": "org/base", "quantize": "q4_K_M"},
+    )
+    events = [json.loads(line) for line in response.text.splitlines()]
+
+    assert events == [
+        {"status": "reading model metadata"},
+        {"status": "quantizing org/base to Q4"},
+        {"status": "writing snapshot"},
+        {"status": "success"},
+    ]
+    [entry] = Catalog(str(cache_dir)).models()
+    assert entry.name == "org/base-4bit"
+    assert entry.quantization_level == "Q4"
+    # The variant is a regular snapshot, without the staging directory.
+    assert [path.name for path in cache_dir.iterdir()] == ["models--org--base-4bit"]
+
+    try:
+        response = CLIENT.post(
+            "/api/chat",
+            json={
+                "model": "org/base-4bit",
+                "messages": [{"role": "user", "content": "Why is the sky blue?"}],
+                "options": {"max_tokens": 4},
+                "stream": False,
+            },
+        )
+        assert response.json()["message"]["content"] == "The sky is blue"
+    finally:
+        Model.unload("org/base-4bit")
+
+
+def test_create_from_modelfile(cache_dir):
+    response = CLIENT.post(
+        "/api/create",
+        json={
+            "model": "org/base-8bit",
+            "modelfile": "FROM org/base\nPARAMETER temperature 0",
+            "quantize": "q8_0",
+            "group_size": 32,
+            "stream": False,
+        },
+    )
+
+    assert response.json() == {"status": "success"}
+    snapshot = next((cache_dir / "models--org--base-8bit" / "snapshots").iterdir())
+    config = json.loads((snapshot / "config.json").read_text())
+    assert config["quantization"] == {"group_size": 32, "bits": 8}
+
+
+def test_create_from_modelfile_path(cache_dir, monkeypatch, tmp_path):
+    modelfiles = tmp_path / "modelfiles"
+    modelfiles.mkdir()
+    (modelfiles / "Modelfile").write_text("FROM org/base\n")
+    monkeypatch.setenv("MLLAMA_MODELFILE_DIR", str(modelfiles))
+
+    def create(path):
+        return CLIENT.post(
+            "/api/create",
+            json={
+                "model": "org/base-4bit",
+                "path": path,
+                "quantize": "q4_0",
+                "stream": False,
+            },
+        )
+
+    assert create("Modelfile").json()["status"] == "success"
+    assert create("missing").status_code == 404
+    assert create("../models--org--base-4bit").status_code == 400
+    assert create("/etc/passwd").status_code == 400
+
+
+def test_create_from_path_needs_modelfile_dir(cache_dir, monkeypatch):
+    monkeypatch.delenv("MLLAMA_MODELFILE_DIR", raising=False)
+
+    response = CLIENT.post(
+        "/api/create",
+        json={"model": "org/x", "path": "/etc/passwd", "quantize": "q4_0"},
+    )
+
+    assert response.status_code == 400
+
+
+def test_parse():
+    assert parse_bits("q4_K_M") == 4
+    assert parse_bits("Q8_0") == 8
+    assert parse_source("# comment\nfrom org/base\n") == "org/base"
+
+
+@pytest.mark.parametrize(
+    "params",
+    [
+        {"model": "org/x", "from": "org/base", "quantize": "q5_K_M"},
+        {"model": "org/x", "from": "org/base", "quantize": "f16"},
+        {"model": "org/x", "from": "org/base"},
+        {"model": "org/x", "from": "org/base", "quantize": "q4_0", "group_size": 48},
+        {"model": "org/x", "modelfile": "SYSTEM hi", "quantize": "q4_0"},
+        {"model": "org/x:latest", "from": "org/base", "quantize": "q4_0"},
+    ],
+)
+def test_invalid_request(cache_dir, params):
+    response = CLIENT.post("/api/create", json=params)
+
+    assert response.status_code == 400
@@ -0,0 +1,362 @@
+import math
+import sys
+from typing import Any, Callable, List, Optional, Sequence, Set, Union
+import mlx.core as mx
+from mlx_lm.models.cache import (
+    KVCache,
+    RotatingKVCache,
+    can_trim_prompt_cache,
+    trim_prompt_cache,
+)
+from mllama.grammar import Grammar
+from mllama.worker import Cancelled
+
+LogitsProcessor = Callable[[mx.array, mx.array], mx.array]
+
+# Prompts are evaluated in chunks so their logits never take much memory.
+PREFILL_STEP_SIZE = 512
+
+
+class GreedyDistribution:
+    token: int
+
+    def __init__(self, logits: mx.array):
+        self.token = mx.argmax(logits).item()
+
+    def sample(self) -> int:
+        return self.token
+
+    def prob(self, token: int) -> float:
+        return 1.0 if token == self.token else 0.0
+
+    def residual(self, draft: Any) -> "GreedyDistribution":
+        return self
+
+
+class SampledDistribution:
+    probs: mx.array
+    # The random key to sample with, for reproducible sequences
+    key: Optional[mx.array]
+
+    def __init__(self, probs: mx.array, key: Optional[mx.array] = None):
+        self.probs = probs
+        self.key = key
+
+    @staticmethod
+    def from_logits(
+        logits: mx.array, temp: float, key: Optional[mx.array] = None
+    ) -> "SampledDistribution":
+        return SampledDistribution(mx.softmax(logits / temp), key)
+
+    def sample(self) -> int:
+        return mx.random.categorical(mx.log(self.probs), key=self.key).item()
+
+    def prob(self, token: int) -> float:
+        return self.probs[token].item()
+
+    def residual(self, draft: Any) -> "SampledDistribution":
+        residual = mx.maximum(self.probs - draft.probs, 0)
+        total = residual.sum().item()
+        if total == 0:
+            return self
+        return SampledDistribution(residual / total, self.key)
+
+
+class MlxDecoder:
+    """
+    A model and its KV cache, sampling at temperature `temp` after applying
+    `processors` to the logits. Logits are cut to `vocab_size` so a target and
+    draft whose embeddings are padded differently agree. With a `seed`, each
+    token is sampled with a key split from it, so the sequence is reproducible
+    however it is interleaved with others. Prefilling raises `Cancelled` once
+    `interrupt` returns True.
+    """
+
+    model: Any
+    cache: List[Any]
+    tokens: List[int]
+    key: Optional[mx.array]
+
+    def __init__(
+        self,
+        model: Any,
+        cache: List[Any],
+        tokens: List[int],
+        vocab_size: int,
+        temp: float,
+        processors: Sequence[LogitsProcessor] = (),
+        seed: Optional[int] = None,
+        interrupt: Callable[[], bool] = lambda: False,
+    ):
+        if not can_trim_prompt_cache(cache):
+            raise ValueError("Decoding requires a trimmable KV cache")
+        self.model = model
+        self.cache = cache
+        self.tokens = tokens
+        self.vocab_size = vocab_size
+        self.temp = temp
+        self.logits_processors = list(processors)
+        self.key = mx.random.key(seed) if seed is not None else None
+        self.interrupt = interrupt
+
+    def extend(self, tokens: List[int]):
+        for start in range(0, len(tokens), PREFILL_STEP_SIZE):
+            # A long prompt can be abandoned between steps.
+            if self.interrupt():
+                raise Cancelled()
+            chunk = tokens[start : start + PREFILL_STEP_SIZE]
+            self.model(mx.array(chunk)[None], cache=self.cache)
+            mx.eval([c.state for c in self.cache])
+            self.tokens.extend(chunk)
+
+    def prefill(self, tokens: List[int]):
+        last = max(len(tokens) - 1, 0) // PREFILL_STEP_SIZE * PREFILL_STEP_SIZE
+        self.extend(tokens[:last])
+        tokens = tokens[last:]
+        # Only the last position's distribution is needed, for the next token.
+        logits = self.model(mx.array(tokens)[None], cache=self.cache)
+        self.tokens.extend(tokens)
+        return self._distribution(logits[0, -1:])
+
+    def forward(self, tokens: List[int]):
+        logits = self.model(mx.array(tokens)[None], cache=self.cache)
+        distributions: List[Union[GreedyDistribution, SampledDistribution]] = []
+        for i, token in enumerate(tokens):
+            self.tokens.append(token)
+            distributions.append(self._distribution(logits[0, i : i + 1]))
+        return distributions
+
+    def _distribution(
+        self, row: mx.array
+    ) -> Union[GreedyDistribution, SampledDistribution]:
+        """The distribution for the token after `self.tokens`, from its row of logits."""
+        row = row[:, : self.vocab_size].astype(mx.float32)
+        if self.logits_processors:
+            context = mx.array(self.tokens)
+            for processor in self.logits_processors:
+                row = processor(context, row)
+        if self.temp == 0:
+            return GreedyDistribution(row[0])
+        key = None
+        if self.key is not None:
+            self.key, key = mx.random.split(self.key)
+        return SampledDistribution.from_logits(row[0], self.temp, key)
+
+    def trim(self, count: int):
+        if count:
+            trim_prompt_cache(self.cache, count)
+            del self.tokens[-count:]
+
+
+# The mlx_lm architectures whose attention takes its RoPE offset from the cache
+# and its mask from `create_attention_mask`, which is all `batch_forward` needs.
+BATCHABLE_ARCHITECTURES = {
+    "llama",
+    "qwen2",
+    "qwen2_moe",
+    "mixtral",
+    "phi3",
+    "gemma",
+    "starcoder2",
+}
+
+# The model modules whose `create_attention_mask` has been wrapped
+_batching_modules: Set[str] = set()
+
+
+class RowOffsets(int):
+    """The offset of a batch's cache, which also knows each row's own."""
+
+    rows: List[int]
+
+    def __new__(cls, rows: List[int]) -> "RowOffsets":
+        offsets = super().__new__(cls, max(rows))
+        offsets.rows = rows
+        return offsets
+
+
+class BatchKVCache:
+    """
+    One layer's KV caches for the rows of a batch, each holding its own sequence.
+    Each row's keys and values are padded on the right to the longest, and
+    `mask` keeps attention off the padding.
+    """
+
+    caches: List[Any]
+    mask: mx.array
+    offset: RowOffsets
+
+    def __init__(self, caches: List[Any], mask: mx.array):
+        self.caches = caches
+        self.mask = mask
+        self.offset = RowOffsets([c.offset for c in caches])
+
+    def update_and_fetch(self, keys: mx.array, values: mx.array):
+        fetched = [
+            cache.update_and_fetch(keys[i : i + 1], values[i : i + 1])
+            for i, cache in enumerate(self.caches)
+        ]
+        length = max(row_keys.shape[2] for row_keys, _ in fetched)
+
+        def stack(rows: List[mx.array]) -> mx.array:
+            return mx.concatenate(
+                [
+                    mx.pad(row, [(0, 0), (0, 0), (0, length - row.shape[2]), (0, 0)])
+                    for row in rows
+                ]
+            )
+
+        return stack([k for k, _ in fetched]), stack([v for _, v in fetched])
+
+
+class RowRoPE:
+    """
+    Stands in for an attention layer's RoPE, rotating each row of a batch by
+    its own offset when given `RowOffsets`.
+    """
+
+    def __init__(self, rope: Any):
+        self.rope = rope
+
+    def __call__(self, x: mx.array, offset: int = 0) -> mx.array:
+        if not isinstance(offset, RowOffsets):
+            return self.rope(x, offset=offset)
+        return mx.concatenate(
+            [self.rope(x[i : i + 1], offset=row) for i, row in enumerate(offset.rows)]
+        )
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self.rope, name)
+
+
+def enable_batching(model: Any) -> bool:
+    """
+    Readies `model` for `batch_forward`, returning False if its architecture
+    isn't one it can run. Unbatched forward passes are unaffected.
+    """
+    module: Any = sys.modules[type(model).__module__]
+    if module.__name__.rsplit(".", 1)[-1] not in BATCHABLE_ARCHITECTURES:
+        return False
+    if module.__name__ not in _batching_modules:
+        create_attention_mask = module.create_attention_mask
+
+        def batch_attention_mask(h: mx.array, cache: Optional[Any] = None):
+            if cache and isinstance(cache[0], BatchKVCache):
+                return cache[0].mask.astype(h.dtype)
+            return create_attention_mask(h, cache)
+
+        module.create_attention_mask = batch_attention_mask
+        _batching_modules.add(module.__name__)
+    for child in model.modules():
+        if "rope" in child and not isinstance(child.rope, RowRoPE):
+            # A plain attribute, which shadows the module without changing the
+            # model's parameters.
+            object.__setattr__(child, "rope", RowRoPE(child["rope"]))
+    return True
+
+
+def batch_forward(
+    decoders: List[Any], tokens: List[int]
+) -> List[Union[GreedyDistribution, SampledDistribution]]:
+    """
+    Appends each token to its `MlxDecoder`'s cache and returns the distributions
+    after them, in one forward pass of a model readied by `enable_batching`.
+    Caches that can't be padded to share it, such as quantized ones or rotating
+    ones that have wrapped around, are run one at a time.
+    """
+    if len(decoders) == 1 or not all(
+        type(c) in (KVCache, RotatingKVCache) and c.is_trimmable()
+        for decoder in decoders
+        for c in decoder.cache
+    ):
+        return [decoder.forward([token])[0] for decoder, token in zip(decoders, tokens)]
+    lengths = [decoder.cache[0].offset + 1 for decoder in decoders]
+    mask = mx.where(
+        mx.arange(max(lengths))[None] < mx.array(lengths)[:, None], 0.0, -1e9
+    )[:, None, None, :]
+    cache = [
+        BatchKVCache([decoder.cache[layer] for decoder in decoders], mask)
+        for layer in range(len(decoders[0].cache))
+    ]
+    logits = decoders[0].model(mx.array(tokens)[:, None], cache=cache)
+    distributions = []
+    for i, (decoder, token) in enumerate(zip(decoders, tokens)):
+        decoder.tokens.append(token)
+        distributions.append(decoder._distribution(logits[i, -1:]))
+    return distributions
+
+
+def top_k_processor(k: int) -> LogitsProcessor:
+    """Keeps the `k` most likely tokens."""
+
+    def processor(tokens: mx.array, logits: mx.array) -> mx.array:
+        if k >= logits.shape[-1]:
+            return logits
+        threshold = mx.topk(logits, k, axis=-1).min(axis=-1, keepdims=True)
+        return mx.where(logits < threshold, -mx.inf, logits)
+
+    return processor
+
+
+def top_p_processor(p: float, temp: float) -> LogitsProcessor:
+    """Keeps the most likely tokens whose probabilities at `temp` sum to `p`."""
+
+    def processor(tokens: mx.array, logits: mx.array) -> mx.array:
+        probs = mx.softmax(logits / temp, axis=-1)
+        sorted_probs = mx.sort(probs, axis=-1)[..., ::-1]
+        # A token is kept if the more likely ones don't already reach `p`.
+        kept = (mx.cumsum(sorted_probs, axis=-1) - sorted_probs) < p
+        threshold = mx.where(kept, sorted_probs, mx.inf).min(axis=-1, keepdims=True)
+        return mx.where(probs < threshold, -mx.inf, logits)
+
+    return processor
+
+
+def min_p_processor(p: float, temp: float) -> LogitsProcessor:
+    """Keeps the tokens at least `p` times as likely at `temp` as the most likely one."""
+    offset = temp * math.log(p)
+
+    def processor(tokens: mx.array, logits: mx.array) -> mx.array:
+        threshold = logits.max(axis=-1, keepdims=True) + offset
+        return mx.where(logits < threshold, -mx.inf, logits)
+
+    return processor
+
+
+class GrammarProcessor:
+    """
+    Masks the logits of tokens a grammar doesn't allow after the tokens generated
+    so far, which follow the `start` prompt tokens. The tokens must only be
+    appended to, as `decode` does.
+    """
+
+    grammar: Grammar
+    start: int
+    vocab_size: int
+    # The grammar's state after each number of generated tokens
+    states: List[int]
+
+    def __init__(self, grammar: Grammar, start: int, vocab_size: int):
+        self.grammar = grammar
+        self.start = start
+        self.vocab_size = vocab_size
+        self.states = [grammar.initial_state]
+
+    def __call__(self, tokens: mx.array, logits: mx.array) -> mx.array:
+        count = len(tokens) - self.start
+        # Positions within the prompt
+        if count < 0:
+            return logits
+        if count >= len(self.states):
+            for token in tokens[self.start + len(self.states) - 1 :].tolist():
+                self.states.append(self.grammar.next_state(self.states[-1], token))
+        mask = self.grammar.mask(self.states[count], self._build_mask)
+        return mx.where(mask, logits, -mx.inf)
+
+    def _build_mask(self, allowed: List[int]) -> mx.array:
+        mask = mx.zeros(self.vocab_size, dtype=mx.bool_)
+        allowed = [token for token in allowed if token < self.vocab_size]
+        if allowed:
+            mask[mx.array(allowed)] = True
+        mx.eval(mask)
+        return mask
@@ -0,0 +1,76 @@
+from array import array
+import hashlib
+from types import ModuleType
+from typing import Any, Iterator, List, Tuple
+from fastapi import HTTPException
+from mllama import config
+from mllama.lru import LRUCache
+
+# Inputs are embedded in batches of similar length, bounded in both count and
+# padded size so a batch of long documents doesn't exhaust memory.
+BATCH_SIZE = 32
+BATCH_TOKENS = 16384
+
+_cache: "LRUCache[str, array] | None" = None
+
+
+def cache() -> "LRUCache[str, array]":
+    """Embeddings by model and content hash, shared across model reloads."""
+    global _cache
+    if _cache is None:
+        _cache = LRUCache(config.get_size("MLLAMA_EMBEDDING_CACHE_SIZE", "512MB"))
+    return _cache
+
+
+def cache_key(
+    model: str, snapshot: str, text: str, max_length: int, truncate: bool
+) -> str:
+    """
+    Identifies an embedding by the model's snapshot, so a model pulled again
+    doesn't reuse the old weights' embeddings, and by the length inputs are
+    truncated to.
+    """
+    digest = hashlib.sha256(text.encode()).hexdigest()
+    return f"{model}:{snapshot}:{max_length}:{truncate}:{digest}"
+
+
+def embed(
+    engine: ModuleType, kit: Any, texts: List[str], max_length: int, truncate: bool
+) -> Iterator[Tuple[List[int], List[array], int]]:
+    """
+    Embeds `texts` by mean pooling the model's final hidden states. Yields, batch
+    by batch, the indices of the embedded texts, their normalized embeddings and
+    the number of tokens evaluated. Blocks, so run on the model's worker.
+    """
+    if not engine.can_embed(kit):
+        raise HTTPException(status_code=400, detail="Model does not support embeddings")
+
+    tokens = [
+        engine.tokenize(kit, text) or [kit.tokenizer.eos_token_id] for text in texts
+    ]
+    for i, input_tokens in enumerate(tokens):
+        if len(input_tokens) > max_length:
+            if not truncate:
+                raise HTTPException(
+                    status_code=400,
+                    detail=f"Input {i} is {len(input_tokens)} tokens, longer than the context length of {max_length}",
+                )
+            tokens[i] = input_tokens[:max_length]
+
+    batch: List[int] = []
+    for i in sorted(range(len(tokens)), key=lambda i: len(tokens[i])):
+        padded_size = len(tokens[i]) * (len(batch) + 1)
+        if batch and (len(batch) == BATCH_SIZE or padded_size > BATCH_TOKENS):
+            yield _embed_batch(engine, kit, tokens, batch)
+            batch = []
+        batch.append(i)
+    if batch:
+        yield _embed_batch(engine, kit, tokens, batch)
+
+
+def _embed_batch(
+    engine: ModuleType, kit: Any, tokens: List[List[int]], batch: List[int]
+) -> Tuple[List[int], List[array], int]:
+    inputs = [tokens[i] for i in batch]
+    embeddings = engine.embed_batch(kit, inputs)
+    return batch, embeddings, sum(len(input_tokens) for input_tokens in inputs)
@@ -0,0 +1,20 @@
+import os
+from types import ModuleType
+
+
+def get() -> ModuleType:
+    """
+    The engine models are loaded with, chosen by MLLAMA_ENGINE: `mlx`, or
+    `stub` to measure the server's own overhead without a model. Each engine is
+    imported on first use, so the stub runs where MLX isn't installed.
+    """
+    name = os.environ.get("MLLAMA_ENGINE", "mlx")
+    if name == "mlx":
+        from mllama.engines import mlx
+
+        return mlx
+    if name == "stub":
+        from mllama.engines import stub
+
+        return stub
+    raise ValueError(f"Invalid MLLAMA_ENGINE: {name}, expected mlx or stub")
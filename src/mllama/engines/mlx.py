@@ -0,0 +1,292 @@
+from array import array
+import base64
+import copy
+import functools
+import hashlib
+import io
+from typing import Any, Dict, List, Optional, Tuple
+import weakref
+import huggingface_hub
+import mlx.core as mx
+from mlx.utils import tree_flatten
+import mlx_engine
+from mlx_lm.models.cache import (
+    can_trim_prompt_cache,
+    load_prompt_cache as load_prefix,
+    make_prompt_cache,
+    save_prompt_cache,
+    trim_prompt_cache,
+)
+from mlx_lm.sample_utils import make_logits_processors
+from mlx_lm.utils import convert
+from outlines.fsm.guide import RegexGuide
+from outlines.fsm.json_schema import build_regex_from_schema
+from outlines.models.transformers import TransformerTokenizer
+from PIL import Image, ImageOps
+from mllama import config
+from mllama.decoder import GrammarProcessor as make_grammar_processor
+from mllama.decoder import (
+    PREFILL_STEP_SIZE,
+    LogitsProcessor,
+    MlxDecoder as make_decoder,
+    batch_forward,
+    enable_batching,
+    min_p_processor,
+    top_k_processor,
+    top_p_processor,
+)
+from mllama.config import hub_cache
+from mllama.grammar import Grammar
+from mllama.lru import LRUCache
+from mllama.registry import estimate_size
+from mllama.sampling import SamplingOptions
+from mllama.speculative import DecodeBatch
+
+__all__ = [
+    "locate",
+    "estimate_size",
+    "max_cache_size",
+    "load_model",
+    "quantize",
+    "tokenize",
+    "create_generator",
+    "make_prompt_cache",
+    "trim_prompt_cache",
+    "save_prefix",
+    "load_prefix",
+    "kv_size",
+    "token_array",
+    "make_decoder",
+    "make_decode_batch",
+    "sampling_processors",
+    "make_grammar_processor",
+    "compile_grammar",
+    "can_decode",
+    "can_see",
+    "prepare_image",
+    "can_embed",
+    "embed_batch",
+]
+
+tokenize = mlx_engine.tokenize
+create_generator = mlx_engine.create_generator
+
+# Outlines' view of each model's vocabulary, which is slow to build
+_outlines_tokenizers: "weakref.WeakKeyDictionary[Any, TransformerTokenizer]" = (
+    weakref.WeakKeyDictionary()
+)
+
+
+def locate(name: str) -> Optional[str]:
+    """Finds the local snapshot of a model."""
+    try:
+        return huggingface_hub.snapshot_download(
+            name, cache_dir=hub_cache(), local_files_only=True
+        )
+    except huggingface_hub.utils.LocalEntryNotFoundError:
+        return None
+
+
+def max_cache_size() -> int:
+    """The most a model's prefix, grammar and vision caches may hold, by their caps."""
+    return (
+        config.get_size("MLLAMA_PREFIX_CACHE_SIZE", "4GB")
+        + config.get_size("MLLAMA_GRAMMAR_CACHE_SIZE", "1GB")
+        + config.get_size("MLLAMA_VISION_CACHE_SIZE", "1GB")
+    )
+
+
+def load_model(path: str, max_kv_size: int) -> Any:
+    kit = mlx_engine.load_model(path, max_kv_size=max_kv_size, trust_remote_code=False)
+    if can_see(kit):
+        _cache_vision_encoder(kit)
+    return kit
+
+
+class CachedVisionEncoder:
+    """
+    Stands in for a vision model's encoder, returning its earlier output for
+    the same pixels rather than encoding them again, as when a chat resends
+    the same screenshot on every turn.
+    """
+
+    def __init__(self, encoder: Any, max_bytes: int):
+        self.encoder = encoder
+        self.outputs: LRUCache[str, Any] = LRUCache(max_bytes)
+
+    def __call__(self, *args: Any, **kwargs: Any) -> Any:
+        key = _digest(args, kwargs)
+        outputs = self.outputs.get(key)
+        if outputs is None:
+            outputs = self.encoder(*args, **kwargs)
+            arrays = [
+                value
+                for _, value in tree_flatten(outputs)
+                if isinstance(value, mx.array)
+            ]
+            mx.eval(arrays)
+            self.outputs.put(key, outputs, sum(array.nbytes for array in arrays))
+        return outputs
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self.encoder, name)
+
+
+def _cache_vision_encoder(kit: Any):
+    """
+    Wraps the vision tower of the mlx_vlm model inside the kit, if it has one,
+    with a `CachedVisionEncoder` holding up to MLLAMA_VISION_CACHE_SIZE.
+    """
+    vlm = getattr(kit.model, "vision_model", kit.model)
+    encoder = getattr(vlm, "vision_tower", None)
+    if encoder is None or isinstance(encoder, CachedVisionEncoder):
+        return
+    # A plain attribute, which shadows the module without changing the
+    # model's parameters.
+    object.__setattr__(
+        vlm,
+        "vision_tower",
+        CachedVisionEncoder(
+            encoder, config.get_size("MLLAMA_VISION_CACHE_SIZE", "1GB")
+        ),
+    )
+
+
+def _digest(args: Tuple[Any, ...], kwargs: Dict[str, Any]) -> str:
+    """Hashes the arguments to a vision encoder, including the pixels' contents."""
+    digest = hashlib.sha256()
+    for key, value in tree_flatten([list(args), kwargs]):
+        digest.update(key.encode())
+        if isinstance(value, mx.array):
+            if value.dtype == mx.bfloat16:
+                value = value.astype(mx.float32)
+            digest.update(f"{value.dtype}{value.shape}".encode())
+            digest.update(memoryview(value))
+        else:
+            digest.update(repr(value).encode())
+    return digest.hexdigest()
+
+
+def quantize(source: str, destination: str, bits: int, group_size: int):
+    """Writes the model at `source` to `destination` with its weights quantized."""
+    convert(source, destination, quantize=True, q_group_size=group_size, q_bits=bits)
+
+
+def save_prefix(path: str, cache: List[Any], length: int) -> bool:
+    """
+    Writes the KV state of the first `length` tokens in `cache` as safetensors,
+    unless it no longer holds them all, as once a rotating cache wraps around.
+    """
+    if not cache or cache[0].offset < length or not can_trim_prompt_cache(cache):
+        return False
+    # Trimming copies only moves their offsets, leaving the shared arrays alone.
+    prefix = [copy.copy(layer) for layer in cache]
+    trim_prompt_cache(prefix, prefix[0].offset - length)
+    save_prompt_cache(path, prefix)
+    return True
+
+
+def kv_size(cache: List[Any]) -> Optional[int]:
+    """The most tokens a KV cache made by `make_prompt_cache` holds, if bounded."""
+    return getattr(cache[0], "max_size", None) if cache else None
+
+
+def token_array(tokens: List[int]) -> mx.array:
+    """Tokens in the form the engine keeps alongside a KV cache."""
+    return mx.array(tokens, dtype=mx.int32)
+
+
+@functools.lru_cache(maxsize=256)
+def sampling_processors(options: SamplingOptions) -> List[LogitsProcessor]:
+    """
+    The logits processors for decoding with `options`, built once for each
+    distinct set of options. None of them keep state between calls.
+    """
+    processors = make_logits_processors(
+        None, options.repetition_penalty, options.repetition_context_size
+    )
+    # Greedy decoding takes the most likely token, which every filter keeps.
+    if options.temperature > 0:
+        if options.top_k:
+            processors.append(top_k_processor(options.top_k))
+        if options.top_p < 1:
+            processors.append(top_p_processor(options.top_p, options.temperature))
+        if options.min_p > 0:
+            processors.append(min_p_processor(options.min_p, options.temperature))
+    return processors
+
+
+def compile_grammar(kit: Any, schema: str) -> Grammar:
+    """Builds the token-level state machine for a JSON schema over the model's vocabulary."""
+    tokenizer = _outlines_tokenizers.get(kit)
+    if tokenizer is None:
+        tokenizer = _outlines_tokenizers[kit] = TransformerTokenizer(
+            kit.tokenizer._tokenizer
+        )
+    guide = RegexGuide.from_regex(build_regex_from_schema(schema), tokenizer)
+    transitions = sum(len(tokens) for tokens in guide.states_to_token_maps.values())
+    # A boolean mask per state, plus the transitions in Python dicts
+    nbytes = (
+        len(guide.states_to_token_maps) * kit.tokenizer.vocab_size + transitions * 100
+    )
+    return Grammar(guide, nbytes)
+
+
+def make_decode_batch(kit: Any) -> Optional[DecodeBatch]:
+    """
+    A batch for the model's decoders to share forward passes in, or None if its
+    architecture can't run several sequences at once.
+    """
+    if not enable_batching(kit.model):
+        return None
+    return DecodeBatch(batch_forward, PREFILL_STEP_SIZE)
+
+
+def can_decode(kit: Any) -> bool:
+    """
+    Whether `make_decoder` can run the model, which vision models don't allow.
+    `make_decoder`, `make_decode_batch` and `make_grammar_processor` are only
+    used when it can.
+    """
+    return getattr(kit, "cache_wrapper", None) is not None
+
+
+def can_see(kit: Any) -> bool:
+    """Whether the model takes images, as vision models, which manage their own cache, do."""
+    return getattr(kit, "cache_wrapper", None) is None
+
+
+def prepare_image(data: bytes, max_size: int) -> str:
+    """
+    Decodes an image, turned upright and in RGB, scaled down to fit within
+    `max_size` pixels on each side, as the base64 PNG `create_generator` takes.
+    """
+    image = ImageOps.exif_transpose(Image.open(io.BytesIO(data))).convert("RGB")
+    if max_size:
+        image.thumbnail((max_size, max_size))
+    output = io.BytesIO()
+    # Lossless, and quicker to write than to read at higher compression
+    image.save(output, format="PNG", compress_level=1)
+    return base64.b64encode(output.getvalue()).decode()
+
+
+def can_embed(kit: Any) -> bool:
+    return getattr(kit.model, "model", None) is not None and hasattr(kit, "tokenizer")
+
+
+def embed_batch(kit: Any, inputs: List[List[int]]) -> List[array]:
+    """Mean pools the final hidden states of each input, then normalizes them."""
+    lengths = [len(tokens) for tokens in inputs]
+    width = max(lengths)
+    # Padding goes on the right, where causal attention keeps it from affecting
+    # the real tokens. It is then masked out of the pooling.
+    padded = mx.array([tokens + [0] * (width - len(tokens)) for tokens in inputs])
+    hidden = kit.model.model(padded).astype(mx.float32)
+
+    mask = mx.arange(width)[None, :] < mx.array(lengths)[:, None]
+    pooled = (hidden * mask[..., None]).sum(axis=1) / mx.array(lengths)[:, None]
+    norms = mx.linalg.norm(pooled, axis=1, keepdims=True)
+    embeddings = pooled / mx.maximum(norms, 1e-12)
+    mx.eval(embeddings)
+
+    return [array("f", row) for row in embeddings.tolist()]
@@ -0,0 +1,271 @@
+"""
+A stand-in for the MLX engine that generates canned text without a model, so
+the server's own overhead (templating, tokenization, scheduling, serialization)
+can be measured anywhere, including Linux CI.
+
+MLLAMA_STUB_PROMPT_RATE and MLLAMA_STUB_EVAL_RATE, in tokens/sec, make it sleep
+as a real model would. Both default to 0, which doesn't sleep at all.
+"""
+
+from array import array
+import base64
+import hashlib
+import json
+from pathlib import Path
+import re
+import time
+from typing import Any, Iterator, List, Optional
+from mllama import config
+
+__all__ = [
+    "locate",
+    "estimate_size",
+    "max_cache_size",
+    "load_model",
+    "quantize",
+    "tokenize",
+    "create_generator",
+    "make_prompt_cache",
+    "trim_prompt_cache",
+    "save_prefix",
+    "load_prefix",
+    "kv_size",
+    "token_array",
+    "sampling_processors",
+    "compile_grammar",
+    "can_decode",
+    "can_see",
+    "prepare_image",
+    "can_embed",
+    "embed_batch",
+]
+
+WORDS = (
+    "The sky is blue because molecules in the atmosphere scatter short "
+    "wavelengths of sunlight more strongly than long ones, so blue light reaches "
+    "the eye from every direction."
+).split()
+EMBEDDING_SIZE = 64
+
+
+class StubTokenizer:
+    """Makes a token of each byte, after splitting out ChatML's special tokens."""
+
+    ADDED = {"<s>": 1, "</s>": 2, "<|im_start|>": 3, "<|im_end|>": 4}
+    SPLIT = re.compile("(" + "|".join(re.escape(token) for token in ADDED) + ")")
+
+    chat_template = None
+    bos_token = "<s>"
+    eos_token = "<|im_end|>"
+    eos_token_id = ADDED["<|im_end|>"]
+    special_tokens_map = {"bos_token": "<s>", "eos_token": "<|im_end|>"}
+    vocab_size = 256 + len(ADDED)
+
+    def get_added_vocab(self):
+        return self.ADDED
+
+    def encode(self, text: str, add_special_tokens: bool = True) -> List[int]:
+        tokens = [self.ADDED["<s>"]] if add_special_tokens else []
+        for piece in self.SPLIT.split(text):
+            if piece in self.ADDED:
+                tokens.append(self.ADDED[piece])
+            else:
+                tokens.extend(byte + len(self.ADDED) for byte in piece.encode())
+        return tokens
+
+
+class StubCacheWrapper:
+    cache: List[Any]
+    tokens: Optional[array]
+
+    def __init__(self, max_kv_size: int):
+        self.cache = make_prompt_cache(None, max_kv_size)
+        self.tokens = None
+
+
+class StubModelKit:
+    model: None
+    tokenizer: StubTokenizer
+    cache_wrapper: StubCacheWrapper
+
+    def __init__(self, max_kv_size: int):
+        self.model = None
+        self.tokenizer = StubTokenizer()
+        self.cache_wrapper = StubCacheWrapper(max_kv_size)
+
+
+class StubStopCondition:
+    stop_reason: str
+
+    def __init__(self, stop_reason: str):
+        self.stop_reason = stop_reason
+
+
+class StubGenerationResult:
+    text: str
+    tokens: List[int]
+    stop_condition: Optional[StubStopCondition]
+
+    def __init__(self, text: str, stop_condition: Optional[StubStopCondition] = None):
+        self.text = text
+        self.tokens = []
+        self.stop_condition = stop_condition
+
+
+def locate(name: str) -> Optional[str]:
+    """Any model name is found, at a path of the same name."""
+    return name
+
+
+def estimate_size(path: str) -> int:
+    return 0
+
+
+def max_cache_size() -> int:
+    """The stub's caches hold no arrays worth counting."""
+    return 0
+
+
+def load_model(path: str, max_kv_size: int) -> StubModelKit:
+    return StubModelKit(max_kv_size)
+
+
+def quantize(source: str, destination: str, bits: int, group_size: int):
+    """Writes the config MLX would, without any weights."""
+    Path(destination).mkdir(parents=True)
+    quantization = {"group_size": group_size, "bits": bits}
+    (Path(destination) / "config.json").write_text(
+        json.dumps({"model_type": "stub", "quantization": quantization})
+    )
+
+
+def tokenize(kit: StubModelKit, prompt: str) -> List[int]:
+    return kit.tokenizer.encode(prompt)
+
+
+def create_generator(
+    kit: StubModelKit,
+    prompt_tokens: List[int],
+    *,
+    images_b64: Optional[List[str]] = None,
+    json_schema: Optional[str] = None,
+    max_tokens: Optional[int] = 1024,
+    **kwargs: Any,
+) -> Iterator[StubGenerationResult]:
+    """
+    Yields the words of a canned answer, one per token, until `max_tokens`. A
+    JSON schema gets the answer wrapped in a JSON string. Prompt tokens already
+    in the active cache aren't evaluated again, as with a real prefix cache.
+    """
+    cached_tokens = kit.cache_wrapper.tokens
+    cached = 0
+    if cached_tokens is not None:
+        for cached_token, token in zip(cached_tokens, prompt_tokens):
+            if cached_token != token:
+                break
+            cached += 1
+    _sleep(len(prompt_tokens) - cached, "MLLAMA_STUB_PROMPT_RATE")
+    tokens = list(prompt_tokens)
+    kit.cache_wrapper.tokens = token_array(tokens)
+
+    max_tokens = max_tokens or 1024
+    for count in range(max_tokens):
+        _sleep(1, "MLLAMA_STUB_EVAL_RATE")
+        text = ("" if count == 0 else " ") + WORDS[count % len(WORDS)]
+        if json_schema is not None:
+            if count == 0:
+                text = '{"response": "' + text
+            if count == max_tokens - 1:
+                text += '"}'
+        tokens.append(count % 256 + len(kit.tokenizer.ADDED))
+        # Another sequence's cache may have been activated in the meantime.
+        kit.cache_wrapper.tokens = token_array(tokens)
+        yield StubGenerationResult(text)
+
+
+class StubKVCache:
+    max_size: Optional[int]
+    offset: int
+
+    def __init__(self, max_size: Optional[int]):
+        self.max_size = max_size
+        self.offset = 0
+
+
+def make_prompt_cache(
+    model: Any, max_kv_size: Optional[int] = None
+) -> List[StubKVCache]:
+    return [StubKVCache(max_kv_size)]
+
+
+def trim_prompt_cache(cache: List[Any], num_tokens: int) -> int:
+    return 0
+
+
+def save_prefix(path: str, cache: List[Any], length: int) -> bool:
+    """Writes what the stub's KV cache holds, which is only its size."""
+    Path(path).write_text(json.dumps({"max_size": cache[0].max_size, "offset": length}))
+    return True
+
+
+def load_prefix(path: str) -> List[StubKVCache]:
+    state = json.loads(Path(path).read_text())
+    layer = StubKVCache(state["max_size"])
+    layer.offset = state["offset"]
+    return [layer]
+
+
+def kv_size(cache: List[Any]) -> Optional[int]:
+    return cache[0].max_size if cache else None
+
+
+def token_array(tokens: List[int]) -> array:
+    return array("i", tokens)
+
+
+def sampling_processors(options: Any) -> List[Any]:
+    """Sampling is left to `create_generator`, which ignores it."""
+    return []
+
+
+def compile_grammar(kit: StubModelKit, schema: str) -> None:
+    """Formats are left to `create_generator`."""
+    return None
+
+
+def can_decode(kit: StubModelKit) -> bool:
+    """
+    The stub has no `make_decoder`, `make_decode_batch` or
+    `make_grammar_processor`, so requests are always left to `create_generator`.
+    """
+    return False
+
+
+def can_see(kit: StubModelKit) -> bool:
+    return True
+
+
+def prepare_image(data: bytes, max_size: int) -> str:
+    """The image as it was sent, since the stub doesn't look at it."""
+    return base64.b64encode(data).decode()
+
+
+def can_embed(kit: StubModelKit) -> bool:
+    return True
+
+
+def embed_batch(kit: StubModelKit, inputs: List[List[int]]) -> List[array]:
+    """Derives a unit vector from a hash of each input."""
+    embeddings = []
+    for tokens in inputs:
+        digest = hashlib.sha256(array("i", tokens).tobytes()).digest()
+        vector = [digest[i % len(digest)] - 127.5 for i in range(EMBEDDING_SIZE)]
+        norm = sum(x * x for x in vector) ** 0.5
+        embeddings.append(array("f", [x / norm for x in vector]))
+    return embeddings
+
+
+def _sleep(tokens: int, rate_variable: str):
+    rate = config.get_int(rate_variable, 0)
+    if rate and tokens > 0:
+        time.sleep(tokens / rate)
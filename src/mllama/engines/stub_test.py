@@ -0,0 +1,142 @@
+import base64
+import json
+from fastapi.testclient import TestClient
+from mllama.engines import stub
+from mllama.main import app
+from mllama.model import Model
+
+CLIENT = TestClient(app)
+
+
+def test_create_generator():
+    kit = stub.load_model("stub", max_kv_size=4096)
+    prompt = stub.tokenize(kit, "<|im_start|>user\nHi<|im_end|>\n")
+
+    results = list(stub.create_generator(kit, prompt, json_schema="{}", max_tokens=3))
+
+    assert json.loads("".join(result.text for result in results)) == {
+        "response": "The sky is"
+    }
+    assert len(kit.cache_wrapper.tokens) == len(prompt) + 3
+
+
+def test_chat_reuses_prefix(monkeypatch):
+    monkeypatch.setenv("MLLAMA_ENGINE", "stub")
+    params = {
+        "model": "stub/chat",
+        "messages": [
+            # Longer than a block of the prefix cache
+            {"role": "system", "content": "You are a helpful assistant. " * 8},
+            {"role": "user", "content": "Why is the sky blue?"},
+        ],
+        "options": {"max_tokens": 4},
+        "stream": False,
+    }
+
+    first = CLIENT.post("/api/chat", json=params).json()
+    second = CLIENT.post("/api/chat", json=params).json()
+
+    assert first["message"]["content"] == "The sky is blue"
+    assert first["prompt_cache_count"] == 0
+    assert second["prompt_cache_count"] == first["prompt_eval_count"] - 1
+
+
+def test_chat_restores_prefix_from_disk(monkeypatch, tmp_path):
+    monkeypatch.setenv("MLLAMA_ENGINE", "stub")
+    monkeypatch.setenv("MLLAMA_PREFIX_CACHE_DIR", str(tmp_path))
+    monkeypatch.setenv("MLLAMA_PREFIX_CACHE_MIN_TOKENS", "128")
+    params = {
+        "model": "stub/store",
+        "messages": [
+            {"role": "system", "content": "You are a helpful assistant. " * 8},
+            {"role": "user", "content": "Why is the sky blue?"},
+        ],
+        "options": {"max_tokens": 4},
+        "stream": False,
+    }
+
+    try:
+        CLIENT.post("/api/chat", json=params)
+        # Sharing the system prompt with the first request snapshots it.
+        CLIENT.post("/api/chat", json=params)
+        Model.unload("stub/store")
+        params["messages"][1]["content"] = "And sunsets?"
+        restored = CLIENT.post("/api/chat", json=params).json()
+    finally:
+        Model.unload("stub/store")
+
+    assert restored["prompt_cache_count"] == 256
+
+
+def test_generation_ends_at_deadline(monkeypatch):
+    monkeypatch.setenv("MLLAMA_ENGINE", "stub")
+    monkeypatch.setenv("MLLAMA_STUB_EVAL_RATE", "100")
+    params = {
+        "model": "stub/deadline",
+        "prompt": "Why is the sky blue?",
+        "options": {"num_predict": 1000},
+        "stream": False,
+    }
+
+    try:
+        result = CLIENT.post(
+            "/api/generate", json=params, headers={"X-Mllama-Timeout": "0.2"}
+        ).json()
+        invalid = CLIENT.post(
+            "/api/generate", json={**params, "options": {"timeout": "soon"}}
+        )
+    finally:
+        Model.unload("stub/deadline")
+
+    assert result["done_reason"] == "deadline"
+    assert 0 < result["eval_count"] < 1000
+    assert invalid.status_code == 400
+
+
+def test_chat_prepares_each_image_once(monkeypatch):
+    monkeypatch.setenv("MLLAMA_ENGINE", "stub")
+    screenshot = base64.b64encode(b"screenshot of a blue sky").decode()
+    prepared = []
+    prepare_image = stub.prepare_image
+    monkeypatch.setattr(
+        stub,
+        "prepare_image",
+        lambda data, max_size: prepared.append(data) or prepare_image(data, max_size),
+    )
+    images_b64 = []
+    create_generator = stub.create_generator
+
+    def record_images(kit, tokens, **kwargs):
+        images_b64.append(kwargs["images_b64"])
+        return create_generator(kit, tokens, **kwargs)
+
+    monkeypatch.setattr(stub, "create_generator", record_images)
+    messages = [{"role": "user", "content": "Why is it blue?", "images": [screenshot]}]
+
+    try:
+        for turn in range(3):
+            result = CLIENT.post(
+                "/api/chat",
+                json={
+                    "model": "stub/vision",
+                    "messages": messages,
+                    "options": {"max_tokens": 4},
+                    "stream": False,
+                },
+            ).json()
+            # Clients resend the screenshot with each turn.
+            messages = messages + [
+                result["message"],
+                {"role": "user", "content": "And now?", "images": [screenshot]},
+            ]
+
+        invalid = CLIENT.post(
+            "/api/generate",
+            json={"model": "stub/vision", "prompt": "Hi", "images": ["not base64!"]},
+        )
+    finally:
+        Model.unload("stub/vision")
+
+    assert prepared == [b"screenshot of a blue sky"]
+    assert images_b64 == [[screenshot], [screenshot] * 2, [screenshot] * 3]
+    assert invalid.status_code == 400
@@ -10,7 +10,17 @@ class EndEvent(BaseModel):
     done_reason: Optional[str] = None
     total_duration: int = 0
     load_duration: int = 0
+    # Time spent waiting for a free slot on the model
+    queue_duration: int = 0
     prompt_eval_count: int = 0
     prompt_eval_duration: int = 0
+    # Prompt tokens whose KV state was reused from an earlier request, which
+    # are not included in `prompt_eval_count`
+    prompt_cache_count: int = 0
     eval_count: int = 0
     eval_duration: int = 0
+    # Fraction of draft model proposals accepted, when decoding speculatively
+    draft_acceptance_rate: Optional[float] = None
+    # Whether the grammar for the request's format was already compiled, "hit"
+    # or "miss", when decoding with one
+    grammar_cache: Optional[str] = None
@@ -0,0 +1,72 @@
+import hashlib
+import json
+from typing import Any, Callable, Dict, List, Literal, Optional
+from mllama.lru import LRUCache
+
+# What `"format": "json"` asks for
+JSON_OBJECT = {"type": "object", "additionalProperties": True}
+
+
+def canonical_schema(format: Literal["json"] | Dict[str, Any] | None) -> Optional[str]:
+    """
+    The JSON schema a request's `format` asks for, serialized so that schemas
+    differing only in key order or whitespace are the same string.
+    """
+    if format is None:
+        return None
+    schema = JSON_OBJECT if format == "json" else format
+    return json.dumps(schema, sort_keys=True, separators=(",", ":"))
+
+
+class Grammar:
+    """
+    A JSON schema compiled against a model's vocabulary: a state machine over
+    tokens, plus the mask of tokens allowed in each state, built the first time
+    the state is reached and kept for later requests.
+    """
+
+    guide: Any
+    initial_state: int
+    # Upper bound on the memory held once every state's mask has been built
+    nbytes: int
+    masks: Dict[int, Any]
+
+    def __init__(self, guide: Any, nbytes: int):
+        self.guide = guide
+        self.initial_state = guide.initial_state
+        self.nbytes = nbytes
+        self.masks = {}
+
+    def next_state(self, state: int, token: int) -> int:
+        return self.guide.get_next_state(state, token)
+
+    def allowed(self, state: int) -> List[int]:
+        tokens = self.guide.get_next_instruction(state).tokens
+        return tokens.tolist() if hasattr(tokens, "tolist") else list(tokens)
+
+    def mask(self, state: int, build: Callable[[List[int]], Any]) -> Any:
+        mask = self.masks.get(state)
+        if mask is None:
+            mask = self.masks[state] = build(self.allowed(state))
+        return mask
+
+
+class GrammarCache:
+    """Compiled grammars for one model, by hash of their canonical schema."""
+
+    grammars: "LRUCache[str, Grammar]"
+
+    def __init__(self, max_bytes: int):
+        self.grammars = LRUCache(max_bytes)
+
+    def get(
+        self, schema: str, compile: Callable[[str], Optional[Grammar]]
+    ) -> Optional[Grammar]:
+        """Returns the grammar for `schema`, compiling it on a miss. None if it can't be compiled."""
+        key = hashlib.sha256(schema.encode()).hexdigest()
+        grammar = self.grammars.get(key)
+        if grammar is None:
+            grammar = compile(schema)
+            if grammar is not None:
+                self.grammars.put(key, grammar, grammar.nbytes)
+        return grammar
@@ -0,0 +1,57 @@
+from typing import Dict, List
+from mllama.grammar import Grammar, GrammarCache, canonical_schema
+
+
+class Instruction:
+    def __init__(self, tokens: List[int]):
+        self.tokens = tokens
+
+
+class DigitsGuide:
+    """Accepts one or more digits (tokens 0-9), then EOS (token 10)."""
+
+    initial_state = 0
+
+    def get_next_instruction(self, state: int) -> Instruction:
+        return Instruction(list(range(10)) + ([10] if state == 1 else []))
+
+    def get_next_state(self, state: int, token: int) -> int:
+        return 1 if token < 10 else -1
+
+
+def test_canonical_schema():
+    assert canonical_schema({"type": "object", "required": ["a"]}) == canonical_schema(
+        {"required": ["a"], "type": "object"}
+    )
+    assert canonical_schema("json") == '{"additionalProperties":true,"type":"object"}'
+    assert canonical_schema(None) is None
+
+
+def test_cache_compiles_once():
+    cache = GrammarCache(max_bytes=2**20)
+    compiled: List[str] = []
+
+    def compile(schema: str) -> Grammar:
+        compiled.append(schema)
+        return Grammar(DigitsGuide(), nbytes=1024)
+
+    schema = canonical_schema({"type": "integer"})
+    assert cache.get(schema, compile) is cache.get(schema, compile)
+    assert compiled == [schema]
+
+
+def test_masks_are_built_once_per_state():
+    grammar = Grammar(DigitsGuide(), nbytes=1024)
+    built: Dict[int, List[int]] = {}
+
+    def build(allowed: List[int]) -> List[int]:
+        built[len(built)] = allowed
+        return allowed
+
+    state = grammar.initial_state
+    assert 10 not in grammar.mask(state, build)
+    state = grammar.next_state(state, 4)
+    assert 10 in grammar.mask(state, build)
+    grammar.mask(grammar.next_state(state, 2), build)
+
+    assert len(built) == 2
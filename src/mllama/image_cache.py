@@ -0,0 +1,68 @@
+import base64
+import binascii
+import hashlib
+from types import ModuleType
+from typing import List, Optional, Tuple
+from fastapi import HTTPException
+from mllama import config
+from mllama.lru import LRUCache
+
+
+class ImageCache:
+    """
+    Images decoded and resized for vision models, by the hash of their base64
+    encoding, so a chat that sends the same screenshot on every turn only has
+    it decoded and resized once.
+    """
+
+    images: "LRUCache[str, str]"
+
+    def __init__(self, max_bytes: int):
+        self.images = LRUCache(max_bytes)
+
+    def prepare(
+        self, engine: ModuleType, images: List[str], max_size: int
+    ) -> Tuple[List[str], List[str]]:
+        """
+        Returns each image's digest and the image in the form `engine` takes,
+        scaled down to at most `max_size` pixels on each side. Raises a 400 if
+        an image can't be decoded. Blocks, so called on a thread.
+        """
+        digests = []
+        prepared = []
+        for image in images:
+            digest = hashlib.sha256(image.encode()).hexdigest()
+            key = f"{digest}:{max_size}"
+            value = self.images.get(key)
+            if value is None:
+                try:
+                    value = engine.prepare_image(
+                        base64.b64decode(image, validate=True), max_size
+                    )
+                except (binascii.Error, OSError, ValueError) as e:
+                    raise HTTPException(
+                        status_code=400,
+                        detail=f"Invalid image: {e}, expected a base64-encoded image",
+                    )
+                self.images.put(key, value, len(value))
+            digests.append(digest)
+            prepared.append(value)
+        return digests, prepared
+
+
+_cache: Optional[ImageCache] = None
+
+
+def cache() -> ImageCache:
+    """The server's image cache, holding up to MLLAMA_IMAGE_CACHE_SIZE (default: `256MB`)."""
+    global _cache
+    if _cache is None:
+        _cache = ImageCache(config.get_size("MLLAMA_IMAGE_CACHE_SIZE", "256MB"))
+    return _cache
+
+
+def prepare(engine: ModuleType, images: List[str]) -> Tuple[List[str], List[str]]:
+    """Prepares images with the server's cache, see `ImageCache.prepare`."""
+    return cache().prepare(
+        engine, images, config.get_int("MLLAMA_IMAGE_MAX_SIZE", 2048)
+    )
@@ -0,0 +1,40 @@
+import base64
+from types import SimpleNamespace
+from fastapi import HTTPException
+import pytest
+from mllama.image_cache import ImageCache
+
+
+def engine(prepared):
+    def prepare_image(data, max_size):
+        prepared.append((data, max_size))
+        return data.decode().upper()
+
+    return SimpleNamespace(prepare_image=prepare_image)
+
+
+def test_prepares_each_image_once():
+    prepared = []
+    cache = ImageCache(2**20)
+    first = base64.b64encode(b"first").decode()
+    second = base64.b64encode(b"second").decode()
+
+    digests, images = cache.prepare(engine(prepared), [first, second], 1024)
+    again, images_again = cache.prepare(engine(prepared), [second, first], 1024)
+
+    assert images == ["FIRST", "SECOND"]
+    assert images_again == ["SECOND", "FIRST"]
+    assert again == digests[::-1]
+    assert prepared == [(b"first", 1024), (b"second", 1024)]
+    # Resized again for another size
+    cache.prepare(engine(prepared), [first], 512)
+    assert prepared[-1] == (b"first", 512)
+
+
+def test_rejects_invalid_image():
+    cache = ImageCache(2**20)
+
+    with pytest.raises(HTTPException) as error:
+        cache.prepare(engine([]), ["not base64!"], 1024)
+
+    assert error.value.status_code == 400
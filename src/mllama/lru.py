@@ -0,0 +1,47 @@
+from collections import OrderedDict
+import threading
+from typing import Generic, Hashable, Optional, Tuple, TypeVar
+
+K = TypeVar("K", bound=Hashable)
+V = TypeVar("V")
+
+
+class LRUCache(Generic[K, V]):
+    """A thread-safe mapping that evicts its least recently used items once their total size exceeds `max_bytes`."""
+
+    max_bytes: int
+    nbytes: int
+    items: "OrderedDict[K, Tuple[V, int]]"
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self.items = OrderedDict()
+        self.lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self.items)
+
+    def __contains__(self, key: K) -> bool:
+        return key in self.items
+
+    def get(self, key: K) -> Optional[V]:
+        with self.lock:
+            item = self.items.get(key)
+            if item is None:
+                return None
+            self.items.move_to_end(key)
+            return item[0]
+
+    def put(self, key: K, value: V, nbytes: int):
+        with self.lock:
+            previous = self.items.pop(key, None)
+            if previous is not None:
+                self.nbytes -= previous[1]
+            if nbytes > self.max_bytes:
+                return
+            self.items[key] = (value, nbytes)
+            self.nbytes += nbytes
+            while self.nbytes > self.max_bytes:
+                _, (_, evicted) = self.items.popitem(last=False)
+                self.nbytes -= evicted
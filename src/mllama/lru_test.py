@@ -0,0 +1,33 @@
+from mllama.lru import LRUCache
+
+
+def test_evicts_least_recently_used():
+    cache = LRUCache(max_bytes=20)
+    cache.put("a", 1, nbytes=10)
+    cache.put("b", 2, nbytes=10)
+    assert cache.get("a") == 1
+
+    cache.put("c", 3, nbytes=10)
+
+    assert cache.get("b") is None
+    assert cache.get("a") == 1
+    assert cache.get("c") == 3
+    assert cache.nbytes == 20
+
+
+def test_replace():
+    cache = LRUCache(max_bytes=20)
+    cache.put("a", 1, nbytes=10)
+    cache.put("a", 2, nbytes=5)
+
+    assert cache.get("a") == 2
+    assert cache.nbytes == 5
+
+
+def test_items_larger_than_the_cache_are_not_stored():
+    cache = LRUCache(max_bytes=20)
+    cache.put("a", 1, nbytes=10)
+    cache.put("b", 2, nbytes=30)
+
+    assert "b" not in cache
+    assert cache.get("a") == 1
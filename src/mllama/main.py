@@ -1,16 +1,44 @@
+from contextlib import asynccontextmanager
+import threading
 from fastapi import FastAPI, HTTPException
 from pydantic import BaseModel
 from typing import Literal, Optional, List, Dict, Any
-import huggingface_hub
-from mllama.routers import chat, generate, tags
+from mllama import catalog, preload
+from mllama.model import clean_cache
+from mllama.routers import chat, create, embed, generate, metrics, ps, pull, ready, tags
 from dotenv import load_dotenv
 
 load_dotenv()
 
-app = FastAPI()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Starts the server's background work, which importing it doesn't."""
+    stop_cleaning = threading.Event()
+    threading.Thread(
+        target=clean_cache, args=(stop_cleaning,), name="clean cache", daemon=True
+    ).start()
+    stop_watching = threading.Event()
+    threading.Thread(
+        target=catalog.watch, args=(stop_watching,), name="catalog", daemon=True
+    ).start()
+    preloading = preload.start()
+    yield
+    preloading.cancel()
+    stop_cleaning.set()
+    stop_watching.set()
+
+
+app = FastAPI(lifespan=lifespan)
 
 app.include_router(chat.router)
+app.include_router(create.router)
+app.include_router(embed.router)
 app.include_router(generate.router)
+app.include_router(metrics.router)
+app.include_router(ps.router)
+app.include_router(pull.router)
+app.include_router(ready.router)
 app.include_router(tags.router)
 
 
@@ -38,24 +66,6 @@ class Message(BaseModel):
     # tool_calls: List[Tool] = []
 
 
-class CreateModelRequest(BaseModel):
-    # uses `model:tag` format
-    model: str
-    modelfile: Optional[str]
-    stream: Optional[bool]
-    path: Optional[str]
-    quantize: Optional[str]
-
-
-class CreateModelResponse(BaseModel):
-    status: str
-
-
-@app.post("/api/create", response_model=CreateModelResponse)
-def create_model(request: CreateModelRequest):
-    raise HTTPException(status_code=501, detail="Not implemented")
-
-
 class ShowModelInformationRequest(BaseModel):
     # uses `model:tag` format
     model: str
@@ -110,18 +120,6 @@ def delete_model(request: DeleteModelRequest):
     raise HTTPException(status_code=501, detail="Not implemented")
 
 
-class PullRequest(BaseModel):
-    model: str
-    insecure: Optional[bool] = False
-    stream: Optional[bool] = True
-
-
-@app.post("/api/pull")
-def pull(request: PullRequest):
-    huggingface_hub.snapshot_download(request.model)
-    return {"status": "success"}
-
-
 class PushModelRequest(BaseModel):
     # uses `model:tag` format
     model: str
@@ -136,39 +134,3 @@ class PushModelResponse(BaseModel):
 @app.post("/api/push", response_model=PushModelResponse)
 def push_model(request: PushModelRequest):
     raise HTTPException(status_code=501, detail="Not implemented")
-
-
-class GenerateEmbeddingsRequest(BaseModel):
-    # uses `model:tag` format
-    model: str
-    input: List[str]
-    truncate: Optional[bool]
-    options: Optional[Dict[str, Any]]
-    keep_alive: Optional[str]
-
-
-class GenerateEmbeddingsResponse(BaseModel):
-    # uses `model:tag` format
-    model: str
-    embeddings: List[List[float]]
-
-    # Measured in nanoseconds
-    total_duration: Optional[int]
-
-    # Measured in nanoseconds
-    load_duration: Optional[int]
-    prompt_eval_count: Optional[int]
-
-
-@app.post("/api/embed", response_model=GenerateEmbeddingsResponse)
-def generate_embeddings(request: GenerateEmbeddingsRequest):
-    raise HTTPException(status_code=501, detail="Not implemented")
-
-
-class ListRunningModelsResponse(BaseModel):
-    models: List[Dict[str, Any]]
-
-
-@app.get("/api/ps", response_model=ListRunningModelsResponse)
-def list_running_models():
-    raise HTTPException(status_code=501, detail="Not implemented")
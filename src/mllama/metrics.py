@@ -0,0 +1,175 @@
+from bisect import bisect_left
+from typing import Dict, List, Sequence, Tuple
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+RATE_BUCKETS = (1, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
+ACCEPTANCE_BUCKETS = (0.1, 0.2, 0.3, 0.4, 0.5, 0.6, 0.7, 0.8, 0.9, 1)
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str]) -> str:
+    if not names:
+        return ""
+    escaped = [
+        str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        for value in values
+    ]
+    return (
+        "{" + ",".join(f'{name}="{value}"' for name, value in zip(names, escaped)) + "}"
+    )
+
+
+class Metric:
+    """
+    A metric in the Prometheus text format. Only updated and rendered from the
+    event loop, so worker threads hand their measurements back in events.
+    """
+
+    name: str
+    help: str
+    type: str
+    labels: Tuple[str, ...]
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        METRICS.append(self)
+
+    def render(self) -> List[str]:
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.type}"]
+
+
+class Counter(Metric):
+    type = "counter"
+    values: Dict[Tuple[str, ...], float]
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = ()):
+        super().__init__(name, help, labels)
+        self.values = {}
+
+    def inc(self, *labels: str, amount: float = 1):
+        self.values[labels] = self.values.get(labels, 0) + amount
+
+    def render(self) -> List[str]:
+        return super().render() + [
+            f"{self.name}{_format_labels(self.labels, labels)} {value}"
+            for labels, value in self.values.items()
+        ]
+
+
+class Histogram(Metric):
+    type = "histogram"
+    buckets: Tuple[float, ...]
+    # Per label set, the count in each bucket (not cumulative) followed by +Inf
+    counts: Dict[Tuple[str, ...], List[int]]
+    sums: Dict[Tuple[str, ...], float]
+
+    def __init__(
+        self,
+        name: str,
+        help: str,
+        labels: Sequence[str] = (),
+        buckets: Sequence[float] = LATENCY_BUCKETS,
+    ):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(buckets)
+        self.counts = {}
+        self.sums = {}
+
+    def observe(self, value: float, *labels: str):
+        counts = self.counts.get(labels)
+        if counts is None:
+            counts = self.counts[labels] = [0] * (len(self.buckets) + 1)
+            self.sums[labels] = 0
+        counts[bisect_left(self.buckets, value)] += 1
+        self.sums[labels] += value
+
+    def render(self) -> List[str]:
+        lines = super().render()
+        for labels, counts in self.counts.items():
+            total = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                total += count
+                le = "+Inf" if bound == float("inf") else f"{bound}"
+                lines.append(
+                    f"{self.name}_bucket{_format_labels(self.labels + ('le',), labels + (le,))} {total}"
+                )
+            lines.append(
+                f"{self.name}_sum{_format_labels(self.labels, labels)} {self.sums[labels]}"
+            )
+            lines.append(
+                f"{self.name}_count{_format_labels(self.labels, labels)} {total}"
+            )
+        return lines
+
+
+METRICS: List[Metric] = []
+
+
+def render() -> str:
+    return "\n".join(line for metric in METRICS for line in metric.render()) + "\n"
+
+
+time_to_first_token = Histogram(
+    "mllama_time_to_first_token_seconds",
+    "Time from receiving a request to generating its first token",
+    ["model", "endpoint"],
+)
+inter_token_latency = Histogram(
+    "mllama_inter_token_latency_seconds",
+    "Time between consecutive generated tokens",
+    ["model", "endpoint"],
+)
+prompt_eval_rate = Histogram(
+    "mllama_prompt_eval_tokens_per_second",
+    "Prompt evaluation speed per request",
+    ["model", "endpoint"],
+    buckets=RATE_BUCKETS,
+)
+eval_rate = Histogram(
+    "mllama_eval_tokens_per_second",
+    "Generation speed per request",
+    ["model", "endpoint"],
+    buckets=RATE_BUCKETS,
+)
+load_duration = Histogram(
+    "mllama_load_duration_seconds",
+    "Time each request waited for its model to load",
+    ["model", "endpoint"],
+)
+queue_duration = Histogram(
+    "mllama_queue_duration_seconds",
+    "Time each request waited for a free slot on its model",
+    ["model", "endpoint"],
+)
+draft_acceptance_rate = Histogram(
+    "mllama_draft_acceptance_rate",
+    "Fraction of draft model proposals accepted per speculative generation",
+    ["model", "endpoint"],
+    buckets=ACCEPTANCE_BUCKETS,
+)
+requests = Counter(
+    "mllama_requests_total",
+    "Finished generations by done_reason",
+    ["model", "endpoint", "done_reason"],
+)
+response_cache = Counter(
+    "mllama_response_cache_requests_total",
+    "Deterministic requests looked up in the response cache, by result",
+    ["model", "endpoint", "result"],
+)
+grammar_cache = Counter(
+    "mllama_grammar_cache_requests_total",
+    "Compiled grammars for request formats looked up in the cache, by result",
+    ["model", "result"],
+)
+rejections = Counter(
+    "mllama_rejected_requests_total",
+    "Requests turned away because their model's queue was full",
+    ["model", "endpoint"],
+)
+client_disconnects = Counter(
+    "mllama_client_disconnects_total",
+    "Generations abandoned because the client disconnected",
+    ["model", "endpoint"],
+)
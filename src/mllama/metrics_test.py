@@ -0,0 +1,41 @@
+from mllama.metrics import METRICS, Counter, Histogram, render
+
+
+def test_counter():
+    counter = Counter("test_counter_total", "A counter", ["model"])
+    METRICS.remove(counter)
+    counter.inc("a")
+    counter.inc("a")
+    counter.inc('say "hi"', amount=3)
+
+    assert counter.render() == [
+        "# HELP test_counter_total A counter",
+        "# TYPE test_counter_total counter",
+        'test_counter_total{model="a"} 2',
+        'test_counter_total{model="say \\"hi\\""} 3',
+    ]
+
+
+def test_histogram():
+    histogram = Histogram("test_seconds", "A histogram", ["model"], buckets=[1, 2])
+    METRICS.remove(histogram)
+    histogram.observe(0.5, "a")
+    histogram.observe(2, "a")
+    histogram.observe(3, "a")
+
+    assert histogram.render() == [
+        "# HELP test_seconds A histogram",
+        "# TYPE test_seconds histogram",
+        'test_seconds_bucket{model="a",le="1"} 1',
+        'test_seconds_bucket{model="a",le="2"} 2',
+        'test_seconds_bucket{model="a",le="+Inf"} 3',
+        'test_seconds_sum{model="a"} 5.5',
+        'test_seconds_count{model="a"} 3',
+    ]
+
+
+def test_render_includes_generation_metrics():
+    text = render()
+
+    assert "# TYPE mllama_time_to_first_token_seconds histogram" in text
+    assert "# TYPE mllama_client_disconnects_total counter" in text
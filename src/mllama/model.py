@@ -1,78 +1,159 @@
+from array import array
+import asyncio
+import copy
+import math
+import random
 from datetime import datetime, timedelta
-import json
+import os
 import threading
-import time
+from types import ModuleType, SimpleNamespace
 from typing import List, Literal
-from typing import Any, Dict, List, Optional
+from typing import (
+    Any,
+    AsyncGenerator,
+    Callable,
+    Dict,
+    Generator,
+    Iterator,
+    List,
+    Optional,
+    Sequence,
+    Tuple,
+)
 from fastapi import HTTPException
 from time import time_ns
-import mlx_engine.model_kit
-import mlx_engine.vision
-import mlx_engine.vision.vision_model_kit
-import huggingface_hub
 from datetime import datetime
 from typing import Dict
+from mllama import config, embeddings, engines, image_cache, metrics, response_cache
+from mllama.chat_template import CHATML, PROBES, ChatTemplate
 from mllama.events import ChunkEvent, EndEvent
+from mllama.grammar import Grammar, GrammarCache, canonical_schema
 from mllama.logger import logger
+from mllama.prefix_cache import PrefixCache, PrefixCacheEntry
+from mllama.prefix_store import PrefixStore
+from mllama.registry import ModelRegistry
+from mllama.sampling import DEFAULT_NUM_CTX, SamplingOptions
+from mllama.speculative import DecodeBatch, Decoder, SpeculativeDecoder, decode
+from mllama.stats import ModelStats
+from mllama.tokenization import PromptTokenizer
+from mllama.process import ProcessWorker
+from mllama import worker
+from mllama.worker import PRIORITIES, InferenceWorker, Job
+
+# Seconds a client rejected by a full queue is asked to wait before retrying
+RETRY_AFTER = 5
 
 
 class Model:
 
     @staticmethod
-    def load(name: str, keep_alive: str | int):
-        """Loads a model into the cache or extends its expiration."""
-        if isinstance(keep_alive, str) and keep_alive.endswith("m"):
+    async def load(name: str, keep_alive: str | int):
+        """
+        Loads a model into the cache or extends its expiration. `keep_alive` is
+        either minutes, as "5m", or a number of seconds.
+        """
+        if isinstance(keep_alive, int):
+            delta = timedelta(seconds=keep_alive)
+        elif keep_alive.endswith("m") and keep_alive[:-1].isdigit():
             delta = timedelta(minutes=int(keep_alive[:-1]))
         else:
-            raise ValueError(f"Invalid keep_alive value: {keep_alive}")
-
-        if name not in cache:
-            cache[name] = Model(name, expiration=datetime.now() + delta)
+            raise HTTPException(
+                status_code=400, detail=f"Invalid keep_alive value: {keep_alive}"
+            )
 
-        model = cache[name]
+        model = await registry.load(
+            name, lambda: Model.create(name, expiration=datetime.now() + delta)
+        )
         model.expiration = max(model.expiration, datetime.now() + delta)
+        model.last_used = datetime.now()
+        return model
+
+    @staticmethod
+    def create(name: str, expiration: datetime) -> "Model":
+        """Loads a model within the memory budget. Blocks, so called on a thread."""
+        engine = engines.get()
+        path = Model.locate(engine, name)
+        size = engine.estimate_size(path)
+        with registry.reserve(name, size + engine.max_cache_size()):
+            if config.get_int("MLLAMA_MODEL_PROCESSES", 0):
+                model: Model = ProcessModel(engine, name, path, size, expiration)
+            else:
+                model = Model(engine, name, path, size, expiration)
+            registry.add(model)
         return model
 
     @staticmethod
     def unload(name: str):
         """Unloads a model from the cache."""
-        if name in cache:
-            del cache[name]
+        registry.remove(name)
 
+    @staticmethod
+    def locate(engine: ModuleType, name: str) -> str:
+        """Finds the local snapshot of a model."""
+        path = engine.locate(name)
+        if path is None:
+            raise HTTPException(status_code=404, detail=f"Model {name} not found")
+        return path
+
+    # The `mllama.engines` module the model was loaded with
+    engine: ModuleType
     name: str
-    model: (
-        mlx_engine.model_kit.ModelKit
-        | mlx_engine.vision.vision_model_kit.VisionModelKit
-    )
+    # The engine's model kit
+    model: Any
+    path: str
+    # Estimated resident memory in bytes
+    size: int
+    # The most the model's caches may hold, in bytes
+    cache_size: int
     expiration: datetime
+    last_used: datetime
+    # Generations queued or running
+    in_flight: int
+    # Whether requests may include images
+    vision: bool
     stop_strings: List[str]
+    chat_template: ChatTemplate
+    prompt_tokenizer: PromptTokenizer
+    prefix_cache: Optional[PrefixCache]
+    prefix_store: Optional[PrefixStore]
+    grammars: GrammarCache
+    worker: InferenceWorker
+    # Where concurrent sequences decoding outside the engine share forward passes
+    batch: Optional[DecodeBatch]
+    stats: ModelStats
 
     def __init__(
         self,
+        engine: ModuleType,
         name: str,
+        path: str,
+        size: int,
         expiration: datetime,
     ):
+        self.engine = engine
         self.name = name
+        self.path = path
+        self.size = size
+        self.cache_size = engine.max_cache_size()
         self.expiration = expiration
+        self.last_used = datetime.now()
+        self.in_flight = 0
 
         logger.info(f"model - {name} - load")
 
-        path = huggingface_hub.snapshot_download(name, local_files_only=True)
-        if path is None:
-            raise HTTPException(status_code=404, detail=f"Model {name} not found")
-
-        self.model = mlx_engine.load_model(
-            path, max_kv_size=4096, trust_remote_code=False
-        )
+        self.model = engine.load_model(path, max_kv_size=DEFAULT_NUM_CTX)
+        self.vision = engine.can_see(self.model)
 
         tokenizer = self.model.tokenizer
 
-        if tokenizer.chat_template is not None:
-            pass
-        else:
-            tokenizer.chat_template = open(
-                "src/mllama/chat_templates/chatml.jinja"
-            ).read()
+        if tokenizer.chat_template is None:
+            tokenizer.chat_template = CHATML
+        self.chat_template = ChatTemplate(tokenizer)
+        self.prompt_tokenizer = PromptTokenizer(
+            tokenizer,
+            encode=lambda text: engine.tokenize(self.model, text),
+            probe=self.chat_template.render(PROBES[0]),
+        )
 
         if name.startswith("mlx-community/llama3.3") or name.startswith("Qwen/"):
             self.stop_strings = ["<|im_end|>"]
@@ -81,90 +162,859 @@ class Model:
         else:
             self.stop_strings = ["<|im_end|>"]
 
-    def template(self, **kwargs):
-        return self.model.tokenizer.apply_chat_template(
-            tokenize=False, add_generation_prompt=True, **kwargs
+        # Sequences can only be interleaved when each one can be given its own
+        # KV cache. Vision models manage their cache internally.
+        if getattr(self.model, "cache_wrapper", None) is not None:
+            self.prefix_cache = PrefixCache(
+                config.get_size("MLLAMA_PREFIX_CACHE_SIZE", "4GB")
+            )
+            self.prefix_cache.release(
+                self.prefix_cache.add(self.model.cache_wrapper), [], 0
+            )
+            directory = os.environ.get("MLLAMA_PREFIX_CACHE_DIR")
+            self.prefix_store = (
+                PrefixStore(
+                    directory,
+                    os.path.basename(path),
+                    config.get_int("MLLAMA_PREFIX_CACHE_MIN_TOKENS", 1024),
+                    config.get_size("MLLAMA_PREFIX_CACHE_DISK_SIZE", "32GB"),
+                )
+                if directory
+                else None
+            )
+            parallel = config.get_int("MLLAMA_NUM_PARALLEL", 4)
+        else:
+            self.prefix_cache = None
+            self.prefix_store = None
+            parallel = 1
+
+        self.grammars = GrammarCache(
+            config.get_size("MLLAMA_GRAMMAR_CACHE_SIZE", "1GB")
+        )
+        self.worker = InferenceWorker(name, parallel=parallel)
+        self.batch = (
+            engine.make_decode_batch(self.model)
+            if parallel > 1 and engine.can_decode(self.model)
+            else None
         )
+        self.stats = ModelStats()
+
+    @property
+    def resident_size(self) -> int:
+        """Estimated memory in use, including KV caches kept for prefix reuse."""
+        kv_size = self.prefix_cache.nbytes if self.prefix_cache is not None else 0
+        return self.size + kv_size
+
+    @property
+    def footprint(self) -> int:
+        """
+        The memory counted against the budget: the weights plus the most the
+        caches may hold, or more while active sequences hold extra KV state.
+        """
+        return max(self.resident_size, self.size + self.cache_size)
+
+    def close(self):
+        """Stops the worker once in-flight generations finish."""
+        self.worker.stop()
+
+    def template(self, messages: List[Dict[str, Any]]) -> str:
+        return self.chat_template.render(messages)
 
     async def generate(
         self,
         start_time: int,
-        prompt: Optional[str],
+        prompt: str,
         options: Dict[str, Any],
         format: Literal["json"] | Dict[str, Any] | None,
-    ):
-        load_time = time_ns()
-
-        tokens = mlx_engine.tokenize(self.model, prompt)
+        endpoint: Literal["chat", "generate", "warmup"],
+        priority: int = PRIORITIES["interactive"],
+        deadline: Optional[int] = None,
+        images: Sequence[str] = (),
+    ) -> AsyncGenerator[ChunkEvent | EndEvent, None]:
+        """
+        Admits a generation, rejecting it before any response is sent if its
+        options are invalid or the model's queue is full, and returns its events.
+        Deterministic requests may be answered from the response cache without
+        running the model. A generation still running at `deadline`, in
+        nanoseconds since the epoch, ends with a `done_reason` of `deadline`.
+        `images` are base64-encoded, in the order the prompt refers to them.
+        """
+        sampling = SamplingOptions.parse(options)
+        image_digests: List[str] = []
+        prepared_images: List[str] = []
+        if images:
+            if not self.vision:
+                raise HTTPException(
+                    status_code=400, detail=f"Model {self.name} does not take images"
+                )
+            image_digests, prepared_images = await asyncio.to_thread(
+                image_cache.prepare, self.engine, list(images)
+            )
+        cache = response_cache.cache()
+        cache_key = None
+        if cache is not None and response_cache.is_deterministic(sampling, format):
+            cache_key = response_cache.cache_key(
+                self.name,
+                os.path.basename(self.path),
+                prompt,
+                options,
+                format,
+                image_digests,
+            )
+            cached = cache.get(cache_key)
+            metrics.response_cache.inc(
+                self.name, endpoint, "hit" if cached is not None else "miss"
+            )
+            if cached is not None:
+                return self._replay(start_time, cached)
 
-        if format == "json":
-            json_schema = '{"type": "object", "additionalProperties": true}'
-        elif format is not None:
-            json_schema = json.dumps(format)
-        else:
-            json_schema = None
-
-        logger.info(f"model - {self.name} - prompt eval")
-        generator = mlx_engine.create_generator(
-            self.model,
-            tokens,
-            images_b64=None,
-            json_schema=json_schema,
-            max_tokens=(options["max_tokens"] if "max_tokens" in options else 1024),
-            repetition_context_size=20,
-            repetition_penalty=1.1,
-            seed=None,
-            temp=0.7,
-            top_p=None,
-            min_tokens_to_keep=None,
-            stop_strings=self.stop_strings,
+        self.admit(endpoint)
+        draft = await self.load_draft(options)
+        return self._stream(
+            start_time,
+            prompt,
+            options,
+            sampling,
+            format,
+            endpoint,
+            priority,
+            draft,
+            cache_key,
+            deadline,
+            prepared_images,
         )
 
-        prompt_eval_time = None
-        done_reason = None
-        full_response = ""
-        eval_count = 0
-
-        for response_chunk in generator:
-            if prompt_eval_time is None:
-                logger.info(f"model - {self.name} - eval")
-                prompt_eval_time = time_ns()
-            yield ChunkEvent(
-                response=response_chunk.text,
-            )
-            eval_count += 1
-            full_response += response_chunk.text
-            if response_chunk.stop_condition:
-                done_reason = response_chunk.stop_condition.stop_reason
-                break
+    def admit(self, endpoint: str):
+        """Raises a 503 while more requests are waiting than MLLAMA_MAX_QUEUE allows."""
+        queue_depth = self.worker.queue_depth
+        if queue_depth >= config.get_int("MLLAMA_MAX_QUEUE", 512):
+            metrics.rejections.inc(self.name, endpoint)
+            raise HTTPException(
+                status_code=503,
+                detail=f"Model {self.name} is busy with {queue_depth} queued requests",
+                headers={"Retry-After": str(RETRY_AFTER)},
+            )
+
+    @staticmethod
+    def parse_deadline(start_time: int, timeout: Any) -> Optional[int]:
+        """The deadline for a request that must finish within `timeout` seconds of `start_time`."""
+        if timeout is None:
+            return None
+        try:
+            seconds = float(timeout)
+        except (TypeError, ValueError):
+            seconds = math.nan
+        if not 0 < seconds < math.inf:
+            raise HTTPException(
+                status_code=400,
+                detail=f"Invalid timeout: {timeout}, expected a positive number of seconds",
+            )
+        return start_time + int(seconds * 1e9)
+
+    @staticmethod
+    def parse_priority(value: Optional[str], default: str) -> int:
+        """Reads a priority class, `interactive` or `batch`."""
+        value = value or default
+        if value not in PRIORITIES:
+            raise HTTPException(
+                status_code=400,
+                detail=f"Invalid priority: {value}, expected one of {', '.join(PRIORITIES)}",
+            )
+        return PRIORITIES[value]
+
+    async def _stream(
+        self,
+        start_time: int,
+        prompt: str,
+        options: Dict[str, Any],
+        sampling: SamplingOptions,
+        format: Literal["json"] | Dict[str, Any] | None,
+        endpoint: Literal["chat", "generate", "warmup"],
+        priority: int,
+        draft: Optional["Model"],
+        cache_key: Optional[str],
+        deadline: Optional[int],
+        images: List[str],
+    ) -> AsyncGenerator[ChunkEvent | EndEvent, None]:
+        """Streams events from the model's worker thread so the event loop is never blocked."""
+        load_time = time_ns()
+        self.in_flight += 1
+        if draft is not None:
+            draft.in_flight += 1
+        job = self._submit(
+            "_generate",
+            (
+                start_time,
+                load_time,
+                prompt,
+                options,
+                sampling,
+                format,
+                draft,
+                deadline,
+                images,
+            ),
+            priority,
+        )
+        labels = (self.name, endpoint)
+        last_token_time = None
+        chunks = []
+        # Once the EndEvent is out, the job is only cleaning up.
+        ended = False
+        try:
+            async for event in job.events():
+                if isinstance(event, ChunkEvent):
+                    chunks.append(event.response)
+                    now = time_ns()
+                    if last_token_time is None:
+                        metrics.time_to_first_token.observe(
+                            (now - start_time) / 1e9, *labels
+                        )
+                    else:
+                        metrics.inter_token_latency.observe(
+                            (now - last_token_time) / 1e9, *labels
+                        )
+                    last_token_time = now
+                elif isinstance(event, EndEvent):
+                    ended = True
+                    # The job was admitted before its first event.
+                    if job.admit_time is not None:
+                        event.queue_duration = job.admit_time - job.submit_time
+                    self.record(event, labels)
+                    responses = response_cache.cache()
+                    # A response cut short by its deadline isn't the whole response.
+                    if (
+                        cache_key is not None
+                        and responses is not None
+                        and event.done_reason != "deadline"
+                    ):
+                        responses.put(
+                            cache_key,
+                            response_cache.CachedResponse(
+                                chunks=chunks,
+                                done_reason=event.done_reason,
+                                prompt_count=event.prompt_eval_count
+                                + event.prompt_cache_count,
+                            ),
+                        )
+                yield event
+        finally:
+            if not (ended or job.finished):
+                job.cancel()
+            self.in_flight -= 1
+            self.last_used = datetime.now()
+            if draft is not None:
+                draft.in_flight -= 1
+                draft.last_used = datetime.now()
 
+    async def _replay(
+        self, start_time: int, response: response_cache.CachedResponse
+    ) -> AsyncGenerator[ChunkEvent | EndEvent, None]:
+        """Streams a cached response, timed as a request that evaluated nothing."""
+        load_time = time_ns()
+        for chunk in response.chunks:
+            yield ChunkEvent(response=chunk)
         end_time = time_ns()
+        self.last_used = datetime.now()
         yield EndEvent(
+            done_reason=response.done_reason,
             total_duration=end_time - start_time,
             load_duration=load_time - start_time,
-            prompt_eval_count=len(tokens),
-            prompt_eval_duration=(
-                prompt_eval_time - load_time if prompt_eval_time else 0
+            prompt_cache_count=response.prompt_count,
+            eval_count=len(response.chunks),
+            eval_duration=end_time - load_time,
+        )
+
+    async def load_draft(self, options: Dict[str, Any]) -> Optional["Model"]:
+        """Loads the draft model for speculative decoding, if one is configured."""
+        name = options.get("draft_model") or config.get_mapping(
+            "MLLAMA_DRAFT_MODELS"
+        ).get(self.name)
+        if not name or name == self.name or self.prefix_cache is None:
+            return None
+
+        draft = await Model.load(name, "5m")
+        # The draft is only useful while the target is loaded.
+        draft.expiration = max(draft.expiration, self.expiration)
+
+        if draft.prefix_cache is None:
+            raise HTTPException(
+                status_code=400, detail=f"Draft model {name} is not a text model"
+            )
+        if draft.model.tokenizer.vocab_size != self.model.tokenizer.vocab_size:
+            raise HTTPException(
+                status_code=400,
+                detail=f"Draft model {name} does not share {self.name}'s vocabulary",
+            )
+        return draft
+
+    async def embed(
+        self,
+        inputs: List[str],
+        truncate: bool,
+        options: Dict[str, Any],
+        priority: int = PRIORITIES["batch"],
+    ) -> Tuple[List[List[float]], int]:
+        """
+        Embeds `inputs`, reusing cached embeddings and computing the rest in
+        batches on the model's worker. Returns the embeddings in order along with
+        the number of tokens evaluated.
+        """
+        max_length = SamplingOptions.parse(options).num_ctx
+        keys = [
+            embeddings.cache_key(
+                self.name, os.path.basename(self.path), text, max_length, truncate
+            )
+            for text in inputs
+        ]
+        results = [embeddings.cache().get(key) for key in keys]
+        missing = [i for i, result in enumerate(results) if result is None]
+        prompt_eval_count = 0
+        if missing:
+            self.admit("embed")
+            self.in_flight += 1
+            job = self._submit(
+                "_embed", ([inputs[i] for i in missing], max_length, truncate), priority
+            )
+            try:
+                async for indices, vectors, token_count in job.events():
+                    for index, vector in zip(indices, vectors):
+                        results[missing[index]] = vector
+                        embeddings.cache().put(
+                            keys[missing[index]], vector, vector.itemsize * len(vector)
+                        )
+                    prompt_eval_count += token_count
+            finally:
+                if not job.finished:
+                    job.cancel()
+                self.in_flight -= 1
+                self.last_used = datetime.now()
+        # Every input is either cached or computed by now.
+        return [
+            list(result) for result in results if result is not None
+        ], prompt_eval_count
+
+    def _submit(self, method: str, args: Tuple[Any, ...], priority: int) -> Job:
+        """Queues a call to one of the model's blocking methods on its worker."""
+        return self.worker.submit(lambda: getattr(self, method)(*args), priority)
+
+    def _embed(
+        self, texts: List[str], max_length: int, truncate: bool
+    ) -> Iterator[Tuple[List[int], List[array], int]]:
+        return embeddings.embed(self.engine, self.model, texts, max_length, truncate)
+
+    def record(self, event: EndEvent, labels: Tuple[str, str]):
+        """Records a finished generation in the model's stats and the server's metrics."""
+        self.stats.prompt_eval.record(
+            event.prompt_eval_count, event.prompt_eval_duration
+        )
+        self.stats.eval.record(event.eval_count, event.eval_duration)
+
+        if event.prompt_eval_duration:
+            metrics.prompt_eval_rate.observe(
+                event.prompt_eval_count / (event.prompt_eval_duration / 1e9), *labels
+            )
+        if event.eval_duration:
+            metrics.eval_rate.observe(
+                event.eval_count / (event.eval_duration / 1e9), *labels
+            )
+        metrics.load_duration.observe(event.load_duration / 1e9, *labels)
+        metrics.queue_duration.observe(event.queue_duration / 1e9, *labels)
+        if event.draft_acceptance_rate is not None:
+            metrics.draft_acceptance_rate.observe(event.draft_acceptance_rate, *labels)
+        if event.grammar_cache is not None:
+            metrics.grammar_cache.inc(self.name, event.grammar_cache)
+        metrics.requests.inc(*labels, str(event.done_reason))
+
+    def _generate(
+        self,
+        start_time: int,
+        load_time: int,
+        prompt: str,
+        options: Dict[str, Any],
+        sampling: SamplingOptions,
+        format: Literal["json"] | Dict[str, Any] | None,
+        draft: Optional["Model"],
+        deadline: Optional[int],
+        images: List[str],
+    ):
+        eval_start_time = time_ns()
+        if deadline is not None and eval_start_time >= deadline:
+            # Waited for a slot past its deadline
+            yield EndEvent(
+                total_duration=eval_start_time - start_time,
+                load_duration=load_time - start_time,
+                done_reason="deadline",
+            )
+            return
+
+        def interrupted() -> bool:
+            """Whether to stop evaluating the prompt early."""
+            return worker.cancelled() or (
+                deadline is not None and time_ns() >= deadline
+            )
+
+        tokens = self.prompt_tokenizer.tokenize(prompt)
+        max_tokens = sampling.max_tokens_for(len(tokens))
+        if max_tokens == 0:
+            # Asked for no tokens at all, so the prompt isn't evaluated either.
+            yield EndEvent(
+                total_duration=time_ns() - start_time,
+                load_duration=load_time - start_time,
+            )
+            return
+
+        slot, prompt_cache_count = self._acquire_slot(tokens, sampling.num_ctx)
+        results = None
+        speculator = None
+        # Set when decoding outside the engine, whose cache holds its tokens
+        decoder = None
+        try:
+            json_schema = canonical_schema(format)
+            stop_strings = self.stop_strings + list(sampling.stop)
+
+            # Decoding outside the engine needs the KV cache to be trimmable for
+            # the whole sequence, and speculating for the draft tokens past its
+            # end as well. Only the engine takes images.
+            decodable = (
+                slot is not None
+                and not images
+                and self.engine.can_decode(self.model)
+                and len(tokens) + max_tokens <= sampling.num_ctx
+            )
+            grammar = None
+            grammar_cache = None
+            if json_schema is not None and decodable:
+                grammar, grammar_cache = self._grammar(json_schema)
+
+            logger.info(f"model - {self.name} - prompt eval")
+            # `decodable` implies a slot, checked again below so its type narrows.
+            if (
+                slot is not None
+                and decodable
+                and draft is not None
+                and json_schema is None
+                and len(tokens) + max_tokens + sampling.num_draft_tokens
+                < sampling.num_ctx
+            ):
+                speculator = self._make_speculator(
+                    slot,
+                    tokens,
+                    prompt_cache_count,
+                    draft,
+                    sampling.num_draft_tokens,
+                    sampling,
+                    interrupted,
+                )
+                decoder = speculator.target
+                prompt_cache_count = len(decoder.tokens)
+                results = self._detokenize(
+                    speculator.generate(tokens), max_tokens, stop_strings
+                )
+            elif slot is not None and (
+                grammar is not None
+                or (
+                    decodable
+                    and (self.batch is not None or not sampling.engine_compatible)
+                )
+            ):
+                processors = self.engine.sampling_processors(sampling)
+                if grammar is not None:
+                    # Masked first, so top-k, top-p and min-p only choose among
+                    # the tokens the grammar allows, and never rule them all out.
+                    processors = [
+                        self.engine.make_grammar_processor(
+                            grammar, len(tokens), self.model.tokenizer.vocab_size
+                        )
+                    ] + processors
+                decoder = self._slot_decoder(
+                    slot, tokens, prompt_cache_count, sampling, processors, interrupted
+                )
+                prompt_cache_count = len(decoder.tokens)
+                results = self._detokenize(
+                    decode(decoder, tokens, self.batch), max_tokens, stop_strings
+                )
+            else:
+                self._activate_slot(slot)
+                results = self._engine_results(
+                    slot,
+                    self.engine.create_generator(
+                        self.model,
+                        tokens,
+                        images_b64=images or None,
+                        json_schema=json_schema,
+                        max_tokens=max_tokens,
+                        repetition_context_size=sampling.repetition_context_size,
+                        repetition_penalty=sampling.repetition_penalty,
+                        seed=sampling.seed,
+                        temp=sampling.temperature,
+                        top_p=sampling.top_p if sampling.top_p < 1 else None,
+                        min_tokens_to_keep=None,
+                        stop_strings=stop_strings,
+                    ),
+                )
+
+            prompt_eval_time = None
+            done_reason = None
+            full_response = ""
+            eval_count = 0
+
+            try:
+                for result in results:
+                    if result is None:
+                        # Partway through the prompt, letting others decode
+                        yield worker.PENDING
+                        continue
+                    text, stop_reason = result
+                    if prompt_eval_time is None:
+                        logger.info(f"model - {self.name} - eval")
+                        prompt_eval_time = time_ns()
+                    yield ChunkEvent(
+                        response=text,
+                    )
+                    eval_count += 1
+                    full_response += text
+                    if stop_reason:
+                        done_reason = stop_reason
+                        break
+                    if deadline is not None and time_ns() >= deadline:
+                        done_reason = "deadline"
+                        break
+            except worker.Cancelled:
+                # The prompt was abandoned partway, for the deadline or a
+                # cancellation, which nobody is waiting to hear about.
+                if worker.cancelled():
+                    raise
+                done_reason = "deadline"
+
+            end_time = time_ns()
+            yield EndEvent(
+                total_duration=end_time - start_time,
+                load_duration=load_time - start_time,
+                prompt_eval_count=len(tokens) - prompt_cache_count,
+                prompt_cache_count=prompt_cache_count,
+                prompt_eval_duration=(
+                    prompt_eval_time - eval_start_time if prompt_eval_time else 0
+                ),
+                eval_count=eval_count,
+                eval_duration=end_time - prompt_eval_time if prompt_eval_time else 0,
+                done_reason=done_reason,
+                draft_acceptance_rate=(
+                    speculator.acceptance_rate if speculator is not None else None
+                ),
+                grammar_cache=grammar_cache if grammar is not None else None,
+            )
+            logger.info(f"model - {self.name} - end")
+        finally:
+            if results is not None:
+                results.close()
+            if decoder is not None and slot is not None:
+                slot.state.tokens = self.engine.token_array(decoder.tokens)
+            self._release_slot(slot)
+
+    def _engine_results(
+        self, slot: Optional[PrefixCacheEntry], generator: Generator[Any, None, None]
+    ) -> Generator[Tuple[str, Optional[str]], None, None]:
+        """Yields the text and stop reason of each result from the engine."""
+        try:
+            while True:
+                # Other sequences may have stepped since this one last did.
+                self._activate_slot(slot)
+                result = next(generator, None)
+                if result is None:
+                    return
+                stop_reason = (
+                    result.stop_condition.stop_reason if result.stop_condition else None
+                )
+                yield result.text, stop_reason
+        finally:
+            generator.close()
+
+    def _make_speculator(
+        self,
+        slot: PrefixCacheEntry,
+        tokens: List[int],
+        cached: int,
+        draft: "Model",
+        num_draft_tokens: int,
+        sampling: SamplingOptions,
+        interrupt: Callable[[], bool],
+    ) -> SpeculativeDecoder:
+        """
+        Pairs a decoder on the slot's KV cache with one on a fresh cache for the
+        draft. The draft evaluates the whole prompt, which is cheap next to the
+        target. Both sample the same way, so the draft's proposals are likely.
+        """
+        processors = self.engine.sampling_processors(sampling)
+        return SpeculativeDecoder(
+            self._slot_decoder(slot, tokens, cached, sampling, processors, interrupt),
+            self.engine.make_decoder(
+                draft.model.model,
+                self.engine.make_prompt_cache(draft.model.model),
+                [],
+                self.model.tokenizer.vocab_size,
+                sampling.temperature,
+                processors,
+                sampling.seed,
+                interrupt=interrupt,
             ),
-            eval_count=eval_count,
-            eval_duration=end_time - prompt_eval_time if prompt_eval_time else 0,
-            done_reason=done_reason,
+            num_draft_tokens,
+            random.Random(sampling.seed) if sampling.seed is not None else None,
         )
-        logger.info(f"model - {self.name} - end")
+
+    def _slot_decoder(
+        self,
+        slot: PrefixCacheEntry,
+        tokens: List[int],
+        cached: int,
+        sampling: SamplingOptions,
+        processors: Sequence[Any],
+        interrupt: Callable[[], bool],
+    ) -> Decoder:
+        """A decoder on the slot's KV cache, cut back to the `cached` prompt tokens."""
+        wrapper = slot.state
+        offset = wrapper.cache[0].offset if wrapper.cache else 0
+        if offset > cached and not self.engine.trim_prompt_cache(
+            wrapper.cache, offset - cached
+        ):
+            wrapper.cache = self.engine.make_prompt_cache(
+                self.model.model, max_kv_size=sampling.num_ctx
+            )
+            cached = 0
+        return self.engine.make_decoder(
+            self.model.model,
+            wrapper.cache,
+            tokens[:cached],
+            self.model.tokenizer.vocab_size,
+            sampling.temperature,
+            processors,
+            sampling.seed,
+            interrupt=interrupt,
+        )
+
+    def _grammar(self, schema: str) -> Tuple[Optional[Grammar], str]:
+        """
+        The compiled grammar for a schema, or None if the engine can't compile
+        one, and whether it was a cache "hit" or "miss".
+        """
+        result = "hit"
+
+        def compile(schema: str) -> Optional[Grammar]:
+            nonlocal result
+            result = "miss"
+            logger.info(f"model - {self.name} - compile grammar")
+            return self.engine.compile_grammar(self.model, schema)
+
+        return self.grammars.get(schema, compile), result
+
+    def _detokenize(
+        self,
+        tokens: Generator[Optional[int], None, None],
+        max_tokens: int,
+        stop_strings: List[str],
+    ) -> Generator[Optional[Tuple[str, Optional[str]]], None, None]:
+        """
+        Yields the text of each generated token and the stop reason, stopping at
+        EOS, a stop string or `max_tokens` as the engine does. Text that could be
+        the start of a stop string is held back until it can't be. The None that
+        `decode` yields partway through a prompt is passed on.
+        """
+        tokenizer = self.model.tokenizer
+        detokenizer = copy.copy(tokenizer.detokenizer)
+        detokenizer.reset()
+        text = ""
+        emitted = 0
+        count = 0
+        try:
+            for token in tokens:
+                if token is None:
+                    yield None
+                    continue
+                count += 1
+                eos = token == tokenizer.eos_token_id
+                if not eos:
+                    detokenizer.add_token(token)
+                # Streaming detokenizers hold back the last word until the next
+                # one starts, so it has to be flushed once there is none.
+                if eos or count == max_tokens:
+                    detokenizer.finalize()
+                text += detokenizer.last_segment
+
+                stops = [text.find(stop) for stop in stop_strings if stop in text]
+                if stops:
+                    yield text[emitted : min(stops)], "stop_string"
+                    return
+                if eos:
+                    yield text[emitted:], "eos_token"
+                    return
+                if count == max_tokens:
+                    yield text[emitted:], None
+                    return
+
+                end = len(text) - _partial_stop_length(text, stop_strings)
+                yield text[emitted:end], None
+                emitted = max(emitted, end)
+        finally:
+            tokens.close()
+
+    def _acquire_slot(
+        self, tokens: List[int], num_ctx: int
+    ) -> Tuple[Optional[PrefixCacheEntry], int]:
+        """
+        Takes a KV cache holding up to `num_ctx` tokens for one sequence,
+        preferring the one sharing the longest prefix with `tokens`. Returns it
+        along with the number of prompt tokens it already covers. Only called
+        from the worker thread.
+        """
+        if self.prefix_cache is None:
+            return None, 0
+        slot, cached = self.prefix_cache.acquire(tokens)
+        if slot is None:
+            slot = self.prefix_cache.add(copy.copy(self.model.cache_wrapper))
+            slot.state.cache = None
+        if slot.state.cache is None or self.engine.kv_size(slot.state.cache) != num_ctx:
+            # A cache sized for another context length can't be resized.
+            slot.state.cache = self.engine.make_prompt_cache(
+                self.model.model, max_kv_size=num_ctx
+            )
+            slot.state.tokens = None
+            cached = 0
+        if self.prefix_store is not None:
+            cached = self._persist_prefix(
+                self.prefix_store, slot, tokens, cached, num_ctx
+            )
+        # The engine always evaluates at least the last prompt token.
+        return slot, max(0, min(cached, len(tokens) - 1))
+
+    def _persist_prefix(
+        self,
+        store: PrefixStore,
+        slot: PrefixCacheEntry,
+        tokens: List[int],
+        cached: int,
+        num_ctx: int,
+    ) -> int:
+        """
+        Snapshots a long prefix `tokens` share with the slot to `store` on disk,
+        or else restores a longer one from it into the slot. Returns the number
+        of prompt tokens the slot now covers.
+        """
+        target = store.target(tokens, cached, num_ctx)
+        if target is not None:
+            path, length = target
+            logger.info(f"model - {self.name} - save prefix")
+            # Written under another name first, so no reader sees part of it
+            partial = store.partial(path)
+            if self.engine.save_prefix(str(partial), slot.state.cache, length):
+                os.replace(partial, path)
+                store.evict()
+
+        found = store.find(tokens, num_ctx, longer_than=cached)
+        if found is None:
+            return cached
+        path, length = found
+        logger.info(f"model - {self.name} - restore prefix")
+        try:
+            cache = self.engine.load_prefix(str(path))
+        except Exception:
+            logger.exception(f"model - {self.name} - restore prefix error")
+            path.unlink(missing_ok=True)
+            return cached
+        slot.state.cache = cache
+        slot.state.tokens = self.engine.token_array(tokens[:length])
+        return length
+
+    def _activate_slot(self, slot: Optional[PrefixCacheEntry]):
+        if slot is not None:
+            self.model.cache_wrapper = slot.state
+
+    def _release_slot(self, slot: Optional[PrefixCacheEntry]):
+        if slot is not None and self.prefix_cache is not None:
+            wrapper = slot.state
+            tokens = wrapper.tokens.tolist() if wrapper.tokens is not None else []
+            self.prefix_cache.release(slot, tokens, _cache_nbytes(wrapper.cache))
+
+
+class ProcessModel(Model):
+    """
+    A model running in its own process, for `MLLAMA_MODEL_PROCESSES`. The
+    server keeps the bookkeeping: admission, the response cache, stats and
+    metrics, and renders chat templates. The process tokenizes and generates.
+
+    If the process exits unexpectedly, its requests fail and the model is
+    unloaded, so the next request for it starts a new process. Speculative
+    decoding needs the draft in the same process, so isn't available.
+    """
+
+    worker: ProcessWorker  # type: ignore[assignment]
+
+    def __init__(
+        self,
+        engine: ModuleType,
+        name: str,
+        path: str,
+        size: int,
+        expiration: datetime,
+    ):
+        self.engine = engine
+        self.name = name
+        self.path = path
+        self.size = size
+        self.cache_size = engine.max_cache_size()
+        self.expiration = expiration
+        self.last_used = datetime.now()
+        self.in_flight = 0
+
+        logger.info(f"model - {name} - load in process")
+
+        self.worker = ProcessWorker(name, path, size, on_exit=self._exited)
+        self.vision = self.worker.info["vision"]
+        self.chat_template = ChatTemplate(SimpleNamespace(**self.worker.info))
+        self.stats = ModelStats()
+
+    @property
+    def resident_size(self) -> int:
+        return self.size + self.worker.kv_nbytes
+
+    async def load_draft(self, options: Dict[str, Any]) -> Optional[Model]:
+        return None
+
+    def _submit(self, method: str, args: Tuple[Any, ...], priority: int) -> Job:
+        return self.worker.submit(method, args, priority)
+
+    def _exited(self):
+        if registry.get(self.name) is self:
+            registry.remove(self.name)
+
+
+def _partial_stop_length(text: str, stop_strings: List[str]) -> int:
+    """The length of the longest suffix of `text` that begins a stop string."""
+    longest = 0
+    for stop in stop_strings:
+        for length in range(min(len(stop) - 1, len(text)), longest, -1):
+            if stop.startswith(text[-length:]):
+                longest = length
+                break
+    return longest
 
 
-cache: Dict[str, Model] = {}
+def _cache_nbytes(cache: List[Any]) -> int:
+    """Measures the memory held by a model's per-layer KV caches."""
+    nbytes = 0
+    for layer in cache:
+        for arrays in (getattr(layer, "keys", None), getattr(layer, "values", None)):
+            if isinstance(arrays, (list, tuple)):
+                nbytes += sum(array.nbytes for array in arrays)
+            elif arrays is not None:
+                nbytes += arrays.nbytes
+    return nbytes
 
 
-def clean_cache():
-    """Periodically checks and removes expired models from the cache."""
-    while True:
-        now = datetime.now()
-        for model in list(cache.values()):
-            if model.expiration < now:
-                Model.unload(model.name)
-        time.sleep(10)  # Run the cleanup every 10 seconds
+registry = ModelRegistry()
 
 
-clean_model_cache_thread = threading.Thread(target=clean_cache, daemon=True)
-clean_model_cache_thread.start()
+def clean_cache(stop: threading.Event):
+    """Periodically removes expired models from the cache until `stop` is set."""
+    # Run the cleanup every 10 seconds
+    while not stop.wait(10):
+        registry.remove_expired()
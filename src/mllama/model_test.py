@@ -0,0 +1,51 @@
+from types import SimpleNamespace
+from typing import Any, List
+import pytest
+from mllama.model import Model
+
+EOS = 5
+# GPT-2 style BPE, where "Ġ" marks a leading space
+VOCAB = {'{"': 0, "The": 1, "Ġsky": 2, "Ġis": 3, "Ġblue": 4, "<|im_end|>": EOS}
+
+
+def detokenize(tokens: List[int], max_tokens: int = 16, stop_strings=()) -> list:
+    tokenizer_utils = pytest.importorskip("mlx_lm.tokenizer_utils")
+    tokenizer = SimpleNamespace(
+        vocab=VOCAB,
+        clean_up_tokenization_spaces=False,
+        added_tokens_decoder={EOS: "<|im_end|>"},
+    )
+    # Only the model kit's tokenizer is used.
+    model: Any = SimpleNamespace(
+        model=SimpleNamespace(
+            tokenizer=SimpleNamespace(
+                detokenizer=tokenizer_utils.BPEStreamingDetokenizer(tokenizer),
+                eos_token_id=EOS,
+            )
+        )
+    )
+    return list(
+        Model._detokenize(
+            model, (token for token in tokens), max_tokens, list(stop_strings)
+        )
+    )
+
+
+def test_detokenize_flushes_last_word_at_eos():
+    results = detokenize([1, 2, 3, 4, EOS])
+
+    assert "".join(text for text, _ in results) == "The sky is blue"
+    assert results[-1][1] == "eos_token"
+
+
+def test_detokenize_flushes_last_word_at_max_tokens():
+    results = detokenize([1, 2, 3, 4], max_tokens=4)
+
+    assert "".join(text for text, _ in results) == "The sky is blue"
+
+
+def test_detokenize_finds_stop_string_in_last_word():
+    results = detokenize([1, 2, 3, 4, EOS], stop_strings=["blue"])
+
+    assert "".join(text for text, _ in results) == "The sky is "
+    assert results[-1][1] == "stop_string"
@@ -0,0 +1,129 @@
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+# Prefixes are indexed at block granularity, so lookups hash each prompt once
+# rather than once per token.
+BLOCK_SIZE = 128
+
+
+def block_hashes(tokens: List[int], block_size: int = BLOCK_SIZE) -> List[int]:
+    """Hashes every whole block of `tokens`, each hash covering the entire prefix up to it."""
+    hashes = []
+    previous = 0
+    for start in range(0, len(tokens) - block_size + 1, block_size):
+        previous = hash((previous, tuple(tokens[start : start + block_size])))
+        hashes.append(previous)
+    return hashes
+
+
+def common_prefix_length(a: List[int], b: List[int]) -> int:
+    length = 0
+    for x, y in zip(a, b):
+        if x != y:
+            break
+        length += 1
+    return length
+
+
+class PrefixCacheEntry:
+    """The KV state of one earlier sequence, along with the tokens it covers."""
+
+    state: Any
+    tokens: List[int]
+    hashes: List[int]
+    nbytes: int
+    in_use: bool
+
+    def __init__(self, state: Any):
+        self.state = state
+        self.tokens = []
+        self.hashes = []
+        self.nbytes = 0
+        self.in_use = False
+
+
+class PrefixCache:
+    """
+    Keeps the KV state of finished sequences so later prompts sharing a prefix
+    with them, such as the next turn of a chat, only need to evaluate the rest.
+
+    The state itself is opaque to the cache. Entries are handed out to one
+    sequence at a time and idle entries are evicted least recently used first
+    once the total size exceeds `max_bytes`.
+    """
+
+    max_bytes: int
+    block_size: int
+    entries: "OrderedDict[int, PrefixCacheEntry]"
+    index: Dict[int, Set[int]]
+
+    def __init__(self, max_bytes: int, block_size: int = BLOCK_SIZE):
+        self.max_bytes = max_bytes
+        self.block_size = block_size
+        self.entries = OrderedDict()
+        self.index = {}
+
+    @property
+    def nbytes(self) -> int:
+        # Copied first since the worker thread may be changing the entries.
+        return sum(entry.nbytes for entry in list(self.entries.values()))
+
+    def add(self, state: Any) -> PrefixCacheEntry:
+        """Adds an empty entry, already in use by the caller."""
+        entry = PrefixCacheEntry(state)
+        entry.in_use = True
+        self.entries[id(entry)] = entry
+        return entry
+
+    def acquire(self, tokens: List[int]) -> Tuple[Optional[PrefixCacheEntry], int]:
+        """
+        Takes the idle entry sharing the longest prefix with `tokens`. Returns the
+        entry, or None if no entry shares a whole block, and the matched length.
+        """
+        hashes = block_hashes(tokens, self.block_size)
+        for i in reversed(range(len(hashes))):
+            candidates = [
+                self.entries[key]
+                for key in self.index.get(hashes[i], ())
+                if not self.entries[key].in_use
+            ]
+            if candidates:
+                entry = max(
+                    candidates,
+                    key=lambda entry: common_prefix_length(entry.tokens, tokens),
+                )
+                entry.in_use = True
+                self.entries.move_to_end(id(entry))
+                return entry, common_prefix_length(entry.tokens, tokens)
+        return None, 0
+
+    def release(self, entry: PrefixCacheEntry, tokens: List[int], nbytes: int):
+        """Returns an entry now holding the KV state for `tokens`, then evicts down to budget."""
+        self._unindex(entry)
+        entry.tokens = tokens
+        entry.hashes = block_hashes(tokens, self.block_size)
+        entry.nbytes = nbytes
+        entry.in_use = False
+        for h in entry.hashes:
+            self.index.setdefault(h, set()).add(id(entry))
+        self.entries.move_to_end(id(entry))
+        self.evict()
+
+    def evict(self, max_bytes: Optional[int] = None):
+        max_bytes = self.max_bytes if max_bytes is None else max_bytes
+        total = self.nbytes
+        for key, entry in list(self.entries.items()):
+            if total <= max_bytes:
+                break
+            if not entry.in_use:
+                self._unindex(entry)
+                del self.entries[key]
+                total -= entry.nbytes
+
+    def _unindex(self, entry: PrefixCacheEntry):
+        for h in entry.hashes:
+            keys = self.index.get(h)
+            if keys is not None:
+                keys.discard(id(entry))
+                if not keys:
+                    del self.index[h]
@@ -0,0 +1,75 @@
+from mllama.prefix_cache import PrefixCache
+
+BLOCK_SIZE = 4
+SYSTEM = list(range(100, 112))
+
+
+def cache_with(*sequences, max_bytes=1000):
+    cache = PrefixCache(max_bytes, block_size=BLOCK_SIZE)
+    entries = []
+    for tokens in sequences:
+        entry = cache.add(state=len(entries))
+        cache.release(entry, tokens, nbytes=10)
+        entries.append(entry)
+    return cache, entries
+
+
+def test_acquire_longest_prefix():
+    cache, entries = cache_with(SYSTEM + [1, 2, 3, 4], SYSTEM[:4] + [9, 9, 9, 9])
+
+    entry, cached = cache.acquire(SYSTEM + [1, 2, 3, 4, 5, 6])
+
+    assert entry is entries[0]
+    assert cached == len(SYSTEM) + 4
+
+
+def test_acquire_matches_beyond_block_boundary():
+    cache, entries = cache_with(SYSTEM + [1, 2, 3])
+
+    entry, cached = cache.acquire(SYSTEM + [1, 2, 7, 8])
+
+    assert entry is entries[0]
+    assert cached == len(SYSTEM) + 2
+
+
+def test_acquire_miss():
+    cache, _ = cache_with(SYSTEM)
+
+    assert cache.acquire([1, 2, 3, 4, 5]) == (None, 0)
+    assert cache.acquire(SYSTEM[:3]) == (None, 0)
+
+
+def test_entries_in_use_are_skipped():
+    cache, entries = cache_with(SYSTEM + [1, 2, 3, 4], SYSTEM)
+
+    first, _ = cache.acquire(SYSTEM + [1, 2, 3, 4])
+    second, cached = cache.acquire(SYSTEM + [1, 2, 3, 4])
+
+    assert first is entries[0]
+    assert second is entries[1]
+    assert cached == len(SYSTEM)
+    assert cache.acquire(SYSTEM) == (None, 0)
+
+
+def test_evicts_least_recently_used():
+    cache, entries = cache_with([1] * 4, [2] * 4, [3] * 4, max_bytes=30)
+
+    entry, _ = cache.acquire([1] * 4)
+    cache.release(entry, [1] * 4, nbytes=10)
+    entry = cache.add(state="new")
+    cache.release(entry, [4] * 4, nbytes=10)
+
+    assert cache.acquire([2] * 4) == (None, 0)
+    assert cache.acquire([1] * 4)[0] is entries[0]
+    assert cache.nbytes == 30
+
+
+def test_entries_in_use_are_not_evicted():
+    cache, entries = cache_with([1] * 4, max_bytes=10)
+
+    entry, _ = cache.acquire([1] * 4)
+    other = cache.add(state="new")
+    cache.release(other, [2] * 4, nbytes=10)
+
+    assert entry is entries[0]
+    assert list(cache.entries.values()) == [entry]
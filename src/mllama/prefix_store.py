@@ -0,0 +1,107 @@
+from array import array
+import hashlib
+import os
+from pathlib import Path
+from typing import Iterator, List, Optional, Tuple
+from mllama.prefix_cache import BLOCK_SIZE
+
+# Marks a file still being written, which eviction leaves alone
+PARTIAL_SUFFIX = ".partial.safetensors"
+
+
+class PrefixStore:
+    """
+    Snapshots of the KV state of long prompt prefixes, such as an agent's
+    system prompt, kept on disk so they outlive restarts and unloads.
+
+    A prefix is snapshotted once a request reuses at least `min_tokens` of it
+    from the prefix cache, so only prefixes that requests share are written.
+    Files are keyed by the model's snapshot, the KV cache size and a hash of
+    the prefix's tokens, at block granularity like the prefix cache. The least
+    recently used are deleted once the files exceed `max_bytes`.
+    """
+
+    directory: Path
+    min_tokens: int
+    max_bytes: int
+    block_size: int
+
+    def __init__(
+        self,
+        directory: str,
+        snapshot: str,
+        min_tokens: int,
+        max_bytes: int,
+        block_size: int = BLOCK_SIZE,
+    ):
+        self.root = Path(directory)
+        self.directory = self.root / snapshot
+        self.min_tokens = max(min_tokens, block_size)
+        self.max_bytes = max_bytes
+        self.block_size = block_size
+
+    def find(
+        self, tokens: List[int], num_ctx: int, longer_than: int = 0
+    ) -> Optional[Tuple[Path, int]]:
+        """The file holding the longest stored prefix of `tokens`, and its length."""
+        for length, path in reversed(list(self._prefixes(tokens, num_ctx))):
+            if length <= longer_than:
+                break
+            if path.exists():
+                # Marks the file as recently used.
+                os.utime(path)
+                return path, length
+        return None
+
+    def target(
+        self, tokens: List[int], length: int, num_ctx: int
+    ) -> Optional[Tuple[Path, int]]:
+        """
+        Where to snapshot the first `length` tokens, cut back to a whole block,
+        and the length to snapshot. None if it's too short or already stored.
+        """
+        length -= length % self.block_size
+        if length < self.min_tokens:
+            return None
+        for prefix_length, path in self._prefixes(tokens[:length], num_ctx):
+            if prefix_length == length:
+                if path.exists():
+                    return None
+                path.parent.mkdir(parents=True, exist_ok=True)
+                return path, length
+        return None
+
+    def partial(self, path: Path) -> Path:
+        """Where this process writes `path` before moving it into place."""
+        return path.with_name(f"{path.stem}.{os.getpid()}{PARTIAL_SUFFIX}")
+
+    def evict(self):
+        """
+        Deletes the least recently used files, across models, down to
+        `max_bytes`. Files still being written, by any process, aren't counted.
+        """
+        files = []
+        for path in self.root.glob("*/*/*.safetensors"):
+            if path.name.endswith(PARTIAL_SUFFIX):
+                continue
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                # Deleted by another process in the meantime
+                continue
+            files.append((stat.st_mtime, stat.st_size, path))
+        total = sum(size for _, size, _ in files)
+        for _, size, path in sorted(files):
+            if total <= self.max_bytes:
+                break
+            path.unlink(missing_ok=True)
+            total -= size
+
+    def _prefixes(self, tokens: List[int], num_ctx: int) -> Iterator[Tuple[int, Path]]:
+        """Each whole-block prefix at least `min_tokens` long, shortest first, with its file."""
+        digest = hashlib.sha256()
+        directory = self.directory / str(num_ctx)
+        for end in range(self.block_size, len(tokens) + 1, self.block_size):
+            digest.update(array("i", tokens[end - self.block_size : end]).tobytes())
+            if end >= self.min_tokens:
+                yield end, directory / f"{digest.hexdigest()}.safetensors"
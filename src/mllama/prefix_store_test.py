@@ -0,0 +1,59 @@
+import os
+from mllama.prefix_store import PrefixStore
+
+TOKENS = list(range(40))
+
+
+def make_store(tmp_path, max_bytes=2**20):
+    return PrefixStore(str(tmp_path), "snapshot", 8, max_bytes, block_size=4)
+
+
+def test_target_is_a_whole_block_prefix(tmp_path):
+    store = make_store(tmp_path)
+
+    assert store.target(TOKENS, 7, 4096) is None
+    path, length = store.target(TOKENS, 19, 4096)
+
+    assert length == 16
+    assert path.parent.is_dir()
+
+
+def test_find_returns_the_longest_stored_prefix(tmp_path):
+    store = make_store(tmp_path)
+    for length in (8, 16):
+        path, _ = store.target(TOKENS, length, 4096)
+        path.write_bytes(b"kv")
+
+    assert store.find(TOKENS, 4096)[1] == 16
+    assert store.find(TOKENS[:12], 4096)[1] == 8
+    assert store.find(TOKENS, 4096, longer_than=16) is None
+    # Stored prefixes aren't targeted again.
+    assert store.target(TOKENS, 16, 4096) is None
+    # Nor found for another KV cache size or different tokens.
+    assert store.find(TOKENS, 2048) is None
+    assert store.find([1] + TOKENS[1:], 4096) is None
+
+
+def test_evict_deletes_least_recently_used(tmp_path):
+    store = make_store(tmp_path, max_bytes=4)
+    paths = []
+    for i, length in enumerate((8, 12, 16)):
+        path, _ = store.target(TOKENS, length, 4096)
+        path.write_bytes(b"kv")
+        os.utime(path, (i, i))
+        paths.append(path)
+
+    store.evict()
+
+    assert [path.exists() for path in paths] == [False, True, True]
+
+
+def test_evict_leaves_files_being_written(tmp_path):
+    store = make_store(tmp_path, max_bytes=0)
+    path, _ = store.target(TOKENS, 8, 4096)
+    partial = store.partial(path)
+    partial.write_bytes(b"kv")
+
+    store.evict()
+
+    assert partial.exists()
@@ -0,0 +1,88 @@
+import asyncio
+from datetime import datetime
+import os
+from pathlib import Path
+from time import time_ns
+from typing import Dict, List
+from mllama import config
+from mllama.events import EndEvent
+from mllama.logger import logger
+from mllama.model import Model, registry
+from mllama.worker import PRIORITIES
+
+# The expiration of preloaded models, far enough ahead never to pass, yet
+# representable in any timezone for /api/ps
+PINNED = datetime(9999, 1, 1)
+
+# Each preloaded model's progress: `loading`, `warming up`, `ready` or `failed`
+status: Dict[str, str] = {}
+
+
+def models() -> List[str]:
+    """The models MLLAMA_PRELOAD lists, in order."""
+    return [
+        name.strip()
+        for name in os.environ.get("MLLAMA_PRELOAD", "").split(",")
+        if name.strip()
+    ]
+
+
+def ready() -> bool:
+    return all(state == "ready" for state in status.values())
+
+
+def start() -> "asyncio.Task[None]":
+    """
+    Starts loading the models in MLLAMA_PRELOAD, which are not ready from this
+    point until they are loaded and warmed up.
+    """
+    names = models()
+    status.update((name, "loading") for name in names)
+    return asyncio.create_task(run(names))
+
+
+async def run(names: List[str]):
+    """
+    Loads models one at a time and keeps them loaded, warming each up with a
+    one-token generation unless MLLAMA_PRELOAD_WARMUP is 0. The warmup puts the
+    system prompt in MLLAMA_PRELOAD_SYSTEM_PROMPT_FILE, if set, in the prefix
+    cache.
+    """
+    for name in names:
+        try:
+            logger.info(f"preload - {name} - load")
+            model = await registry.load(
+                name, lambda: Model.create(name, expiration=PINNED)
+            )
+            # Pinned, even if a request loaded it first
+            model.expiration = PINNED
+            if config.get_int("MLLAMA_PRELOAD_WARMUP", 1):
+                status[name] = "warming up"
+                await warmup(model)
+            status[name] = "ready"
+            logger.info(f"preload - {name} - ready")
+        except Exception:
+            status[name] = "failed"
+            logger.exception(f"preload - {name} - failed")
+
+
+async def warmup(model: Model):
+    """Runs a first forward pass, which compiles the model's kernels."""
+    messages = [{"role": "user", "content": "Hi"}]
+    system_prompt_file = os.environ.get("MLLAMA_PRELOAD_SYSTEM_PROMPT_FILE")
+    if system_prompt_file:
+        system_prompt = Path(system_prompt_file).read_text()
+        messages.insert(0, {"role": "system", "content": system_prompt})
+    events = await model.generate(
+        time_ns(),
+        model.template(messages),
+        {"num_predict": 1},
+        None,
+        "warmup",
+        PRIORITIES["batch"],
+    )
+    async for event in events:
+        if isinstance(event, EndEvent):
+            logger.info(
+                f"preload - {model.name} - warmup took {event.total_duration / 1e6:.0f}ms"
+            )
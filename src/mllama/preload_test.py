@@ -0,0 +1,57 @@
+import time
+from fastapi.testclient import TestClient
+from mllama import preload
+from mllama.main import app
+from mllama.model import Model, registry
+
+SYSTEM_PROMPT = "You are a helpful assistant. " * 8
+
+
+def test_preload(monkeypatch, tmp_path):
+    system_prompt_file = tmp_path / "system.txt"
+    system_prompt_file.write_text(SYSTEM_PROMPT)
+    monkeypatch.setenv("MLLAMA_ENGINE", "stub")
+    monkeypatch.setenv("MLLAMA_PRELOAD", "stub/preload")
+    monkeypatch.setenv("MLLAMA_PRELOAD_SYSTEM_PROMPT_FILE", str(system_prompt_file))
+    monkeypatch.setenv("MLLAMA_STUB_PROMPT_RATE", "1000")
+
+    try:
+        with TestClient(app) as client:
+            statuses = []
+            for _ in range(100):
+                response = client.get("/ready")
+                statuses.append(response.status_code)
+                if response.status_code == 200:
+                    break
+                time.sleep(0.05)
+
+            result = client.post(
+                "/api/chat",
+                json={
+                    "model": "stub/preload",
+                    "messages": [
+                        {"role": "system", "content": SYSTEM_PROMPT},
+                        {"role": "user", "content": "Why is the sky blue?"},
+                    ],
+                    "options": {"max_tokens": 4},
+                    "stream": False,
+                },
+            ).json()
+
+        # Not ready while the warmup evaluates the system prompt
+        assert statuses[0] == 503
+        assert statuses[-1] == 200
+        assert registry.get("stub/preload").expiration == preload.PINNED
+        # The warmup primed the prefix cache with the system prompt.
+        assert result["prompt_cache_count"] >= 128
+    finally:
+        Model.unload("stub/preload")
+        preload.status.clear()
+
+
+def test_ready_without_preload():
+    with TestClient(app) as client:
+        response = client.get("/ready")
+
+    assert response.status_code == 200
+    assert response.json() == {"status": "ready", "models": {}}
@@ -0,0 +1,264 @@
+import asyncio
+from datetime import datetime
+import itertools
+import multiprocessing
+from multiprocessing.connection import Connection
+import threading
+from typing import Any, Callable, Dict, Iterator, Optional, Tuple
+from fastapi import HTTPException
+from mllama.logger import logger
+from mllama.worker import Job
+
+# Yielded ahead of a job's items in the worker process, when the job is admitted
+_ADMITTED = object()
+
+
+class RemoteJob(Job):
+    """A job running in a `ProcessWorker`'s process, streamed back over its pipe."""
+
+    worker: "ProcessWorker"
+    id: int
+
+    def __init__(self, worker: "ProcessWorker", id: int, priority: int):
+        super().__init__(lambda: iter(()), priority)
+        self.worker = worker
+        self.id = id
+
+    def cancel(self):
+        if not self.cancelled.is_set():
+            super().cancel()
+            if self.id in self.worker.jobs:
+                self.worker.send(("cancel", self.id, None))
+
+
+class ProcessWorker:
+    """
+    Runs a model in a child process, so models don't contend for one GIL and a
+    crash in the engine only takes down the model it happened in.
+
+    Jobs name one of the model's blocking methods. The child calls it on its
+    own `InferenceWorker`, which schedules jobs as it does in process, and
+    streams the items back over a pipe. A thread reads the pipe and hands each
+    item to the event loop waiting for it.
+    """
+
+    name: str
+    process: multiprocessing.process.BaseProcess
+    connection: Connection
+    # What the model told the server about itself once loaded
+    info: Dict[str, Any]
+    # Jobs submitted and not yet ended, by id
+    jobs: Dict[int, RemoteJob]
+    # The memory held by the model's KV caches, as of the last job to end
+    kv_nbytes: int
+    stopping: bool
+    # Set once the pipe is closed and the jobs left on it have failed
+    exited: bool
+
+    def __init__(self, name: str, path: str, size: int, on_exit: Callable[[], None]):
+        self.name = name
+        self.on_exit = on_exit
+        self.jobs = {}
+        self.ids = itertools.count()
+        self.lock = threading.Lock()
+        self.kv_nbytes = 0
+        self.stopping = False
+        self.exited = False
+
+        # Forking would copy the server's threads' locks in whatever state
+        # they're in, and Metal doesn't support it.
+        context = multiprocessing.get_context("spawn")
+        self.connection, child = context.Pipe()
+        self.process = context.Process(
+            target=serve,
+            args=(child, name, path, size),
+            name=f"worker - {name}",
+            daemon=True,
+        )
+        self.process.start()
+        child.close()
+
+        try:
+            kind, _, payload = self.connection.recv()
+        except EOFError:
+            self.process.join()
+            raise RuntimeError(
+                f"Model {name} worker exited with code {self.process.exitcode} while loading"
+            )
+        if kind == "error":
+            self.process.join()
+            raise _exception(payload)
+        self.info = payload
+        logger.info(f"worker - {name} - started process {self.process.pid}")
+
+        threading.Thread(target=self.read, name=f"worker - {name}", daemon=True).start()
+
+    def submit(self, method: str, args: Tuple[Any, ...], priority: int = 0) -> Job:
+        """
+        Queues a call to one of the model's methods, which must return an
+        iterator. Once the worker is stopping or its process has exited, the
+        job fails straight away.
+        """
+        with self.lock:
+            job = RemoteJob(self, next(self.ids), priority)
+            if self.stopping or self.exited:
+                job.fail(RuntimeError(f"Model {self.name} was unloaded"))
+                return job
+            self.jobs[job.id] = job
+        # If the pipe has just closed, the reader fails the job.
+        self.send(("submit", job.id, (method, args, priority)))
+        return job
+
+    @property
+    def queue_depth(self) -> int:
+        """Jobs waiting for a free slot."""
+        return sum(1 for job in list(self.jobs.values()) if job.admit_time is None)
+
+    def send(self, message: Tuple[str, Optional[int], Any]):
+        try:
+            with self.lock:
+                self.connection.send(message)
+        except (OSError, ValueError):
+            # The process is gone. The reader fails its jobs.
+            pass
+
+    def stop(self):
+        """Stops the process once the jobs already queued have finished."""
+        with self.lock:
+            self.stopping = True
+        self.send(("stop", None, None))
+
+    def read(self):
+        while True:
+            try:
+                kind, id, payload = self.connection.recv()
+            except (EOFError, OSError):
+                break
+            job = self.jobs.get(id)
+            if job is None:
+                continue
+            if kind == "admit":
+                job.admit_time = payload
+            elif kind == "item":
+                job.put(payload)
+            elif kind == "error":
+                job.put(_exception(payload))
+            elif kind == "end":
+                self.kv_nbytes = payload
+                with self.lock:
+                    self.jobs.pop(id, None)
+                job.finish()
+
+        self.process.join()
+        self.connection.close()
+        with self.lock:
+            jobs = list(self.jobs.values())
+            self.jobs.clear()
+            self.exited = True
+        for job in jobs:
+            job.fail(RuntimeError(f"Model {self.name} worker exited"))
+        if self.stopping:
+            logger.info(f"worker - {self.name} - stop")
+        else:
+            logger.error(
+                f"worker - {self.name} - exited with code {self.process.exitcode}"
+            )
+            self.on_exit()
+
+
+def serve(connection: Connection, name: str, path: str, size: int):
+    """Loads a model and runs the jobs sent over `connection`. The child process's entry point."""
+    asyncio.run(_serve(connection, name, path, size))
+
+
+async def _serve(connection: Connection, name: str, path: str, size: int):
+    # Imported here since the model imports this module
+    from mllama import engines
+    from mllama.model import Model
+
+    try:
+        model = await asyncio.to_thread(
+            Model, engines.get(), name, path, size, datetime.max
+        )
+    except Exception as e:
+        logger.exception(f"worker - {name} - load error")
+        connection.send(("error", None, _error(e)))
+        return
+    tokenizer = model.model.tokenizer
+    connection.send(
+        (
+            "ready",
+            None,
+            {
+                "chat_template": tokenizer.chat_template,
+                "special_tokens_map": dict(tokenizer.special_tokens_map),
+                "vision": model.vision,
+            },
+        )
+    )
+
+    jobs: Dict[int, Job] = {}
+
+    def start(method: str, args: Tuple[Any, ...]) -> Callable[[], Iterator[Any]]:
+        def run() -> Iterator[Any]:
+            yield _ADMITTED
+            # Closing this closes the method's generator, releasing its slot.
+            yield from getattr(model, method)(*args)
+
+        return run
+
+    async def forward(id: int, job: Job):
+        try:
+            async for item in job.events():
+                if item is _ADMITTED:
+                    connection.send(("admit", id, job.admit_time))
+                else:
+                    connection.send(("item", id, item))
+        except Exception as e:
+            connection.send(("error", id, _error(e)))
+        finally:
+            jobs.pop(id, None)
+            connection.send(("end", id, model.resident_size - model.size))
+
+    forwarding = set()
+    stopping = False
+    # Cancellations are still read while the jobs queued before a stop finish.
+    while not stopping or jobs:
+        try:
+            if not await asyncio.to_thread(connection.poll, 0.1):
+                continue
+            kind, id, payload = connection.recv()
+        except EOFError:
+            # The server is gone, so nobody is listening anymore.
+            for job in jobs.values():
+                job.cancel()
+            break
+        if kind == "submit":
+            method, args, priority = payload
+            jobs[id] = model.worker.submit(start(method, args), priority)
+            task = asyncio.create_task(forward(id, jobs[id]))
+            forwarding.add(task)
+            task.add_done_callback(forwarding.discard)
+        elif kind == "cancel" and id in jobs:
+            jobs[id].cancel()
+        elif kind == "stop":
+            stopping = True
+            model.close()
+
+    if not stopping:
+        model.close()
+    await asyncio.gather(*forwarding, return_exceptions=True)
+
+
+def _error(e: Exception) -> Tuple[Any, ...]:
+    """An exception in a form that can be sent between processes."""
+    if isinstance(e, HTTPException):
+        return ("http", e.status_code, e.detail, e.headers)
+    return ("runtime", f"{type(e).__name__}: {e}")
+
+
+def _exception(error: Tuple[Any, ...]) -> Exception:
+    if error[0] == "http":
+        _, status_code, detail, headers = error
+        return HTTPException(status_code=status_code, detail=detail, headers=headers)
+    return RuntimeError(error[1])
@@ -0,0 +1,87 @@
+import asyncio
+import os
+import time
+import pytest
+from fastapi.testclient import TestClient
+from mllama.main import app
+from mllama.model import Model, ProcessModel, registry
+
+CLIENT = TestClient(app)
+
+
+def chat(model: str) -> dict:
+    response = CLIENT.post(
+        "/api/chat",
+        json={
+            "model": model,
+            "messages": [{"role": "user", "content": "Why is the sky blue?"}],
+            "options": {"max_tokens": 4},
+            "stream": False,
+        },
+    )
+    response.raise_for_status()
+    return response.json()
+
+
+def test_model_runs_in_process(monkeypatch):
+    monkeypatch.setenv("MLLAMA_ENGINE", "stub")
+    monkeypatch.setenv("MLLAMA_MODEL_PROCESSES", "1")
+    try:
+        result = chat("stub/process")
+        model = registry.get("stub/process")
+
+        assert result["message"]["content"] == "The sky is blue"
+        assert result["eval_count"] == 4
+        assert isinstance(model, ProcessModel)
+        assert model.worker.process.pid != os.getpid()
+    finally:
+        Model.unload("stub/process")
+
+
+def test_crashed_process_is_restarted(monkeypatch):
+    monkeypatch.setenv("MLLAMA_ENGINE", "stub")
+    monkeypatch.setenv("MLLAMA_MODEL_PROCESSES", "1")
+    try:
+        chat("stub/crash")
+        chat("stub/survivor")
+        crashed = registry.get("stub/crash")
+        survivor = registry.get("stub/survivor")
+
+        crashed.worker.process.kill()
+        for _ in range(100):
+            if registry.get("stub/crash") is None:
+                break
+            time.sleep(0.05)
+
+        # Only the model whose process exited is unloaded.
+        assert registry.get("stub/crash") is None
+        assert registry.get("stub/survivor") is survivor
+        assert chat("stub/survivor")["message"]["content"] == "The sky is blue"
+        # The next request starts a new process.
+        assert chat("stub/crash")["message"]["content"] == "The sky is blue"
+        assert registry.get("stub/crash") is not crashed
+    finally:
+        Model.unload("stub/crash")
+        Model.unload("stub/survivor")
+
+
+def test_job_submitted_after_exit_fails(monkeypatch):
+    monkeypatch.setenv("MLLAMA_ENGINE", "stub")
+    monkeypatch.setenv("MLLAMA_MODEL_PROCESSES", "1")
+    try:
+        chat("stub/exited")
+        worker = registry.get("stub/exited").worker
+        worker.process.kill()
+        for _ in range(100):
+            if worker.exited:
+                break
+            time.sleep(0.05)
+
+        async def submit():
+            job = worker.submit("_embed", (["hi"], 16, True))
+            return [item async for item in job.events()]
+
+        with pytest.raises(RuntimeError, match="unloaded"):
+            asyncio.run(submit())
+    finally:
+        Model.unload("stub/exited")
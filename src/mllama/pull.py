@@ -0,0 +1,174 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+import functools
+import os
+from pathlib import Path
+from typing import Any, AsyncGenerator, Dict, List, Optional
+import huggingface_hub
+from huggingface_hub.file_download import repo_folder_name
+from mllama import config
+from mllama.catalog import catalog
+from mllama.logger import logger
+
+# Seconds between progress events while files download
+PROGRESS_INTERVAL = 0.5
+
+
+class PullFile:
+    """A file in the snapshot being pulled, and the blob it downloads to."""
+
+    name: str
+    # The blob's sha256 if stored with LFS, else its git hash
+    digest: str
+    size: int
+    blob: Path
+
+    def __init__(self, name: str, digest: str, size: int, blobs: Path):
+        self.name = name
+        self.digest = digest
+        self.size = size
+        self.blob = blobs / digest
+
+    @property
+    def completed(self) -> int:
+        """The bytes downloaded so far, read from the blob or its partial file."""
+        for path in (self.blob, self.blob.with_name(f"{self.blob.name}.incomplete")):
+            try:
+                return min(path.stat().st_size, self.size)
+            except FileNotFoundError:
+                pass
+        return 0
+
+
+class Pull:
+    """
+    A model download running in the background, which any number of requests
+    may follow. Files download in parallel, up to MLLAMA_PULL_CONCURRENCY at a
+    time (default: 8). `hf_hub_download` resumes each from its partial file, so
+    pulling again after an interruption or a restart continues where it left off.
+    """
+
+    name: str
+    # The snapshot's files, once its manifest is fetched
+    files: Optional[List[PullFile]]
+    task: "asyncio.Task[None]"
+
+    def __init__(self, name: str):
+        self.name = name
+        self.files = None
+        self.task = asyncio.create_task(self.run())
+
+    async def run(self):
+        # Read at call time, unlike huggingface_hub, so `.env` files are honored.
+        endpoint = os.environ.get("HF_ENDPOINT") or None
+        cache_dir = config.hub_cache()
+
+        logger.info(f"pull - {self.name} - manifest")
+        info = await asyncio.to_thread(
+            huggingface_hub.HfApi(endpoint=endpoint).model_info,
+            self.name,
+            files_metadata=True,
+        )
+        repo = Path(cache_dir) / repo_folder_name(repo_id=self.name, repo_type="model")
+        self.files = [
+            PullFile(
+                sibling.rfilename,
+                (sibling.lfs.sha256 if sibling.lfs else sibling.blob_id) or "",
+                sibling.size or 0,
+                repo / "blobs",
+            )
+            for sibling in info.siblings or []
+        ]
+
+        loop = asyncio.get_running_loop()
+        executor = ThreadPoolExecutor(
+            max_workers=config.get_int("MLLAMA_PULL_CONCURRENCY", 8),
+            thread_name_prefix=f"pull - {self.name}",
+        )
+        try:
+            await asyncio.gather(
+                *(
+                    loop.run_in_executor(
+                        executor,
+                        functools.partial(
+                            huggingface_hub.hf_hub_download,
+                            self.name,
+                            file.name,
+                            revision=info.sha,
+                            cache_dir=cache_dir,
+                            endpoint=endpoint,
+                        ),
+                    )
+                    for file in self.files
+                )
+            )
+        finally:
+            # Downloads still running finish in the background.
+            executor.shutdown(wait=False, cancel_futures=True)
+
+        # Points `main` at the snapshot, as `snapshot_download` does.
+        ref = repo / "refs" / "main"
+        ref.parent.mkdir(parents=True, exist_ok=True)
+        ref.write_text(info.sha)
+        logger.info(f"pull - {self.name} - done")
+        await asyncio.to_thread(catalog().refresh)
+
+    async def events(self) -> AsyncGenerator[Dict[str, Any], None]:
+        """
+        The pull's progress in Ollama's format, from whenever the caller started
+        following it: the completed bytes of each file as they change, then
+        `success` or an `error`.
+        """
+        yield {"status": "pulling manifest"}
+        sent: Dict[str, int] = {}
+        while True:
+            # Checked first, so the progress read after it is final.
+            done = self.task.done()
+            for file in self.files or []:
+                completed = file.completed
+                if sent.get(file.digest) != completed:
+                    sent[file.digest] = completed
+                    yield {
+                        "status": f"pulling {file.digest[:12]}",
+                        "digest": file.digest,
+                        "total": file.size,
+                        "completed": completed,
+                    }
+            if done:
+                break
+            # Waiting doesn't cancel the pull if the caller goes away.
+            await asyncio.wait({self.task}, timeout=PROGRESS_INTERVAL)
+
+        error = None if self.task.cancelled() else self.task.exception()
+        if self.task.cancelled() or error is not None:
+            yield {"error": message(self.name, error)}
+        else:
+            yield {"status": "success"}
+
+
+def message(name: str, error: Optional[BaseException]) -> str:
+    if isinstance(error, huggingface_hub.utils.RepositoryNotFoundError):
+        return f"Model {name} not found"
+    if error is None:
+        return f"Pull of {name} was cancelled"
+    return f"Pull of {name} failed: {error}"
+
+
+# Pulls in progress, by model name
+pulls: Dict[str, Pull] = {}
+
+
+def start(name: str) -> Pull:
+    """Starts pulling a model, or returns the pull of it already in progress."""
+    pull = pulls.get(name)
+    if pull is None:
+        pull = pulls[name] = Pull(name)
+        pull.task.add_done_callback(functools.partial(_finished, name))
+    return pull
+
+
+def _finished(name: str, task: "asyncio.Task[None]"):
+    pulls.pop(name, None)
+    # Retrieved here, since every request following the pull may be gone.
+    if not task.cancelled() and task.exception() is not None:
+        logger.error(f"pull - {name} - {message(name, task.exception())}")
@@ -0,0 +1,183 @@
+import asyncio
+from contextlib import contextmanager
+import hashlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import threading
+from typing import List, Optional, Tuple
+from fastapi.testclient import TestClient
+import pytest
+from mllama import pull
+from mllama.main import app
+
+REVISION = "0123456789abcdef0123456789abcdef01234567"
+FILES = {
+    "config.json": b'{"model_type": "llama"}',
+    "model.safetensors": bytes(range(256)) * 4096,
+}
+
+
+class Hub:
+    """A local stand-in for the Hugging Face Hub, serving one repo."""
+
+    def __init__(self, repo: str):
+        self.repo = repo
+        self.requests: List[Tuple[str, str, Optional[str]]] = []
+        self.release = threading.Event()
+        self.release.set()
+
+    def handler(self):
+        hub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                self.respond(body=True)
+
+            def do_HEAD(self):
+                self.respond(body=False)
+
+            def respond(self, body: bool):
+                hub.requests.append((self.command, self.path, self.headers["Range"]))
+                if self.path.split("?")[0] == f"/api/models/{hub.repo}":
+                    return self.send(200, {}, json.dumps(hub.manifest()).encode())
+                prefix = f"/{hub.repo}/resolve/{REVISION}/"
+                if (
+                    not self.path.startswith(prefix)
+                    or self.path[len(prefix) :] not in FILES
+                ):
+                    return self.send(404, {"X-Error-Code": "RepoNotFound"}, b"")
+                content = FILES[self.path[len(prefix) :]]
+                headers = {
+                    "X-Repo-Commit": REVISION,
+                    "X-Linked-Etag": f'"{hashlib.sha256(content).hexdigest()}"',
+                    "X-Linked-Size": str(len(content)),
+                }
+                if not body:
+                    return self.send(200, headers, b"", len(content))
+                hub.release.wait()
+                start = int((self.headers["Range"] or "bytes=0-")[6:].rstrip("-"))
+                self.send(206 if start else 200, headers, content[start:])
+
+            def send(self, status, headers, content, length=None):
+                self.send_response(status)
+                for name, value in headers.items():
+                    self.send_header(name, value)
+                self.send_header("Content-Length", str(length or len(content)))
+                self.end_headers()
+                if self.command == "GET":
+                    self.wfile.write(content)
+
+        return Handler
+
+    def manifest(self):
+        return {
+            "id": self.repo,
+            "sha": REVISION,
+            "siblings": [
+                {
+                    "rfilename": name,
+                    "size": len(content),
+                    "lfs": {
+                        "size": len(content),
+                        "sha256": hashlib.sha256(content).hexdigest(),
+                        "pointerSize": 134,
+                    },
+                }
+                for name, content in FILES.items()
+            ],
+        }
+
+    def downloads(self):
+        return [path for command, path, _ in self.requests if command == "GET"]
+
+
+@contextmanager
+def hub(monkeypatch, tmp_path, repo="org/model"):
+    stand_in = Hub(repo)
+    server = ThreadingHTTPServer(("127.0.0.1", 0), stand_in.handler())
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    monkeypatch.setenv("HF_ENDPOINT", f"http://127.0.0.1:{server.server_port}")
+    monkeypatch.setenv("HF_HUB_CACHE", str(tmp_path))
+    try:
+        yield stand_in
+    finally:
+        stand_in.release.set()
+        server.shutdown()
+
+
+def test_pull_streams_progress(monkeypatch, tmp_path):
+    with hub(monkeypatch, tmp_path):
+        response = TestClient(app).post("/api/pull", json={"model": "org/model"})
+        events = [json.loads(line) for line in response.text.splitlines()]
+
+    snapshot = tmp_path / "models--org--model" / "snapshots" / REVISION
+    assert events[0] == {"status": "pulling manifest"}
+    assert events[-1] == {"status": "success"}
+    weights = hashlib.sha256(FILES["model.safetensors"]).hexdigest()
+    assert {
+        "status": f"pulling {weights[:12]}",
+        "digest": weights,
+        "total": len(FILES["model.safetensors"]),
+        "completed": len(FILES["model.safetensors"]),
+    } in events
+    for name, content in FILES.items():
+        assert (snapshot / name).read_bytes() == content
+    assert (tmp_path / "models--org--model" / "refs" / "main").read_text() == REVISION
+
+
+def test_pull_resumes_partial_download(monkeypatch, tmp_path):
+    content = FILES["model.safetensors"]
+    blobs = tmp_path / "models--org--model" / "blobs"
+    blobs.mkdir(parents=True)
+    partial = blobs / f"{hashlib.sha256(content).hexdigest()}.incomplete"
+    partial.write_bytes(content[:1000])
+
+    with hub(monkeypatch, tmp_path) as stand_in:
+        response = TestClient(app).post(
+            "/api/pull", json={"model": "org/model", "stream": False}
+        )
+
+    assert response.json() == {"status": "success"}
+    assert (
+        "GET",
+        f"/org/model/resolve/{REVISION}/model.safetensors",
+        "bytes=1000-",
+    ) in (stand_in.requests)
+    snapshot = tmp_path / "models--org--model" / "snapshots" / REVISION
+    assert (snapshot / "model.safetensors").read_bytes() == content
+
+
+@pytest.mark.asyncio
+async def test_concurrent_pulls_are_deduplicated(monkeypatch, tmp_path):
+    with hub(monkeypatch, tmp_path) as stand_in:
+        stand_in.release.clear()
+        first = pull.start("org/model")
+        second = pull.start("org/model")
+        await asyncio.sleep(0.2)
+        stand_in.release.set()
+        await first.task
+
+    assert first is second
+    assert "org/model" not in pull.pulls
+    assert sorted(stand_in.downloads()) == [
+        "/api/models/org/model?blobs=True",
+        f"/org/model/resolve/{REVISION}/config.json",
+        f"/org/model/resolve/{REVISION}/model.safetensors",
+    ]
+
+
+def test_pull_missing_model(monkeypatch, tmp_path):
+    with hub(monkeypatch, tmp_path):
+        client = TestClient(app)
+        response = client.post(
+            "/api/pull", json={"model": "org/missing", "stream": False}
+        )
+        events = client.post("/api/pull", json={"model": "org/missing"}).text
+
+    assert response.status_code == 404
+    assert json.loads(events.splitlines()[-1]) == {
+        "error": "Model org/missing not found"
+    }
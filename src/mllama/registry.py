@@ -0,0 +1,146 @@
+import asyncio
+from contextlib import contextmanager
+from datetime import datetime
+import os
+from pathlib import Path
+import threading
+from typing import TYPE_CHECKING, Callable, Dict, List, Optional
+from fastapi import HTTPException
+from mllama import config
+from mllama.logger import logger
+
+if TYPE_CHECKING:
+    from mllama.model import Model
+
+
+def default_max_memory() -> str:
+    """Leaves a quarter of physical memory for the OS and other processes."""
+    total = os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES")
+    return str(int(total * 0.75))
+
+
+def estimate_size(path: str) -> int:
+    """Estimates the memory a model will occupy from the size of its snapshot's weights."""
+    files = [file for file in Path(path).iterdir() if file.is_file()]
+    weights = [file for file in files if file.suffix == ".safetensors"]
+    # Snapshot files are symlinks into the blob store, which `stat` follows.
+    return sum(file.stat().st_size for file in weights or files)
+
+
+class ModelRegistry:
+    """
+    The loaded models, kept within the `MLLAMA_MAX_MEMORY` budget.
+
+    A model stays loaded at least until its keep_alive expires. After that it
+    may be unloaded to make room for another, least recently used first, but
+    never while it is generating.
+    """
+
+    models: Dict[str, "Model"]
+    # Loads in progress, only accessed from the event loop
+    loading: Dict[str, "asyncio.Future[Model]"]
+    # Memory set aside for loads in progress
+    reserved: Dict[str, int]
+    lock: threading.RLock
+
+    def __init__(self):
+        self.models = {}
+        self.loading = {}
+        self.reserved = {}
+        self.lock = threading.RLock()
+
+    @property
+    def max_memory(self) -> int:
+        return config.get_size("MLLAMA_MAX_MEMORY", default_max_memory())
+
+    @property
+    def used_memory(self) -> int:
+        return sum(model.footprint for model in list(self.models.values())) + sum(
+            self.reserved.values()
+        )
+
+    def get(self, name: str) -> Optional["Model"]:
+        return self.models.get(name)
+
+    async def load(self, name: str, create: Callable[[], "Model"]) -> "Model":
+        """
+        Returns a loaded model, calling `create` on a thread to load and add it
+        if needed. Callers asking for a model that is already loading wait for
+        that load rather than starting another.
+        """
+        model = self.get(name)
+        if model is not None:
+            return model
+
+        future = self.loading.get(name)
+        if future is None:
+            future = asyncio.ensure_future(asyncio.to_thread(create))
+            future.add_done_callback(lambda _: self.loading.pop(name, None))
+            self.loading[name] = future
+
+        # A caller going away must not cancel the load for everyone else.
+        return await asyncio.shield(future)
+
+    @contextmanager
+    def reserve(self, name: str, size: int):
+        """Sets memory aside for a model while it loads, making room first."""
+        with self.lock:
+            self.make_room(name, size)
+            self.reserved[name] = size
+        try:
+            yield
+        finally:
+            with self.lock:
+                self.reserved.pop(name, None)
+
+    def add(self, model: "Model"):
+        with self.lock:
+            self.models[model.name] = model
+
+    def remove(self, name: str) -> Optional["Model"]:
+        with self.lock:
+            model = self.models.pop(name, None)
+        if model is not None:
+            logger.info(f"model - {name} - unload")
+            model.close()
+        return model
+
+    def make_room(self, name: str, size: int):
+        """Unloads evictable models until `size` more bytes fit within the budget."""
+        max_memory = self.max_memory
+        if size > max_memory:
+            raise HTTPException(
+                status_code=507,
+                detail=f"Model {name} needs {size} bytes, more than the {max_memory} byte memory budget",
+            )
+
+        with self.lock:
+            used_memory = self.used_memory
+            for model in self.evictable():
+                if used_memory + size <= max_memory:
+                    break
+                self.remove(model.name)
+                used_memory -= model.footprint
+
+        if used_memory + size > max_memory:
+            raise HTTPException(
+                status_code=503,
+                detail=f"Not enough memory to load model {name}, the loaded models are busy or within their keep_alive",
+            )
+
+    def evictable(self) -> List["Model"]:
+        """Idle models past their keep_alive, least recently used first."""
+        now = datetime.now()
+        return sorted(
+            (
+                model
+                for model in list(self.models.values())
+                if model.in_flight == 0 and model.expiration < now
+            ),
+            key=lambda model: model.last_used,
+        )
+
+    def remove_expired(self):
+        with self.lock:
+            for model in self.evictable():
+                self.remove(model.name)
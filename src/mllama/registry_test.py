@@ -0,0 +1,141 @@
+import asyncio
+from datetime import datetime, timedelta
+import time
+from fastapi import HTTPException
+import pytest
+from mllama.registry import ModelRegistry, estimate_size
+
+GB = 2**30
+
+
+class FakeModel:
+    def __init__(
+        self, name, size, expired=True, in_flight=0, last_used=0, cache_size=0
+    ):
+        now = datetime.now()
+        self.name = name
+        self.size = size
+        self.footprint = size + cache_size
+        self.expiration = now + timedelta(minutes=-1 if expired else 5)
+        self.in_flight = in_flight
+        self.last_used = now + timedelta(seconds=last_used)
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+
+
+@pytest.fixture
+def registry(monkeypatch):
+    monkeypatch.setenv("MLLAMA_MAX_MEMORY", "10GB")
+    return ModelRegistry()
+
+
+def test_estimate_size(tmp_path):
+    (tmp_path / "model-00001-of-00002.safetensors").write_bytes(b"0" * 300)
+    (tmp_path / "model-00002-of-00002.safetensors").write_bytes(b"0" * 200)
+    (tmp_path / "config.json").write_bytes(b"{}")
+
+    assert estimate_size(str(tmp_path)) == 500
+
+
+def test_make_room_evicts_least_recently_used(registry):
+    older = FakeModel("older", 4 * GB, last_used=-10)
+    newer = FakeModel("newer", 4 * GB, last_used=0)
+    registry.add(newer)
+    registry.add(older)
+
+    registry.make_room("next", 4 * GB)
+
+    assert older.closed
+    assert not newer.closed
+    assert list(registry.models) == ["newer"]
+
+
+def test_make_room_counts_cache_sizes(registry):
+    cached = FakeModel("cached", 2 * GB, cache_size=6 * GB)
+    registry.add(cached)
+
+    # The weights alone would leave room.
+    registry.make_room("next", 4 * GB)
+
+    assert cached.closed
+
+
+def test_make_room_keeps_busy_and_unexpired_models(registry):
+    busy = FakeModel("busy", 4 * GB, in_flight=1, last_used=-20)
+    alive = FakeModel("alive", 4 * GB, expired=False, last_used=-10)
+    registry.add(busy)
+    registry.add(alive)
+
+    with pytest.raises(HTTPException) as error:
+        registry.make_room("next", 4 * GB)
+
+    assert error.value.status_code == 503
+    assert not busy.closed
+    assert not alive.closed
+
+
+def test_make_room_rejects_models_larger_than_budget(registry):
+    with pytest.raises(HTTPException) as error:
+        registry.make_room("huge", 11 * GB)
+
+    assert error.value.status_code == 507
+
+
+def test_remove_expired(registry):
+    expired = FakeModel("expired", GB)
+    busy = FakeModel("busy", GB, in_flight=1)
+    alive = FakeModel("alive", GB, expired=False)
+    for model in [expired, busy, alive]:
+        registry.add(model)
+
+    registry.remove_expired()
+
+    assert list(registry.models) == ["busy", "alive"]
+
+
+@pytest.mark.asyncio
+async def test_concurrent_loads_share_one_load(registry):
+    calls = []
+
+    def create():
+        calls.append(None)
+        time.sleep(0.05)
+        model = FakeModel("model", GB, expired=False)
+        registry.add(model)
+        return model
+
+    first, second = await asyncio.gather(
+        registry.load("model", create), registry.load("model", create)
+    )
+
+    assert len(calls) == 1
+    assert first is second
+    assert await registry.load("model", create) is first
+    assert len(calls) == 1
+
+
+@pytest.mark.asyncio
+async def test_failed_load_is_retried(registry):
+    def fail():
+        time.sleep(0.01)
+        raise HTTPException(status_code=404)
+
+    results = await asyncio.gather(
+        registry.load("model", fail),
+        registry.load("model", fail),
+        return_exceptions=True,
+    )
+
+    assert all(isinstance(result, HTTPException) for result in results)
+    assert registry.loading == {}
+
+
+def test_reserve_counts_towards_budget(registry):
+    with registry.reserve("loading", 8 * GB):
+        with pytest.raises(HTTPException) as error:
+            registry.make_room("next", 4 * GB)
+    registry.make_room("next", 4 * GB)
+
+    assert error.value.status_code == 503
@@ -0,0 +1,118 @@
+import hashlib
+import json
+import os
+from typing import Any, Dict, List, Literal, Optional, Sequence
+import diskcache
+from pydantic import BaseModel
+from mllama import config
+from mllama.lru import LRUCache
+from mllama.sampling import SamplingOptions
+
+# Options that don't change what a model generates
+IGNORED_OPTIONS = {"priority", "timeout", "draft_model", "num_draft_tokens"}
+
+
+class CachedResponse(BaseModel):
+    chunks: List[str]
+    done_reason: Optional[str]
+    # All the prompt tokens, whether evaluated or reused from the prefix cache
+    prompt_count: int
+
+    @property
+    def nbytes(self) -> int:
+        return sum(len(chunk) for chunk in self.chunks) + 64
+
+
+class ResponseCache:
+    """
+    Finished responses to deterministic requests, in a memory LRU backed by an
+    optional LRU on disk that persists across restarts.
+    """
+
+    memory: "LRUCache[str, CachedResponse]"
+    disk: Optional[diskcache.Cache]
+
+    def __init__(
+        self, max_bytes: int, directory: Optional[str] = None, disk_bytes: int = 0
+    ):
+        self.memory = LRUCache(max_bytes)
+        self.disk = (
+            diskcache.Cache(
+                directory,
+                size_limit=disk_bytes,
+                eviction_policy="least-recently-used",
+            )
+            if directory
+            else None
+        )
+
+    def get(self, key: str) -> Optional[CachedResponse]:
+        response = self.memory.get(key)
+        if response is None and self.disk is not None:
+            stored = self.disk.get(key)
+            if stored is not None:
+                response = CachedResponse.model_validate(stored)
+                self.memory.put(key, response, response.nbytes)
+        return response
+
+    def put(self, key: str, response: CachedResponse):
+        self.memory.put(key, response, response.nbytes)
+        if self.disk is not None:
+            self.disk.set(key, response.model_dump())
+
+
+_cache: Optional[ResponseCache] = None
+_configured = False
+
+
+def cache() -> Optional[ResponseCache]:
+    """The server's response cache, or None unless MLLAMA_RESPONSE_CACHE_SIZE is set."""
+    global _cache, _configured
+    if not _configured:
+        max_bytes = config.get_size("MLLAMA_RESPONSE_CACHE_SIZE", "0")
+        directory = os.environ.get("MLLAMA_RESPONSE_CACHE_DIR")
+        if max_bytes or directory:
+            _cache = ResponseCache(
+                max_bytes,
+                directory,
+                config.get_size("MLLAMA_RESPONSE_CACHE_DISK_SIZE", "1GB"),
+            )
+        _configured = True
+    return _cache
+
+
+def is_deterministic(
+    sampling: SamplingOptions, format: Literal["json"] | Dict[str, Any] | None
+) -> bool:
+    """Whether a request asks for a reproducible response, so it can be cached."""
+    return sampling.temperature == 0 or sampling.seed is not None or format is not None
+
+
+def cache_key(
+    model: str,
+    digest: str,
+    prompt: Optional[str],
+    options: Dict[str, Any],
+    format: Literal["json"] | Dict[str, Any] | None,
+    images: Sequence[str] = (),
+) -> str:
+    """
+    Identifies a request by everything that affects its response. Images are
+    given by their digests.
+    """
+    text = json.dumps(
+        {
+            "model": model,
+            "digest": digest,
+            "prompt": prompt,
+            "images": list(images),
+            "options": {
+                key: value
+                for key, value in options.items()
+                if key not in IGNORED_OPTIONS
+            },
+            "format": format,
+        },
+        sort_keys=True,
+    )
+    return hashlib.sha256(text.encode()).hexdigest()
@@ -0,0 +1,51 @@
+from mllama.response_cache import (
+    CachedResponse,
+    ResponseCache,
+    cache_key,
+    is_deterministic,
+)
+from mllama.sampling import SamplingOptions
+
+RESPONSE = CachedResponse(
+    chunks=["The", " sky", " is", " blue"], done_reason="stop", prompt_count=12
+)
+
+
+def test_memory():
+    cache = ResponseCache(max_bytes=2**20)
+    cache.put("key", RESPONSE)
+
+    assert cache.get("key") == RESPONSE
+    assert cache.get("other") is None
+
+
+def test_disk_persists(tmp_path):
+    ResponseCache(0, str(tmp_path), disk_bytes=2**20).put("key", RESPONSE)
+
+    cache = ResponseCache(2**20, str(tmp_path), disk_bytes=2**20)
+
+    assert cache.get("key") == RESPONSE
+    # Promoted to memory
+    assert cache.memory.get("key") == RESPONSE
+
+
+def test_is_deterministic():
+    assert is_deterministic(SamplingOptions(temperature=0), None)
+    assert is_deterministic(SamplingOptions(seed=42), None)
+    assert is_deterministic(SamplingOptions(), "json")
+    assert not is_deterministic(SamplingOptions(temperature=0.7), None)
+    # A negative seed samples randomly.
+    assert not is_deterministic(SamplingOptions.parse({"seed": -1}), None)
+
+
+def test_cache_key():
+    key = cache_key("model", "abc", "Why is the sky blue?", {"seed": 1}, None)
+
+    assert key == cache_key(
+        "model", "abc", "Why is the sky blue?", {"seed": 1, "priority": "batch"}, None
+    )
+    assert key != cache_key("model", "abc", "Why is the sky blue?", {"seed": 2}, None)
+    assert key != cache_key("model", "def", "Why is the sky blue?", {"seed": 1}, None)
+    assert key != cache_key(
+        "model", "abc", "Why is the sky blue?", {"seed": 1}, None, ["image"]
+    )
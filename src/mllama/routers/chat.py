@@ -1,13 +1,13 @@
 from datetime import datetime
-import json
 from time import time_ns
 from fastapi import APIRouter, HTTPException
 import fastapi
-from fastapi.responses import StreamingResponse
 from pydantic import BaseModel, Field
 from typing import Annotated, Literal, Optional, List, Dict, Any
 import mllama
+from mllama import metrics, streaming
 import mllama.events
+from mllama.chat_template import with_images
 from mllama.model import Model
 
 
@@ -69,12 +69,24 @@ async def chat(params: Params, request: fastapi.Request):
 
     start_time = time_ns()
 
-    model = Model.load(params.model, params.keep_alive)
-    generator = model.generate(
+    model = await Model.load(params.model, params.keep_alive)
+    generator = await model.generate(
         start_time=start_time,
-        prompt=model.template(conversation=params.messages),
+        prompt=model.template(
+            [with_images(message.model_dump()) for message in params.messages]
+        ),
         options=params.options,
         format=params.format,
+        endpoint="chat",
+        priority=Model.parse_priority(
+            request.headers.get("X-Mllama-Priority") or params.options.get("priority"),
+            default="interactive",
+        ),
+        deadline=Model.parse_deadline(
+            start_time,
+            request.headers.get("X-Mllama-Timeout") or params.options.get("timeout"),
+        ),
+        images=[image for message in params.messages for image in message.images],
     )
 
     def format_end_event(event, response):
@@ -89,48 +101,41 @@ async def chat(params: Params, request: fastapi.Request):
             "done": True,
             "total_duration": event.total_duration,
             "load_duration": event.load_duration,
+            "queue_duration": event.queue_duration,
             "prompt_eval_count": event.prompt_eval_count,
+            "prompt_cache_count": event.prompt_cache_count,
             "prompt_eval_duration": event.prompt_eval_duration,
             "eval_count": event.eval_count,
             "eval_duration": event.eval_duration,
+            "draft_acceptance_rate": event.draft_acceptance_rate,
         }
 
     if params.stream:
-
-        async def streaming_response():
-            async for event in generator:
-                if await request.is_disconnected():
-                    return
-                elif isinstance(event, mllama.events.EndEvent):
-                    yield json.dumps(format_end_event(event, "")) + "\n"
-                elif isinstance(event, mllama.events.ChunkEvent):
-                    yield json.dumps(
-                        {
-                            "model": params.model,
-                            "created_at": datetime.now().isoformat(),
-                            "message": {
-                                "role": "assistant",
-                                "content": event.response,
-                            },
-                            "done": False,
-                        }
-                    ) + "\n"
-                else:
-                    raise ValueError("Unknown event type")
-
-        return StreamingResponse(
-            streaming_response(),
-            headers={
-                "Transfer-Encoding": "chunked",
-                "Content-Type": "application/x-ndjson",
-            },
+        return streaming.ndjson_response(
+            request,
+            generator,
+            envelope=streaming.Envelope(
+                {
+                    "model": params.model,
+                    "created_at": streaming.Envelope.CREATED_AT,
+                    "message": {
+                        "role": "assistant",
+                        "content": streaming.Envelope.TEXT,
+                    },
+                    "done": False,
+                }
+            ),
+            format_end_event=lambda event: format_end_event(event, ""),
+            on_disconnect=lambda: metrics.client_disconnects.inc(params.model, "chat"),
         )
     else:
         full_response = ""
-        async for event in generator:
-            if request is not None and await request.is_disconnected():
-                raise HTTPException(status_code=499, detail="client disconnected")
-            elif isinstance(event, mllama.model.EndEvent):
+        async for event in streaming.until_disconnected(
+            request,
+            generator,
+            on_disconnect=lambda: metrics.client_disconnects.inc(params.model, "chat"),
+        ):
+            if isinstance(event, mllama.events.EndEvent):
                 return format_end_event(event, full_response)
             else:
                 full_response += event.response
@@ -0,0 +1,80 @@
+import asyncio
+from typing import Annotated, Optional
+from fastapi import APIRouter, HTTPException
+from fastapi.responses import StreamingResponse
+from huggingface_hub.utils import HFValidationError, validate_repo_id
+from pydantic import BaseModel, Field
+from mllama import create as creations
+from mllama.streaming import dumps
+
+router = APIRouter()
+
+
+class CreateModelRequest(BaseModel):
+    model: Annotated[str, Field(description="the name of the model to create")]
+    from_: Annotated[
+        Optional[str],
+        Field(alias="from", description="the model to quantize, instead of FROM"),
+    ] = None
+    modelfile: Annotated[
+        Optional[str],
+        Field(description="a Modelfile whose FROM line names the model to quantize"),
+    ] = None
+    path: Annotated[
+        Optional[str],
+        Field(description="the path of a Modelfile within MLLAMA_MODELFILE_DIR"),
+    ] = None
+    quantize: Annotated[
+        Optional[str], Field(description="the quantization type, such as q4_K_M")
+    ] = None
+    group_size: Annotated[
+        int, Field(description="how many weights share a scale and bias")
+    ] = 64
+    stream: bool = True
+
+
+@router.post("/api/create")
+async def create_model(request: CreateModelRequest):
+    """
+    Writes a copy of a model with its weights quantized, which is then pulled
+    like any other model, streaming its progress unless `stream` is false.
+    """
+    try:
+        validate_repo_id(request.model)
+    except HFValidationError as e:
+        raise HTTPException(status_code=400, detail=f"Invalid model name: {e}")
+    if request.quantize is None:
+        raise HTTPException(
+            status_code=400, detail="Invalid quantize: expected a quantization type"
+        )
+    if request.group_size not in (32, 64, 128):
+        raise HTTPException(
+            status_code=400,
+            detail=f"Invalid group_size: {request.group_size}, expected 32, 64 or 128",
+        )
+    bits = creations.parse_bits(request.quantize)
+    source = request.from_
+    if source is None:
+        modelfile = request.modelfile
+        if modelfile is None and request.path is not None:
+            modelfile = creations.read_modelfile(request.path)
+        source = creations.parse_source(modelfile or "")
+
+    creation = creations.start(request.model, source, bits, request.group_size)
+    if request.stream:
+
+        async def body():
+            async for event in creation.events():
+                yield dumps(event) + b"\n"
+
+        return StreamingResponse(
+            body(),
+            headers={
+                "Transfer-Encoding": "chunked",
+                "Content-Type": "application/x-ndjson",
+            },
+        )
+
+    # Shielded, so the model is still created if this request is cancelled.
+    await asyncio.shield(creation.task)
+    return {"status": "success"}
@@ -0,0 +1,74 @@
+from time import time_ns
+from typing import Annotated, Any, Dict, List, Optional
+from fastapi import APIRouter
+import fastapi
+from pydantic import BaseModel, Field
+from mllama.model import Model
+
+
+class Params(BaseModel):
+    model: Annotated[str, Field(description="the model name")]
+    input: Annotated[
+        str | List[str],
+        Field(description="text or list of text to generate embeddings for"),
+    ]
+    truncate: Annotated[
+        bool,
+        Field(
+            description="truncates the end of each input to fit within context length. Returns error if false and context length is exceeded"
+        ),
+    ] = True
+    options: Annotated[
+        Dict[str, Any],
+        Field(
+            description="additional model parameters listed in the documentation for the Modelfile such as temperature"
+        ),
+    ] = {}
+    keep_alive: Annotated[
+        str | int,
+        Field(
+            description="controls how long the model will stay loaded into memory following the request (default: 5m)"
+        ),
+    ] = "5m"
+
+
+class Response(BaseModel):
+    model: str
+    embeddings: List[List[float]]
+
+    # Measured in nanoseconds
+    total_duration: Optional[int]
+
+    # Measured in nanoseconds
+    load_duration: Optional[int]
+    prompt_eval_count: Optional[int]
+
+
+router = APIRouter()
+
+
+@router.post("/api/embed", response_model=Response)
+async def embed(params: Params, request: fastapi.Request):
+    start_time = time_ns()
+
+    model = await Model.load(params.model, params.keep_alive)
+    load_time = time_ns()
+
+    inputs = [params.input] if isinstance(params.input, str) else params.input
+    embeddings, prompt_eval_count = await model.embed(
+        inputs,
+        truncate=params.truncate,
+        options=params.options,
+        priority=Model.parse_priority(
+            request.headers.get("X-Mllama-Priority") or params.options.get("priority"),
+            default="batch",
+        ),
+    )
+
+    return Response(
+        model=params.model,
+        embeddings=embeddings,
+        total_duration=time_ns() - start_time,
+        load_duration=load_time - start_time,
+        prompt_eval_count=prompt_eval_count,
+    )
@@ -0,0 +1,77 @@
+import math
+from fastapi.testclient import TestClient
+from mllama.main import app
+from mllama.routers.embed import Params
+
+MODEL = "Qwen/Qwen2-0.5B"
+CLIENT = TestClient(app)
+
+
+def test_embed():
+    response = CLIENT.post(
+        "/api/embed",
+        json=Params(
+            model=MODEL,
+            input=["Why is the sky blue?", "Why is the grass green?"],
+        ).model_dump(),
+    ).json()
+
+    assert len(response["embeddings"]) == 2
+    for embedding in response["embeddings"]:
+        assert math.isclose(math.sqrt(sum(x * x for x in embedding)), 1, rel_tol=1e-3)
+
+
+def test_embed_batching_matches_single():
+    single = CLIENT.post(
+        "/api/embed",
+        # Not truncating keeps this from sharing a cache entry with the batch.
+        json=Params(
+            model=MODEL, input="Why is the sky blue?", truncate=False
+        ).model_dump(),
+    ).json()
+    batched = CLIENT.post(
+        "/api/embed",
+        json=Params(
+            model=MODEL,
+            input=["Why is the grass green on a sunny day?", "Why is the sky blue?"],
+        ).model_dump(),
+    ).json()
+
+    for a, b in zip(single["embeddings"][0], batched["embeddings"][1]):
+        assert math.isclose(a, b, abs_tol=1e-3)
+
+
+def test_embed_truncate():
+    response = CLIENT.post(
+        "/api/embed",
+        json=Params(
+            model=MODEL,
+            input="Why is the sky blue? " * 100,
+            truncate=False,
+            options={"num_ctx": 16},
+        ).model_dump(),
+    )
+
+    assert response.status_code == 400
+
+
+def test_embed_keep_alive_seconds():
+    response = CLIENT.post(
+        "/api/embed",
+        json=Params(
+            model=MODEL, input="Why is the sky blue?", keep_alive=300
+        ).model_dump(),
+    )
+
+    assert response.status_code == 200
+
+
+def test_embed_invalid_keep_alive():
+    response = CLIENT.post(
+        "/api/embed",
+        json=Params(
+            model=MODEL, input="Why is the sky blue?", keep_alive="soon"
+        ).model_dump(),
+    )
+
+    assert response.status_code == 400
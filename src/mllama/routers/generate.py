@@ -1,12 +1,12 @@
 from datetime import datetime
-import json
 from time import time_ns
 from fastapi import APIRouter, HTTPException
 import fastapi
-from fastapi.responses import StreamingResponse
 from pydantic import BaseModel, Field
 from typing import Annotated, Literal, Optional, List, Dict, Any
 import mllama
+from mllama import metrics, streaming
+from mllama.chat_template import with_images
 from mllama.model import Model
 import mllama.model
 
@@ -103,9 +103,6 @@ async def generate(params: Params, request: fastapi.Request):
     if params.suffix:
         raise HTTPException(status_code=501, detail="'suffix' not implemented")
 
-    if params.images:
-        raise HTTPException(status_code=501, detail="'images' not implemented")
-
     if params.template:
         raise HTTPException(status_code=501, detail="'template' not implemented")
 
@@ -127,7 +124,7 @@ async def generate(params: Params, request: fastapi.Request):
 
     start_time = time_ns()
 
-    model = Model.load(params.model, params.keep_alive)
+    model = await Model.load(params.model, params.keep_alive)
 
     if params.prompt is None:
         return {
@@ -137,11 +134,36 @@ async def generate(params: Params, request: fastapi.Request):
             "done": True,
         }
 
-    generator = model.generate(
+    generator = await model.generate(
         start_time=start_time,
-        prompt=params.prompt,
+        # Images need the chat template's image tokens.
+        prompt=(
+            model.template(
+                [
+                    with_images(
+                        {
+                            "role": "user",
+                            "content": params.prompt,
+                            "images": params.images,
+                        }
+                    )
+                ]
+            )
+            if params.images
+            else params.prompt
+        ),
         options=params.options,
         format=params.format,
+        endpoint="generate",
+        priority=Model.parse_priority(
+            request.headers.get("X-Mllama-Priority") or params.options.get("priority"),
+            default="batch",
+        ),
+        deadline=Model.parse_deadline(
+            start_time,
+            request.headers.get("X-Mllama-Timeout") or params.options.get("timeout"),
+        ),
+        images=params.images or [],
     )
 
     def format_end_event(event):
@@ -152,45 +174,42 @@ async def generate(params: Params, request: fastapi.Request):
             "done": True,
             "total_duration": event.total_duration,
             "load_duration": event.load_duration,
+            "queue_duration": event.queue_duration,
             "prompt_eval_count": event.prompt_eval_count,
+            "prompt_cache_count": event.prompt_cache_count,
             "prompt_eval_duration": event.prompt_eval_duration,
             "eval_count": event.eval_count,
             "eval_duration": event.eval_duration,
+            "draft_acceptance_rate": event.draft_acceptance_rate,
         }
 
     if params.stream:
-
-        async def streaming_response():
-            async for event in generator:
-                if await request.is_disconnected():
-                    return
-                elif isinstance(event, mllama.model.EndEvent):
-                    yield json.dumps(format_end_event(event)) + "\n"
-                elif isinstance(event, mllama.model.ChunkEvent):
-                    yield json.dumps(
-                        {
-                            "model": params.model,
-                            "created_at": datetime.now().isoformat(),
-                            "response": "",
-                            "done": False,
-                        }
-                    ) + "\n"
-                else:
-                    raise ValueError("Unknown event type")
-
-        return StreamingResponse(
-            streaming_response(),
-            headers={
-                "Transfer-Encoding": "chunked",
-                "Content-Type": "application/x-ndjson",
-            },
+        return streaming.ndjson_response(
+            request,
+            generator,
+            envelope=streaming.Envelope(
+                {
+                    "model": params.model,
+                    "created_at": streaming.Envelope.CREATED_AT,
+                    "response": streaming.Envelope.TEXT,
+                    "done": False,
+                }
+            ),
+            format_end_event=format_end_event,
+            on_disconnect=lambda: metrics.client_disconnects.inc(
+                params.model, "generate"
+            ),
         )
     else:
         full_response = ""
-        async for event in generator:
-            if await request.is_disconnected():
-                raise HTTPException(status_code=499, detail="client disconnected")
-            elif isinstance(event, mllama.model.EndEvent):
+        async for event in streaming.until_disconnected(
+            request,
+            generator,
+            on_disconnect=lambda: metrics.client_disconnects.inc(
+                params.model, "generate"
+            ),
+        ):
+            if isinstance(event, mllama.model.EndEvent):
                 return {**format_end_event(event), "response": full_response}
             else:
                 full_response += event.response
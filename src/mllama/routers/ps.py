@@ -0,0 +1,64 @@
+from datetime import datetime
+import os
+from typing import Annotated, List
+from fastapi import APIRouter
+from pydantic import BaseModel, Field
+from mllama.model import registry
+
+router = APIRouter()
+
+
+class RunningModel(BaseModel):
+    name: str
+    model: str
+    size: Annotated[int, Field(description="estimated resident memory in bytes")]
+    size_vram: Annotated[
+        int, Field(description="same as size, since Apple Silicon has unified memory")
+    ]
+    digest: Annotated[str, Field(description="the snapshot's commit hash")]
+    expires_at: str
+    in_flight: Annotated[
+        int, Field(description="generations running or waiting for a slot")
+    ]
+    queue_depth: Annotated[int, Field(description="generations waiting for a slot")]
+    prompt_eval_rate: Annotated[
+        float,
+        Field(description="prompt tokens evaluated per second over the last minute"),
+    ]
+    eval_rate: Annotated[
+        float, Field(description="tokens generated per second over the last minute")
+    ]
+    idle_duration: Annotated[
+        int, Field(description="nanoseconds since the model was last used")
+    ]
+
+
+class Response(BaseModel):
+    models: List[RunningModel]
+
+
+@router.get("/api/ps")
+async def list_running_models():
+    now = datetime.now()
+    return Response(
+        models=[
+            RunningModel(
+                name=model.name,
+                model=model.name,
+                size=model.resident_size,
+                size_vram=model.resident_size,
+                digest=os.path.basename(model.path),
+                expires_at=model.expiration.astimezone().isoformat(),
+                in_flight=model.in_flight,
+                queue_depth=model.worker.queue_depth,
+                prompt_eval_rate=model.stats.prompt_eval.rate(),
+                eval_rate=model.stats.eval.rate(),
+                idle_duration=(
+                    0
+                    if model.in_flight
+                    else int((now - model.last_used).total_seconds() * 1e9)
+                ),
+            )
+            for model in list(registry.models.values())
+        ]
+    )
@@ -0,0 +1,47 @@
+import asyncio
+from typing import Optional
+from fastapi import APIRouter, HTTPException
+from fastapi.responses import StreamingResponse
+import huggingface_hub
+from pydantic import BaseModel
+from mllama import pull as pulls
+from mllama.streaming import dumps
+
+router = APIRouter()
+
+
+class PullRequest(BaseModel):
+    model: str
+    insecure: Optional[bool] = False
+    stream: Optional[bool] = True
+
+
+@router.post("/api/pull")
+async def pull(request: PullRequest):
+    """
+    Downloads a model in the background, deduplicated with any pull of it in
+    progress, streaming its progress unless `stream` is false.
+    """
+    job = pulls.start(request.model)
+    if request.stream:
+
+        async def body():
+            async for event in job.events():
+                yield dumps(event) + b"\n"
+
+        return StreamingResponse(
+            body(),
+            headers={
+                "Transfer-Encoding": "chunked",
+                "Content-Type": "application/x-ndjson",
+            },
+        )
+
+    try:
+        # Shielded, so the pull continues if this request is cancelled.
+        await asyncio.shield(job.task)
+    except huggingface_hub.utils.RepositoryNotFoundError as e:
+        raise HTTPException(status_code=404, detail=pulls.message(request.model, e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=pulls.message(request.model, e))
+    return {"status": "success"}
@@ -0,0 +1,17 @@
+from fastapi import APIRouter
+from fastapi.responses import JSONResponse
+from mllama import preload
+
+router = APIRouter()
+
+
+@router.get("/ready")
+def ready():
+    """Responds with a 503 until the models in MLLAMA_PRELOAD are loaded and warmed up."""
+    return JSONResponse(
+        {
+            "status": "ready" if preload.ready() else "not ready",
+            "models": preload.status,
+        },
+        status_code=200 if preload.ready() else 503,
+    )
@@ -1,7 +1,7 @@
 from typing import List, Optional
 from fastapi import APIRouter
 from pydantic import BaseModel
-import huggingface_hub
+from mllama.catalog import catalog
 
 router = APIRouter()
 
@@ -33,20 +33,20 @@ def tags():
     return Response(
         models=[
             TagInfo(
-                name=f"{repo.repo_id}",
-                model=f"{repo.repo_id}",
-                modified_at="2024-12-07T13:43:12.129079239-08:00",
-                size=repo.size_on_disk,
-                digest="3028237cc8c52fea4e77185d72cc997b2e90392791f7c82fe1c71995d56e642d",
+                name=entry.name,
+                model=entry.name,
+                modified_at=entry.modified_at,
+                size=entry.size,
+                digest=entry.digest,
                 details=TagDetails(
-                    format="gguf",
+                    format=entry.format,
                     parent_model="",
-                    family="TODO",
-                    families=["TODO"],
-                    parameter_size="3B",
-                    quantization_level="TODO",
+                    family=entry.family,
+                    families=entry.families,
+                    parameter_size=entry.parameter_size,
+                    quantization_level=entry.quantization_level,
                 ),
             )
-            for repo in huggingface_hub.scan_cache_dir().repos
+            for entry in catalog().models()
         ]
     )
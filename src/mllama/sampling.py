@@ -0,0 +1,107 @@
+from typing import Any, Dict, Optional, Tuple
+from fastapi import HTTPException
+from pydantic import (
+    BaseModel,
+    ConfigDict,
+    Field,
+    ValidationError,
+    field_validator,
+    model_validator,
+)
+from mllama import config
+
+# The KV cache size for requests that don't set `num_ctx`
+DEFAULT_NUM_CTX = 4096
+# How many tokens to generate for requests that don't set `num_predict`
+DEFAULT_NUM_PREDICT = 1024
+
+
+class SamplingOptions(BaseModel):
+    """
+    The Ollama options that control generation, validated. Options the server
+    doesn't use are ignored, as Ollama does. Frozen so that equal options share
+    the samplers built for them.
+    """
+
+    model_config = ConfigDict(frozen=True, extra="ignore")
+
+    temperature: float = Field(0.7, ge=0)
+    # 0 disables top-k sampling
+    top_k: int = Field(0, ge=0)
+    top_p: float = Field(1.0, gt=0, le=1)
+    min_p: float = Field(0.0, ge=0, le=1)
+    # A negative seed samples randomly
+    seed: Optional[int] = None
+    # -1 generates until the context is full, as does -2
+    num_predict: Optional[int] = Field(None, ge=-2)
+    # Accepted for compatibility with earlier versions, when num_predict is unset
+    max_tokens: Optional[int] = Field(None, ge=1)
+    num_ctx: int = Field(DEFAULT_NUM_CTX, ge=1)
+    stop: Tuple[str, ...] = ()
+    # 1 disables the repetition penalty
+    repeat_penalty: float = Field(1.1, gt=0)
+    # How many recent tokens are penalized. 0 disables the penalty, -1 is num_ctx.
+    repeat_last_n: int = Field(20, ge=-1)
+    # How many tokens a draft model proposes at a time
+    num_draft_tokens: int = Field(
+        default_factory=lambda: config.get_int("MLLAMA_NUM_DRAFT_TOKENS", 4), ge=1
+    )
+
+    @model_validator(mode="before")
+    @classmethod
+    def _skip_nulls(cls, options: Any) -> Any:
+        """Options sent as null are left unset, as Ollama does."""
+        if isinstance(options, dict):
+            return {name: value for name, value in options.items() if value is not None}
+        return options
+
+    @field_validator("seed")
+    @classmethod
+    def _random_seed(cls, seed: Optional[int]) -> Optional[int]:
+        return seed if seed is not None and seed >= 0 else None
+
+    @field_validator("stop", mode="before")
+    @classmethod
+    def _stop_list(cls, stop: Any) -> Any:
+        return (stop,) if isinstance(stop, str) else stop
+
+    @staticmethod
+    def parse(options: Dict[str, Any]) -> "SamplingOptions":
+        """Reads a request's `options`, raising a 400 if any is invalid."""
+        try:
+            return SamplingOptions.model_validate(options)
+        except ValidationError as e:
+            error = e.errors()[0]
+            name = ".".join(str(part) for part in error["loc"])
+            raise HTTPException(
+                status_code=400, detail=f"Invalid option {name}: {error['msg']}"
+            )
+
+    def max_tokens_for(self, prompt_length: int) -> int:
+        """How many tokens to generate after a prompt of `prompt_length` tokens."""
+        count = self.num_predict if self.num_predict is not None else self.max_tokens
+        if count is None:
+            return DEFAULT_NUM_PREDICT
+        if count < 0:
+            return max(1, self.num_ctx - prompt_length)
+        # 0 generates nothing, as Ollama does.
+        return count
+
+    @property
+    def repetition_penalty(self) -> Optional[float]:
+        if self.repeat_penalty == 1 or self.repeat_last_n == 0:
+            return None
+        return self.repeat_penalty
+
+    @property
+    def repetition_context_size(self) -> int:
+        return self.num_ctx if self.repeat_last_n == -1 else self.repeat_last_n
+
+    @property
+    def engine_compatible(self) -> bool:
+        """
+        Whether mlx_engine can sample with these options. It has neither top-k
+        nor min-p, and seeds its global random state, which sequences generated
+        at the same time share.
+        """
+        return self.top_k == 0 and self.min_p == 0 and self.seed is None
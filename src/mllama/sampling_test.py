@@ -0,0 +1,57 @@
+from fastapi import HTTPException
+import pytest
+from mllama.sampling import DEFAULT_NUM_PREDICT, SamplingOptions
+
+
+def test_parse():
+    options = SamplingOptions.parse(
+        {"temperature": 0.2, "top_k": 40, "stop": "\n", "priority": "batch"}
+    )
+
+    assert options.temperature == 0.2
+    assert options.top_k == 40
+    assert options.stop == ("\n",)
+    assert not options.engine_compatible
+    # Equal options share samplers.
+    assert hash(options) == hash(
+        SamplingOptions.parse({"temperature": 0.2, "top_k": 40, "stop": ["\n"]})
+    )
+
+
+def test_parse_skips_nulls():
+    options = SamplingOptions.parse(
+        {"temperature": None, "top_k": None, "stop": None, "num_ctx": 512}
+    )
+
+    assert options == SamplingOptions(num_ctx=512)
+
+
+def test_parse_rejects_invalid():
+    with pytest.raises(HTTPException) as e:
+        SamplingOptions.parse({"top_p": 1.5})
+
+    assert e.value.status_code == 400
+    assert "top_p" in e.value.detail
+
+
+def test_max_tokens():
+    assert SamplingOptions().max_tokens_for(10) == DEFAULT_NUM_PREDICT
+    assert SamplingOptions(num_predict=32, max_tokens=64).max_tokens_for(10) == 32
+    assert SamplingOptions(max_tokens=64).max_tokens_for(10) == 64
+    assert SamplingOptions(num_predict=-1, num_ctx=100).max_tokens_for(10) == 90
+    assert SamplingOptions(num_predict=0).max_tokens_for(10) == 0
+
+
+def test_repetition_penalty():
+    assert SamplingOptions(repeat_penalty=1.0).repetition_penalty is None
+    assert SamplingOptions(repeat_last_n=0).repetition_penalty is None
+    assert SamplingOptions(repeat_last_n=-1, num_ctx=512).repetition_context_size == 512
+
+
+def test_num_draft_tokens(monkeypatch):
+    monkeypatch.setenv("MLLAMA_NUM_DRAFT_TOKENS", "6")
+
+    assert SamplingOptions.parse({}).num_draft_tokens == 6
+    assert SamplingOptions.parse({"num_draft_tokens": 2}).num_draft_tokens == 2
+    with pytest.raises(HTTPException):
+        SamplingOptions.parse({"num_draft_tokens": 0})
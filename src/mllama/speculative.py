@@ -0,0 +1,236 @@
+import random
+from typing import Callable, Generator, List, Optional, Protocol, Sequence, Tuple
+
+
+class Distribution(Protocol):
+    """The target or draft model's next-token distribution after some context."""
+
+    def sample(self) -> int: ...
+
+    def prob(self, token: int) -> float: ...
+
+    def residual(self, draft: "Distribution") -> "Distribution":
+        """The normalized positive part of this distribution minus `draft`'s."""
+        ...
+
+
+class Decoder(Protocol):
+    """A model and its KV cache, which holds `tokens`."""
+
+    tokens: List[int]
+
+    def extend(self, tokens: List[int]):
+        """Appends `tokens` to the cache without computing any distribution."""
+        ...
+
+    def prefill(self, tokens: List[int]) -> Distribution:
+        """Appends `tokens` to the cache and returns the distribution after the last one."""
+        ...
+
+    def forward(self, tokens: List[int]) -> List[Distribution]:
+        """Appends `tokens` to the cache and returns the distribution after each one."""
+        ...
+
+    def trim(self, count: int):
+        """Removes the last `count` tokens from the cache."""
+        ...
+
+
+class SpeculativeDecoder:
+    """
+    Generates from `target`, letting `draft` propose up to `num_draft_tokens`
+    tokens that the target verifies in a single forward pass.
+
+    Each proposed token is accepted with probability min(1, p(x) / q(x)) and the
+    first rejected one is resampled from the residual max(0, p - q), so the output
+    is distributed exactly as if sampled from the target alone. With greedy
+    distributions this reduces to accepting proposals that match the target's
+    argmax, and the output is identical.
+    """
+
+    target: Decoder
+    draft: Decoder
+    num_draft_tokens: int
+    proposed: int
+    accepted: int
+
+    def __init__(
+        self,
+        target: Decoder,
+        draft: Decoder,
+        num_draft_tokens: int,
+        rng: Optional[random.Random] = None,
+    ):
+        self.target = target
+        self.draft = draft
+        self.num_draft_tokens = num_draft_tokens
+        self.rng = rng or random.Random()
+        self.proposed = 0
+        self.accepted = 0
+
+    @property
+    def acceptance_rate(self) -> Optional[float]:
+        return self.accepted / self.proposed if self.proposed else None
+
+    def generate(self, prompt: List[int]) -> Generator[int, None, None]:
+        """
+        Yields tokens following `prompt` until closed. Each decoder's cache must
+        already hold a prefix of `prompt`.
+        """
+        token = self.target.prefill(prompt[len(self.target.tokens) :]).sample()
+        self.draft.prefill(prompt[len(self.draft.tokens) :])
+        # Tokens generated but not yet in the draft's cache
+        pending: List[int] = []
+
+        while True:
+            yield token
+
+            pending.append(token)
+            proposals: List[int] = []
+            draft_distributions: List[Distribution] = []
+            for _ in range(self.num_draft_tokens):
+                distribution = self.draft.forward(pending)[-1]
+                pending = [distribution.sample()]
+                proposals.append(pending[0])
+                draft_distributions.append(distribution)
+
+            target_distributions = self.target.forward([token] + proposals)
+
+            accepted = 0
+            for proposal, p, q in zip(
+                proposals, target_distributions, draft_distributions
+            ):
+                p_prob, q_prob = p.prob(proposal), q.prob(proposal)
+                if p_prob < q_prob and self.rng.random() * q_prob >= p_prob:
+                    break
+                accepted += 1
+
+            self.proposed += len(proposals)
+            self.accepted += accepted
+
+            if accepted < len(proposals):
+                next_token = (
+                    target_distributions[accepted]
+                    .residual(draft_distributions[accepted])
+                    .sample()
+                )
+                # The target saw every proposal and the draft all but the last.
+                self.target.trim(len(proposals) - accepted)
+                self.draft.trim(len(proposals) - 1 - accepted)
+                pending = []
+            else:
+                next_token = target_distributions[-1].sample()
+
+            for proposal in proposals[:accepted]:
+                yield proposal
+            token = next_token
+
+
+class PendingDistribution:
+    """
+    The distribution after a token queued on a `DecodeBatch`, computed along
+    with every other one queued once it is first needed.
+    """
+
+    batch: "DecodeBatch"
+    distribution: Optional[Distribution]
+
+    def __init__(self, batch: "DecodeBatch"):
+        self.batch = batch
+        self.distribution = None
+
+    def resolve(self) -> Distribution:
+        if self.distribution is None:
+            self.batch.run()
+        if self.distribution is None:
+            raise RuntimeError("The batched forward pass failed")
+        return self.distribution
+
+    def sample(self) -> int:
+        return self.resolve().sample()
+
+    def prob(self, token: int) -> float:
+        return self.resolve().prob(token)
+
+    def residual(self, draft: Distribution) -> Distribution:
+        return self.resolve().residual(draft)
+
+
+class DecodeBatch:
+    """
+    Collects the next token of each sequence decoding on one model, so that they
+    all go through a single forward pass once one of them needs its distribution.
+    `forward` appends each token to its decoder's cache and returns the
+    distributions after them. Prompts are evaluated `prefill_size` tokens at a
+    time, between passes.
+    """
+
+    forward: Callable[[List[Decoder], List[int]], Sequence[Distribution]]
+    prefill_size: int
+    # The decoders with a token queued for the next pass
+    entries: List[Tuple[Decoder, int, PendingDistribution]]
+
+    def __init__(
+        self,
+        forward: Callable[[List[Decoder], List[int]], Sequence[Distribution]],
+        prefill_size: int,
+    ):
+        self.forward = forward
+        self.prefill_size = prefill_size
+        self.entries = []
+
+    def add(self, decoder: Decoder, token: int) -> PendingDistribution:
+        """Queues `token` to be appended to `decoder`'s cache on the next pass."""
+        distribution = PendingDistribution(self)
+        self.entries.append((decoder, token, distribution))
+        return distribution
+
+    def run(self):
+        """Runs the queued tokens through one forward pass."""
+        entries, self.entries = self.entries, []
+        if not entries:
+            return
+        distributions = self.forward(
+            [decoder for decoder, _, _ in entries], [token for _, token, _ in entries]
+        )
+        for (_, _, pending), distribution in zip(entries, distributions):
+            pending.distribution = distribution
+
+    def withdraw(self, decoder: Decoder):
+        """Drops `decoder`'s queued token, leaving its cache as it was."""
+        self.entries = [entry for entry in self.entries if entry[0] is not decoder]
+
+
+def decode(
+    decoder: Decoder, prompt: List[int], batch: Optional[DecodeBatch] = None
+) -> Generator[Optional[int], None, None]:
+    """
+    Yields tokens following `prompt`, sampled from `decoder` one at a time until
+    closed. Its cache must already hold a prefix of `prompt`.
+
+    With a `batch`, each token shares its forward pass with the other sequences
+    decoding in it. The prompt is evaluated in chunks, yielding None after each
+    but the last, so that the others keep decoding meanwhile.
+    """
+    tokens = prompt[len(decoder.tokens) :]
+    if batch is None:
+        distribution = decoder.prefill(tokens)
+        while True:
+            token = distribution.sample()
+            yield token
+            distribution = decoder.forward([token])[0]
+
+    try:
+        while len(tokens) > batch.prefill_size:
+            decoder.extend(tokens[: batch.prefill_size])
+            tokens = tokens[batch.prefill_size :]
+            yield None
+        distribution = decoder.prefill(tokens)
+        while True:
+            token = distribution.sample()
+            # Appended to the cache once a sequence in the batch needs its
+            # next distribution, or not at all if this one is closed first.
+            distribution = batch.add(decoder, token)
+            yield token
+    finally:
+        batch.withdraw(decoder)
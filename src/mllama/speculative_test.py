@@ -0,0 +1,223 @@
+from collections import Counter
+import hashlib
+import itertools
+import random
+from typing import Callable, Dict, List
+from mllama.speculative import DecodeBatch, SpeculativeDecoder, decode
+
+VOCAB_SIZE = 8
+
+
+class Greedy:
+    def __init__(self, token: int):
+        self.token = token
+
+    def sample(self) -> int:
+        return self.token
+
+    def prob(self, token: int) -> float:
+        return 1.0 if token == self.token else 0.0
+
+    def residual(self, draft):
+        return self
+
+
+class Categorical:
+    def __init__(self, probs: List[float], rng: random.Random):
+        self.probs = probs
+        self.rng = rng
+
+    def sample(self) -> int:
+        return self.rng.choices(range(len(self.probs)), self.probs)[0]
+
+    def prob(self, token: int) -> float:
+        return self.probs[token]
+
+    def residual(self, draft):
+        residual = [max(0.0, p - q) for p, q in zip(self.probs, draft.probs)]
+        total = sum(residual)
+        if total == 0:
+            return self
+        return Categorical([r / total for r in residual], self.rng)
+
+
+class ToyDecoder:
+    """A 'model' whose next-token distribution is a pure function of the context."""
+
+    def __init__(self, distribution: Callable[[List[int]], object]):
+        self.distribution = distribution
+        self.tokens: List[int] = []
+        self.forward_passes = 0
+
+    def extend(self, tokens):
+        self.forward(tokens)
+
+    def prefill(self, tokens):
+        return self.forward(tokens)[-1]
+
+    def forward(self, tokens):
+        self.forward_passes += 1
+        distributions = []
+        for token in tokens:
+            self.tokens.append(token)
+            distributions.append(self.distribution(list(self.tokens)))
+        return distributions
+
+    def trim(self, count):
+        if count:
+            del self.tokens[-count:]
+
+
+def hashed(context: List[int], salt: str, window: int) -> int:
+    digest = hashlib.sha256(f"{salt}{context[-window:]}".encode()).digest()
+    return digest[0] % VOCAB_SIZE
+
+
+def target_greedy(context):
+    return Greedy(hashed(context, "target", 3))
+
+
+def draft_greedy(context):
+    # Agrees with the target whenever the last token is even.
+    if context[-1] % 2 == 0:
+        return Greedy(hashed(context, "target", 3))
+    return Greedy(hashed(context, "draft", 3))
+
+
+def generate(decoder: ToyDecoder, prompt: List[int], count: int) -> List[int]:
+    distribution = decoder.prefill(prompt)
+    tokens = []
+    for _ in range(count):
+        token = distribution.sample()
+        tokens.append(token)
+        distribution = decoder.forward([token])[-1]
+    return tokens
+
+
+def test_greedy_matches_target():
+    prompt = [1, 2, 3]
+    expected = generate(ToyDecoder(target_greedy), prompt, 50)
+
+    for num_draft_tokens in [1, 2, 4, 8]:
+        target = ToyDecoder(target_greedy)
+        speculative = SpeculativeDecoder(
+            target, ToyDecoder(draft_greedy), num_draft_tokens
+        )
+        tokens = list(itertools.islice(speculative.generate(prompt), 50))
+
+        assert tokens == expected
+        assert 0 < speculative.acceptance_rate < 1
+        assert target.forward_passes < 50
+
+
+def test_identical_draft_accepts_everything():
+    speculative = SpeculativeDecoder(
+        ToyDecoder(target_greedy), ToyDecoder(target_greedy), num_draft_tokens=4
+    )
+    list(itertools.islice(speculative.generate([1, 2, 3]), 50))
+
+    assert speculative.acceptance_rate == 1
+
+
+def test_reuses_cached_prefix():
+    prompt = [1, 2, 3, 4]
+    target = ToyDecoder(target_greedy)
+    target.prefill(prompt[:3])
+    speculative = SpeculativeDecoder(target, ToyDecoder(draft_greedy), 4)
+
+    tokens = list(itertools.islice(speculative.generate(prompt), 20))
+
+    assert tokens == generate(ToyDecoder(target_greedy), prompt, 20)
+
+
+def test_decode_reuses_cached_prefix():
+    prompt = [1, 2, 3, 4]
+    decoder = ToyDecoder(target_greedy)
+    decoder.prefill(prompt[:3])
+
+    tokens = list(itertools.islice(decode(decoder, prompt), 20))
+
+    assert tokens == generate(ToyDecoder(target_greedy), prompt, 20)
+
+
+def toy_batch(passes: List[int], prefill_size: int = 16) -> DecodeBatch:
+    """A batch recording how many sequences go through each forward pass."""
+
+    def forward(decoders, tokens):
+        passes.append(len(decoders))
+        return [decoder.forward([token])[0] for decoder, token in zip(decoders, tokens)]
+
+    return DecodeBatch(forward, prefill_size)
+
+
+def test_batched_decode_shares_forward_passes():
+    passes: List[int] = []
+    batch = toy_batch(passes)
+    prompts = [[1, 2], [3], [4, 5, 6]]
+    sequences = [decode(ToyDecoder(target_greedy), prompt, batch) for prompt in prompts]
+
+    # Stepped in turn, as the worker does
+    tokens = [[next(sequence) for sequence in sequences] for _ in range(20)]
+
+    assert passes == [3] * 19
+    for i, prompt in enumerate(prompts):
+        expected = generate(ToyDecoder(target_greedy), prompt, 20)
+        assert [step[i] for step in tokens] == expected
+
+
+def test_batched_decode_evaluates_prompt_in_chunks():
+    passes: List[int] = []
+    batch = toy_batch(passes, prefill_size=4)
+    decoder = ToyDecoder(target_greedy)
+    sequence = decode(decoder, list(range(10)), batch)
+    expected = generate(ToyDecoder(target_greedy), list(range(10)), 6)
+
+    assert [next(sequence) for _ in range(3)] == [None, None, expected[0]]
+    # Two chunks of four, then the last two tokens for the first distribution
+    assert decoder.forward_passes == 3
+    assert list(itertools.islice(sequence, 5)) == expected[1:]
+
+
+def test_closed_decode_leaves_batch():
+    batch = toy_batch([])
+    decoder = ToyDecoder(target_greedy)
+    sequence = decode(decoder, [1, 2], batch)
+    next(sequence)
+
+    sequence.close()
+
+    assert batch.entries == []
+    # The token that was waiting for the next pass never reached the cache.
+    assert decoder.tokens == [1, 2]
+
+
+def test_sampling_matches_target_distribution():
+    rng = random.Random(0)
+    target_probs: Dict[int, List[float]] = {}
+    draft_probs: Dict[int, List[float]] = {}
+    for last in range(VOCAB_SIZE):
+        weights = [rng.random() for _ in range(VOCAB_SIZE)]
+        target_probs[last] = [w / sum(weights) for w in weights]
+        weights = [rng.random() ** 3 for _ in range(VOCAB_SIZE)]
+        draft_probs[last] = [w / sum(weights) for w in weights]
+
+    samples = 20000
+    counts = Counter()
+    for _ in range(samples):
+        speculative = SpeculativeDecoder(
+            ToyDecoder(lambda context: Categorical(target_probs[context[-1]], rng)),
+            ToyDecoder(lambda context: Categorical(draft_probs[context[-1]], rng)),
+            num_draft_tokens=3,
+            rng=rng,
+        )
+        # Covers a token from the prefill, an accepted proposal or a resample.
+        counts[tuple(itertools.islice(speculative.generate([0]), 3))[2]] += 1
+
+    expected = Counter()
+    for first, p_first in enumerate(target_probs[0]):
+        for second, p_second in enumerate(target_probs[first]):
+            for third, p_third in enumerate(target_probs[second]):
+                expected[third] += p_first * p_second * p_third
+
+    for token in range(VOCAB_SIZE):
+        assert abs(counts[token] / samples - expected[token]) < 0.015
@@ -0,0 +1,34 @@
+import json
+import os
+from pathlib import Path
+import subprocess
+import sys
+
+# Imported when the first model loads, not when the server starts
+HEAVY_MODULES = ["mlx", "mlx_engine", "mlx_lm", "mlx_vlm", "outlines", "transformers"]
+
+PROBE = """
+import json, sys, threading
+import mllama.main
+print(json.dumps({"modules": sorted(sys.modules), "threads": threading.active_count()}))
+"""
+
+
+def test_import_is_light():
+    src = Path(__file__).resolve().parent.parent
+    result = subprocess.run(
+        [sys.executable, "-c", PROBE],
+        capture_output=True,
+        text=True,
+        check=True,
+        env={**os.environ, "PYTHONPATH": str(src)},
+    )
+    imported = json.loads(result.stdout.splitlines()[-1])
+
+    assert [
+        module
+        for module in imported["modules"]
+        if module.split(".")[0] in HEAVY_MODULES
+    ] == []
+    # Background threads start with the app, not on import.
+    assert imported["threads"] == 1
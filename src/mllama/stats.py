@@ -0,0 +1,43 @@
+from collections import deque
+from time import time_ns
+from typing import Deque, Tuple
+
+WINDOW = 60 * 10**9
+
+
+class RollingRate:
+    """Tokens per second across the generations that finished within the last `window` nanoseconds."""
+
+    window: int
+    # (finished at, tokens, duration)
+    samples: Deque[Tuple[int, int, int]]
+
+    def __init__(self, window: int = WINDOW):
+        self.window = window
+        self.samples = deque()
+
+    def record(self, tokens: int, duration: int):
+        now = time_ns()
+        self.samples.append((now, tokens, duration))
+        self._prune(now)
+
+    def rate(self) -> float:
+        self._prune(time_ns())
+        tokens = sum(sample[1] for sample in self.samples)
+        duration = sum(sample[2] for sample in self.samples)
+        return tokens / (duration / 1e9) if duration else 0.0
+
+    def _prune(self, now: int):
+        while self.samples and self.samples[0][0] < now - self.window:
+            self.samples.popleft()
+
+
+class ModelStats:
+    """Live throughput of one loaded model, cheap enough to read on every poll."""
+
+    prompt_eval: RollingRate
+    eval: RollingRate
+
+    def __init__(self):
+        self.prompt_eval = RollingRate()
+        self.eval = RollingRate()
@@ -0,0 +1,20 @@
+from mllama.stats import RollingRate
+
+
+def test_rate():
+    rate = RollingRate()
+    rate.record(tokens=100, duration=10**9)
+    rate.record(tokens=300, duration=10**9)
+
+    assert rate.rate() == 200
+
+
+def test_rate_forgets_old_samples():
+    rate = RollingRate(window=0)
+    rate.record(tokens=100, duration=10**9)
+
+    assert rate.rate() == 0
+
+
+def test_rate_without_samples():
+    assert RollingRate().rate() == 0
@@ -0,0 +1,209 @@
+import asyncio
+import contextlib
+from datetime import datetime
+import importlib
+import json
+import time
+from types import ModuleType
+from typing import Any, AsyncGenerator, Callable, Dict, List, Optional, Tuple
+import fastapi
+from fastapi.responses import StreamingResponse
+from mllama import config
+from mllama.events import ChunkEvent, EndEvent
+
+orjson: Optional[ModuleType]
+try:
+    orjson = importlib.import_module("orjson")
+except ImportError:
+    orjson = None
+
+# Seconds between checks of whether a client has gone away
+DISCONNECT_CHECK_INTERVAL = 0.25
+
+
+def dumps(value: Any) -> bytes:
+    """Serializes `value` as JSON, with orjson when it is installed."""
+    if orjson is not None:
+        return orjson.dumps(value)
+    return json.dumps(value, ensure_ascii=False).encode()
+
+
+class Envelope:
+    """
+    The JSON of a streamed chunk, serialized once per request so each line only
+    encodes its text and timestamp. Fields are given with the `CREATED_AT` and
+    `TEXT` placeholders, in that order, where those values go.
+    """
+
+    CREATED_AT = "\x00created_at\x00"
+    TEXT = "\x00text\x00"
+
+    def __init__(self, fields: Dict[str, Any]):
+        encoded = dumps(fields)
+        self.head, rest = encoded.split(dumps(Envelope.CREATED_AT))
+        self.middle, tail = rest.split(dumps(Envelope.TEXT))
+        self.tail = tail + b"\n"
+
+    def render(self, text: str) -> bytes:
+        created_at = datetime.now().isoformat().encode()
+        return b"".join(
+            (self.head, b'"', created_at, b'"', self.middle, dumps(text), self.tail)
+        )
+
+
+class DisconnectMonitor:
+    """Checks whether a client has disconnected, at most every `interval` seconds."""
+
+    def __init__(
+        self, request: fastapi.Request, interval: float = DISCONNECT_CHECK_INTERVAL
+    ):
+        self.request = request
+        self.interval = interval
+        self.checked_at = float("-inf")
+
+    async def disconnected(self) -> bool:
+        now = time.monotonic()
+        if now - self.checked_at < self.interval:
+            return False
+        self.checked_at = now
+        return await self.request.is_disconnected()
+
+
+async def until_disconnected(
+    request: fastapi.Request,
+    events: AsyncGenerator[ChunkEvent | EndEvent, None],
+    on_disconnect: Callable[[], None],
+    interval: float = DISCONNECT_CHECK_INTERVAL,
+) -> AsyncGenerator[ChunkEvent | EndEvent, None]:
+    """
+    Yields `events` until the client disconnects, then raises a 499. The client
+    is checked on while waiting for each event, so a generation that is queued
+    or evaluating its prompt is cancelled without waiting for its next event.
+    """
+
+    async def wait_for_disconnect():
+        while not await request.is_disconnected():
+            await asyncio.sleep(interval)
+
+    disconnected = asyncio.ensure_future(wait_for_disconnect())
+    try:
+        while True:
+            pending = asyncio.ensure_future(anext(events, None))
+            await asyncio.wait(
+                {pending, disconnected}, return_when=asyncio.FIRST_COMPLETED
+            )
+            if not pending.done():
+                # Cancelling the wait for the next event cancels the generation.
+                pending.cancel()
+                with contextlib.suppress(BaseException):
+                    await pending
+                on_disconnect()
+                raise fastapi.HTTPException(
+                    status_code=499, detail="client disconnected"
+                )
+            event = pending.result()
+            if event is None:
+                return
+            yield event
+    finally:
+        disconnected.cancel()
+        await events.aclose()
+
+
+async def coalesce(
+    events: AsyncGenerator[ChunkEvent | EndEvent, None], window: float
+) -> AsyncGenerator[Tuple[str, Optional[EndEvent]], None]:
+    """
+    Yields the text of each chunk event, joining the chunks that arrive within
+    `window` seconds of the first one not yet yielded. The end event is yielded
+    with any text still pending.
+    """
+    if window <= 0:
+        try:
+            async for event in events:
+                if isinstance(event, EndEvent):
+                    yield "", event
+                else:
+                    yield event.response, None
+        finally:
+            await events.aclose()
+        return
+
+    async def next_event():
+        return await anext(events, None)
+
+    pending: Optional[asyncio.Future] = None
+    texts: List[str] = []
+    flush_at: Optional[float] = None
+    try:
+        while True:
+            if pending is None:
+                pending = asyncio.ensure_future(next_event())
+            timeout = None if flush_at is None else max(0, flush_at - time.monotonic())
+            done, _ = await asyncio.wait({pending}, timeout=timeout)
+            if not done:
+                yield "".join(texts), None
+                texts, flush_at = [], None
+                continue
+
+            event = pending.result()
+            pending = None
+            if event is None:
+                if texts:
+                    yield "".join(texts), None
+                return
+            elif isinstance(event, EndEvent):
+                yield "".join(texts), event
+                return
+            texts.append(event.response)
+            if flush_at is None:
+                flush_at = time.monotonic() + window
+    finally:
+        if pending is not None:
+            pending.cancel()
+            with contextlib.suppress(BaseException):
+                await pending
+        await events.aclose()
+
+
+def ndjson_response(
+    request: fastapi.Request,
+    events: AsyncGenerator[ChunkEvent | EndEvent, None],
+    envelope: Envelope,
+    format_end_event: Callable[[EndEvent], Dict[str, Any]],
+    on_disconnect: Callable[[], None],
+) -> StreamingResponse:
+    """
+    Streams `events` as NDJSON, one line per chunk of text. With
+    MLLAMA_STREAM_COALESCE_MS set, text generated within that many milliseconds
+    is sent as one line.
+    """
+    window = config.get_int("MLLAMA_STREAM_COALESCE_MS", 0) / 1000
+
+    async def body():
+        monitor = DisconnectMonitor(request)
+        chunks = coalesce(events, window)
+        try:
+            async for text, end_event in chunks:
+                if await monitor.disconnected():
+                    on_disconnect()
+                    return
+                if text:
+                    yield envelope.render(text)
+                if end_event is not None:
+                    yield dumps(format_end_event(end_event)) + b"\n"
+        except asyncio.CancelledError:
+            # Starlette cancels the response as soon as the client disconnects.
+            on_disconnect()
+            raise
+        finally:
+            # Closing the events cancels the generation.
+            await chunks.aclose()
+
+    return StreamingResponse(
+        body(),
+        headers={
+            "Transfer-Encoding": "chunked",
+            "Content-Type": "application/x-ndjson",
+        },
+    )
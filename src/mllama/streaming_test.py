@@ -0,0 +1,120 @@
+import asyncio
+import json
+import pytest
+from mllama import streaming
+from mllama.events import ChunkEvent, EndEvent
+from fastapi import HTTPException
+from mllama.streaming import DisconnectMonitor, Envelope, coalesce, until_disconnected
+
+
+async def events(texts, delay=0.0, closed=None):
+    try:
+        for text in texts:
+            await asyncio.sleep(delay)
+            yield ChunkEvent(response=text)
+        yield EndEvent(done_reason="stop")
+    finally:
+        if closed is not None:
+            closed.append(True)
+
+
+@pytest.mark.parametrize("use_orjson", [True, False])
+def test_envelope(monkeypatch, use_orjson):
+    if not use_orjson:
+        monkeypatch.setattr(streaming, "orjson", None)
+    envelope = Envelope(
+        {
+            "model": "test",
+            "created_at": Envelope.CREATED_AT,
+            "message": {"role": "assistant", "content": Envelope.TEXT},
+            "done": False,
+        }
+    )
+
+    line = envelope.render('He said "héllo"\n')
+
+    assert line.endswith(b"\n")
+    chunk = json.loads(line)
+    assert chunk["model"] == "test"
+    assert chunk["message"] == {"role": "assistant", "content": 'He said "héllo"\n'}
+    assert chunk["done"] is False
+    assert chunk["created_at"]
+
+
+@pytest.mark.asyncio
+async def test_no_coalescing():
+    chunks = [chunk async for chunk in coalesce(events(["a", "b", "c"]), 0)]
+
+    assert [text for text, _ in chunks] == ["a", "b", "c", ""]
+    assert chunks[-1][1].done_reason == "stop"
+
+
+@pytest.mark.asyncio
+async def test_coalesces_within_window():
+    chunks = [chunk async for chunk in coalesce(events(["a", "b", "c"]), 10)]
+
+    assert len(chunks) == 1
+    assert chunks[0][0] == "abc"
+    assert chunks[0][1].done_reason == "stop"
+
+
+@pytest.mark.asyncio
+async def test_flushes_after_window():
+    texts = [text async for text, _ in coalesce(events(["a", "b"], delay=0.05), 0.01)]
+
+    # The end event arrives with "b", inside its window.
+    assert texts == ["a", "b"]
+
+
+@pytest.mark.asyncio
+async def test_closing_closes_events():
+    closed = []
+    chunks = coalesce(events(["a", "b"], delay=0.05, closed=closed), 0.01)
+    await anext(chunks)
+    await chunks.aclose()
+
+    assert closed == [True]
+
+
+@pytest.mark.asyncio
+async def test_disconnect_checks_are_rate_limited():
+    class Request:
+        checks = 0
+
+        async def is_disconnected(self):
+            self.checks += 1
+            return False
+
+    request = Request()
+    monitor = DisconnectMonitor(request, interval=60)
+    for _ in range(100):
+        assert not await monitor.disconnected()
+
+    assert request.checks == 1
+
+
+@pytest.mark.asyncio
+async def test_disconnect_cancels_waiting_for_the_next_event():
+    class Request:
+        def __init__(self):
+            self.disconnected_at = asyncio.get_running_loop().time() + 0.05
+
+        async def is_disconnected(self):
+            return asyncio.get_running_loop().time() >= self.disconnected_at
+
+    closed = []
+    disconnects = []
+    # The next event would take far longer than the client stays connected.
+    chunks = until_disconnected(
+        Request(),
+        events(["a", "b"], delay=60, closed=closed),
+        on_disconnect=lambda: disconnects.append(True),
+        interval=0.01,
+    )
+
+    with pytest.raises(HTTPException) as e:
+        await asyncio.wait_for(anext(chunks), 5)
+
+    assert e.value.status_code == 499
+    assert closed == [True]
+    assert disconnects == [True]
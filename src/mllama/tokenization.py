@@ -0,0 +1,82 @@
+from array import array
+import re
+from typing import Any, Callable, List, Optional
+from mllama.logger import logger
+from mllama.lru import LRUCache
+
+# Text between special tokens at least this long, such as a system prompt, has
+# its tokens memoized. Shorter runs are tokenized together in one call.
+MIN_MEMO_LENGTH = 256
+MEMO_SIZE = 256 * 2**20
+
+
+class PromptTokenizer:
+    """
+    Tokenizes prompts, memoizing the tokens of long runs of text between special
+    tokens so a shared system prompt is only tokenized once.
+
+    Tokenizers split text at added tokens before tokenizing each piece on its
+    own, so the pieces can be tokenized separately. `encode` is the reference
+    tokenization, which is used instead if this doesn't reproduce it on `probe`.
+    """
+
+    memoize: bool
+    pattern: Optional[re.Pattern]
+    prefix: List[int]
+    suffix: List[int]
+
+    def __init__(self, tokenizer: Any, encode: Callable[[str], List[int]], probe: str):
+        self.tokenizer = tokenizer
+        self.encode = encode
+        self.memo: LRUCache[str, array] = LRUCache(MEMO_SIZE)
+
+        self.memoize = False
+        try:
+            added = tokenizer.get_added_vocab()
+            tokens = "|".join(
+                re.escape(token) for token in sorted(added, key=len)[::-1]
+            )
+            self.pattern = re.compile(f"({tokens})") if added else None
+
+            # Tokens the tokenizer adds around any text, such as a BOS token
+            bare = tokenizer.encode("a", add_special_tokens=False)
+            full = encode("a")
+            start = next(i for i in range(len(full)) if full[i : i + len(bare)] == bare)
+            self.prefix = full[:start]
+            self.suffix = full[start + len(bare) :]
+            self.memoize = self._tokenize(probe) == encode(probe)
+        except Exception as e:
+            logger.info(f"tokenizer - memoization unavailable - {e!r}")
+            return
+        if not self.memoize:
+            logger.info("tokenizer - memoization unavailable - probe mismatch")
+
+    def tokenize(self, text: str) -> List[int]:
+        if not self.memoize:
+            return self.encode(text)
+        return self._tokenize(text)
+
+    def _tokenize(self, text: str) -> List[int]:
+        tokens = list(self.prefix)
+        pieces = self.pattern.split(text) if self.pattern is not None else [text]
+        run = ""
+        for i, piece in enumerate(pieces):
+            # Odd pieces are the added tokens the text was split at.
+            if i % 2 == 1 or len(piece) < MIN_MEMO_LENGTH:
+                run += piece
+                continue
+            if run:
+                tokens.extend(self.tokenizer.encode(run, add_special_tokens=False))
+                run = ""
+            memoized = self.memo.get(piece)
+            if memoized is None:
+                memoized = array(
+                    "i", self.tokenizer.encode(piece, add_special_tokens=False)
+                )
+                nbytes = len(piece) + memoized.itemsize * len(memoized)
+                self.memo.put(piece, memoized, nbytes)
+            tokens.extend(memoized)
+        if run:
+            tokens.extend(self.tokenizer.encode(run, add_special_tokens=False))
+        tokens.extend(self.suffix)
+        return tokens
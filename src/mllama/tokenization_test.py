@@ -0,0 +1,63 @@
+import re
+from typing import List
+from mllama.tokenization import PromptTokenizer
+
+ADDED = {"<|im_start|>": 1, "<|im_end|>": 2}
+BOS = 0
+SYSTEM_PROMPT = "You are a helpful assistant. " * 20
+PROMPT = (
+    f"<|im_start|>system\n{SYSTEM_PROMPT}<|im_end|>\n"
+    "<|im_start|>user\nWhy is the sky blue?<|im_end|>\n<|im_start|>assistant\n"
+)
+
+
+class FakeTokenizer:
+    """Splits at added tokens, then makes a token of each character."""
+
+    def __init__(self, prefix_space: bool = False):
+        self.prefix_space = prefix_space
+        self.calls: List[str] = []
+
+    def get_added_vocab(self):
+        return ADDED
+
+    def encode(self, text: str, add_special_tokens: bool = True) -> List[int]:
+        self.calls.append(text)
+        tokens = [BOS] if add_special_tokens else []
+        # Like a SentencePiece tokenizer prepending a space to its input
+        if self.prefix_space:
+            text = " " + text
+        for piece in re.split("(<\\|im_start\\|>|<\\|im_end\\|>)", text):
+            if piece in ADDED:
+                tokens.append(ADDED[piece])
+            else:
+                tokens.extend(1000 + ord(c) for c in piece)
+        return tokens
+
+
+def test_matches_reference():
+    tokenizer = FakeTokenizer()
+    prompt_tokenizer = PromptTokenizer(tokenizer, tokenizer.encode, probe=PROMPT)
+
+    assert prompt_tokenizer.memoize
+    assert prompt_tokenizer.tokenize(PROMPT) == tokenizer.encode(PROMPT)
+
+
+def test_memoizes_long_runs():
+    tokenizer = FakeTokenizer()
+    prompt_tokenizer = PromptTokenizer(tokenizer, tokenizer.encode, probe=PROMPT)
+    prompt_tokenizer.tokenize(PROMPT)
+    tokenizer.calls.clear()
+
+    tokens = prompt_tokenizer.tokenize(PROMPT.replace("sky", "sea"))
+
+    assert tokens == tokenizer.encode(PROMPT.replace("sky", "sea"))
+    assert not any(SYSTEM_PROMPT in call for call in tokenizer.calls[:-1])
+
+
+def test_falls_back_to_reference():
+    tokenizer = FakeTokenizer(prefix_space=True)
+    prompt_tokenizer = PromptTokenizer(tokenizer, tokenizer.encode, probe=PROMPT)
+
+    assert not prompt_tokenizer.memoize
+    assert prompt_tokenizer.tokenize(PROMPT) == tokenizer.encode(PROMPT)
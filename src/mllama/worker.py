@@ -0,0 +1,207 @@
+import asyncio
+import itertools
+import queue
+import threading
+from time import time_ns
+from typing import Any, AsyncIterator, Callable, Iterator, List, Optional, Tuple
+from mllama.logger import logger
+
+# Marks the end of a job's results on its queue.
+_END = object()
+
+# Yielded by a job with nothing to hand over yet, such as partway through
+# evaluating a prompt, to let the other jobs step.
+PENDING = object()
+
+# Jobs with a lower priority are admitted first.
+PRIORITIES = {"interactive": 0, "batch": 1}
+
+# The job each worker thread is stepping
+_stepping = threading.local()
+
+
+class Cancelled(Exception):
+    """Raised by a job that noticed it was cancelled partway through a step."""
+
+
+def cancelled() -> bool:
+    """
+    Whether the job the calling worker thread is stepping has been cancelled,
+    so a long step, such as evaluating a prompt, can stop early.
+    """
+    job = getattr(_stepping, "job", None)
+    return job is not None and job.cancelled.is_set()
+
+
+class Job:
+    """A blocking generation running on an `InferenceWorker`, streamed back to the event loop."""
+
+    start: Callable[[], Iterator[Any]]
+    priority: int
+    iterator: Optional[Iterator[Any]]
+    cancelled: threading.Event
+    submit_time: int
+    admit_time: Optional[int]
+    # Set once the event loop has received the job's last item
+    finished: bool
+
+    def __init__(self, start: Callable[[], Iterator[Any]], priority: int = 0):
+        self.start = start
+        self.priority = priority
+        self.iterator = None
+        self.cancelled = threading.Event()
+        self.submit_time = time_ns()
+        self.admit_time = None
+        self.finished = False
+        self.loop = asyncio.get_running_loop()
+        self.queue: asyncio.Queue = asyncio.Queue()
+
+    def cancel(self):
+        """Asks the worker to stop the job before producing its next item."""
+        self.cancelled.set()
+
+    def put(self, item: Any):
+        """Hands an item to the event loop. Called from the worker thread."""
+        try:
+            self.loop.call_soon_threadsafe(self.queue.put_nowait, item)
+        except RuntimeError:
+            # The event loop is gone, so nobody is listening anymore.
+            self.cancel()
+
+    def finish(self):
+        """Marks the end of the job's items. Called from the worker thread."""
+        self.put(_END)
+
+    def fail(self, error: BaseException):
+        """Ends the job with `error` before it produced anything."""
+        self.put(error)
+        self.finish()
+
+    async def events(self) -> AsyncIterator[Any]:
+        while True:
+            item = await self.queue.get()
+            if item is _END:
+                self.finished = True
+                return
+            elif isinstance(item, BaseException):
+                raise item
+            else:
+                yield item
+
+
+class InferenceWorker:
+    """
+    Schedules the blocking generators for one model on a dedicated thread.
+
+    Up to `parallel` jobs are active at once. Each pass of the scheduler advances
+    every active job by one item, so a long generation no longer holds up the
+    requests that arrive after it. New jobs are admitted and finished jobs are
+    retired between passes. Waiting jobs are admitted by priority, then in the
+    order they were submitted.
+    """
+
+    name: str
+    parallel: int
+    # Waiting jobs by (priority, submission order). None stops the worker.
+    jobs: "queue.PriorityQueue[Tuple[float, int, Optional[Job]]]"
+    active: List[Job]
+    thread: threading.Thread
+    # Set by `stop`, after which jobs are no longer accepted
+    stopping: bool
+
+    def __init__(self, name: str, parallel: int = 1):
+        self.name = name
+        self.parallel = parallel
+        self.jobs = queue.PriorityQueue()
+        self.order = itertools.count()
+        self.active = []
+        self.stopping = False
+        self.lock = threading.Lock()
+        self.thread = threading.Thread(
+            target=self.run, name=f"worker - {name}", daemon=True
+        )
+        self.thread.start()
+
+    def submit(self, start: Callable[[], Iterator[Any]], priority: int = 0) -> Job:
+        """
+        Queues a job. `start` is called on the worker thread and must return an
+        iterator. Once the worker is stopping, the job fails straight away.
+        """
+        job = Job(start, priority)
+        with self.lock:
+            if self.stopping:
+                job.fail(RuntimeError(f"Model {self.name} was unloaded"))
+            else:
+                self.jobs.put((priority, next(self.order), job))
+        return job
+
+    @property
+    def queue_depth(self) -> int:
+        """Jobs waiting for a free slot."""
+        return self.jobs.qsize()
+
+    def stop(self):
+        """Stops the worker once the jobs already queued have finished."""
+        with self.lock:
+            if not self.stopping:
+                self.stopping = True
+                self.jobs.put((float("inf"), next(self.order), None))
+
+    def run(self):
+        stopped = False
+        while not stopped or self.active:
+            while not stopped and len(self.active) < self.parallel:
+                try:
+                    # Only block waiting for work when there is nothing to step.
+                    _, _, job = self.jobs.get(block=not self.active)
+                except queue.Empty:
+                    break
+                if job is None:
+                    stopped = True
+                else:
+                    job.admit_time = time_ns()
+                    self.active.append(job)
+
+            for job in list(self.active):
+                if not self.step(job):
+                    self.active.remove(job)
+                    self.retire(job)
+
+        logger.info(f"worker - {self.name} - stop")
+        while not self.jobs.empty():
+            _, _, job = self.jobs.get()
+            if job is not None:
+                job.fail(RuntimeError(f"Model {self.name} was unloaded"))
+
+    def step(self, job: Job) -> bool:
+        """Advances a job by one item, returning False once it is finished."""
+        if job.cancelled.is_set():
+            logger.info(f"worker - {self.name} - cancelled")
+            return False
+        _stepping.job = job
+        try:
+            if job.iterator is None:
+                job.iterator = job.start()
+            item = next(job.iterator)
+        except StopIteration:
+            return False
+        except Cancelled:
+            logger.info(f"worker - {self.name} - cancelled")
+            return False
+        except Exception as e:
+            logger.exception(f"worker - {self.name} - error")
+            job.put(e)
+            return False
+        finally:
+            _stepping.job = None
+        if item is not PENDING:
+            job.put(item)
+        return True
+
+    def retire(self, job: Job):
+        try:
+            close = getattr(job.iterator, "close", None)
+            if close is not None:
+                close()
+        finally:
+            job.finish()
@@ -0,0 +1,193 @@
+import asyncio
+import time
+import pytest
+from mllama.worker import (
+    PENDING,
+    PRIORITIES,
+    Cancelled,
+    InferenceWorker,
+    cancelled,
+)
+
+TOKEN_COUNT = 10
+TOKEN_DELAY = 0.01
+
+
+def stub_generator(produced, count=TOKEN_COUNT, delay=TOKEN_DELAY):
+    for i in range(count):
+        time.sleep(delay)
+        produced.append(i)
+        yield i
+
+
+@pytest.mark.asyncio
+async def test_event_loop_stays_responsive():
+    worker = InferenceWorker("test")
+    ticks = 0
+
+    async def tick():
+        nonlocal ticks
+        while True:
+            ticks += 1
+            await asyncio.sleep(0.001)
+
+    ticker = asyncio.create_task(tick())
+    job = worker.submit(lambda: stub_generator([]))
+    tokens = [token async for token in job.events()]
+    ticker.cancel()
+    worker.stop()
+
+    assert tokens == list(range(TOKEN_COUNT))
+    # The stub blocks for TOKEN_COUNT * TOKEN_DELAY seconds in total, during
+    # which the event loop should have kept ticking.
+    assert ticks > TOKEN_COUNT
+
+
+@pytest.mark.asyncio
+async def test_cancel_stops_generation():
+    worker = InferenceWorker("test")
+    produced = []
+
+    job = worker.submit(lambda: stub_generator(produced, count=1000))
+    async for token in job.events():
+        if token == 2:
+            job.cancel()
+            break
+
+    # Jobs run in order, so once the next job finishes the cancelled one has stopped.
+    next_job = worker.submit(lambda: iter([None]))
+    assert [token async for token in next_job.events()] == [None]
+    worker.stop()
+
+    assert len(produced) < 10
+
+
+@pytest.mark.asyncio
+async def test_job_is_finished_after_its_last_item():
+    worker = InferenceWorker("test")
+
+    job = worker.submit(lambda: iter([1, 2]))
+    assert not job.finished
+    assert [item async for item in job.events()] == [1, 2]
+    worker.stop()
+
+    assert job.finished
+
+
+@pytest.mark.asyncio
+async def test_error_is_raised_to_caller():
+    worker = InferenceWorker("test")
+
+    def failing_generator():
+        yield 0
+        raise ValueError("boom")
+
+    job = worker.submit(failing_generator)
+    tokens = []
+    with pytest.raises(ValueError, match="boom"):
+        async for token in job.events():
+            tokens.append(token)
+    worker.stop()
+
+    assert tokens == [0]
+
+
+@pytest.mark.asyncio
+async def test_job_submitted_after_stop_fails():
+    worker = InferenceWorker("test")
+    worker.stop()
+    worker.thread.join()
+
+    job = worker.submit(lambda: iter([None]))
+    with pytest.raises(RuntimeError, match="unloaded"):
+        async for _ in job.events():
+            pass
+
+
+@pytest.mark.asyncio
+async def test_pending_items_are_not_handed_over():
+    worker = InferenceWorker("test")
+
+    job = worker.submit(lambda: iter([PENDING, PENDING, "token", PENDING]))
+    items = [item async for item in job.events()]
+    worker.stop()
+
+    assert items == ["token"]
+
+
+async def collect(job, order):
+    async for token in job.events():
+        order.append((job, token))
+
+
+@pytest.mark.asyncio
+async def test_parallel_jobs_are_interleaved():
+    worker = InferenceWorker("test", parallel=2)
+    order = []
+
+    first = worker.submit(lambda: stub_generator([]))
+    second = worker.submit(lambda: stub_generator([]))
+    await asyncio.gather(collect(first, order), collect(second, order))
+    worker.stop()
+
+    # The second job starts streaming long before the first one has finished.
+    jobs = [job for job, _ in order]
+    assert jobs.index(second) < TOKEN_COUNT // 2
+
+
+@pytest.mark.asyncio
+async def test_jobs_beyond_parallel_wait_for_a_free_slot():
+    worker = InferenceWorker("test", parallel=1)
+    order = []
+
+    first = worker.submit(lambda: stub_generator([]))
+    second = worker.submit(lambda: stub_generator([]))
+    await asyncio.gather(collect(first, order), collect(second, order))
+    worker.stop()
+
+    assert [job for job, _ in order] == [first] * TOKEN_COUNT + [second] * TOKEN_COUNT
+
+
+@pytest.mark.asyncio
+async def test_waiting_jobs_are_admitted_by_priority():
+    worker = InferenceWorker("test", parallel=1)
+    order = []
+
+    first = worker.submit(lambda: stub_generator([]), PRIORITIES["interactive"])
+    batch = worker.submit(lambda: stub_generator([]), PRIORITIES["batch"])
+    interactive = worker.submit(lambda: stub_generator([]), PRIORITIES["interactive"])
+    await asyncio.gather(
+        collect(first, order), collect(batch, order), collect(interactive, order)
+    )
+    worker.stop()
+
+    jobs = [job for job, _ in order]
+    assert jobs.index(interactive) < jobs.index(batch)
+
+
+@pytest.mark.asyncio
+async def test_long_step_stops_once_cancelled():
+    worker = InferenceWorker("test")
+    started = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    produced = []
+
+    def long_step():
+        # Evaluating a long prompt, one chunk at a time
+        loop.call_soon_threadsafe(started.set)
+        for i in range(1000):
+            if cancelled():
+                raise Cancelled()
+            time.sleep(TOKEN_DELAY)
+            produced.append(i)
+        yield "done"
+
+    job = worker.submit(long_step)
+    await started.wait()
+    job.cancel()
+
+    # Ends without an error, long before the step would have finished.
+    assert [item async for item in job.events()] == []
+    worker.stop()
+
+    assert len(produced) < 100